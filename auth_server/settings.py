@@ -20,11 +20,87 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
 ]
+# Serve the async endpoints in users/async_views.py (run under auth_server.asgi, e.g. the `asgi` compose profile).
+# OAuth2TokenMiddleware is sync-only and would force every request through a thread; DRF views
+# authenticate bearer tokens themselves, so it is dropped in this mode.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+if ASYNC_VIEWS:
+    MIDDLEWARE.remove('oauth2_provider.middleware.OAuth2TokenMiddleware')
+# Prometheus metrics at /metrics (users/metrics.py). Set METRICS_TOKEN to require `Authorization: Bearer <token>`.
+METRICS = {
+    'ENABLED': os.environ.get('METRICS_ENABLED', 'True') == 'True',
+    'AUTH_TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}
+if METRICS['ENABLED']:
+    MIDDLEWARE.insert(0, 'users.metrics.MetricsMiddleware')
 ROOT_URLCONF = 'auth_server.urls'
-TEMPLATES = [{ 'BACKEND': 'django.template.backends.django.DjangoTemplates','DIRS':[BASE_DIR/'templates'],'APP_DIRS':True,'OPTIONS':{'context_processors':['django.template.context_processors.debug','django.template.context_processors.request','django.contrib.auth.context_processors.auth','django.contrib.messages.context_processors.messages']}}]
+# templates/ and app templates are compiled once per process (cached loader), also with DEBUG on
+TEMPLATES = [{ 'BACKEND': 'django.template.backends.django.DjangoTemplates','DIRS':[BASE_DIR/'templates'],'OPTIONS':{'context_processors':['django.template.context_processors.debug','django.template.context_processors.request','django.contrib.auth.context_processors.auth','django.contrib.messages.context_processors.messages'],
+    'loaders':[('django.template.loaders.cached.Loader', ['django.template.loaders.filesystem.Loader','django.template.loaders.app_directories.Loader'])]}}]
 WSGI_APPLICATION = 'auth_server.wsgi.application'
 DATABASES = {'default': {'ENGINE': os.environ.get('DB_ENGINE','django.db.backends.sqlite3'),'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),'USER': os.environ.get('DB_USER',''),'PASSWORD': os.environ.get('DB_PASSWORD',''),'HOST': os.environ.get('DB_HOST',''),'PORT': os.environ.get('DB_PORT',''),}}
+# Persistent connections; health checks drop a dead connection before it is reused.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+# DB_POOL=True: psycopg 3 connection pool (Django >= 5.1, psycopg[pool]); replaces CONN_MAX_AGE.
+if os.environ.get('DB_POOL', 'False') == 'True' and 'postgresql' in DATABASES['default']['ENGINE']:
+    try:
+        import psycopg_pool  # noqa: F401
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }}
+    except ImportError:
+        pass
+# Read replica for the read-only endpoints (users/db_router.py); same settings, different host.
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {**DATABASES['default'], 'HOST': os.environ['DB_REPLICA_HOST'],
+                            'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+                            'TEST': {'MIRROR': 'default'}}
+# TOKEN_SHARD_DBS=a.sqlite3,b.sqlite3 (database NAMEs on the default server): token, grant and OTP rows are
+# spread over them by user id (users/db_router.py); run `migrate --database shard<n>` for each
+TOKEN_SHARDS = []
+for _i, _name in enumerate(n for n in os.environ.get('TOKEN_SHARD_DBS', '').split(',') if n):
+    DATABASES[f'shard{_i}'] = {**DATABASES['default'], 'NAME': _name}
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        # no foreign key enforcement: users and applications are on default
+        DATABASES[f'shard{_i}']['ENGINE'] = 'users.shard_sqlite3'
+    TOKEN_SHARDS.append(f'shard{_i}')
+DATABASE_ROUTERS = ['users.db_router.TokenShardRouter', 'users.db_router.ReadReplicaRouter']
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+if os.environ.get('REDIS_URL'):
+    CACHES['shared'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['REDIS_URL']}
 AUTH_USER_MODEL = 'users.User'
+# Preferred hasher first; existing hashes are upgraded on the next successful login.
+# argon2/bcrypt are used when their packages (argon2-cffi, bcrypt) are installed.
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+try:
+    import bcrypt  # noqa: F401
+    PASSWORD_HASHERS.insert(0, 'django.contrib.auth.hashers.BCryptSHA256PasswordHasher')
+except ImportError:
+    pass
+try:
+    import argon2  # noqa: F401
+    PASSWORD_HASHERS.insert(0, 'django.contrib.auth.hashers.Argon2PasswordHasher')
+except ImportError:
+    pass
+_preferred_hasher = {'argon2': 'Argon2', 'bcrypt': 'BCryptSHA256', 'pbkdf2': 'PBKDF2'}.get(os.environ.get('PASSWORD_HASHER', ''))
+if _preferred_hasher:
+    PASSWORD_HASHERS.sort(key=lambda h: not h.endswith(f'.{_preferred_hasher}PasswordHasher'))
+AUTHENTICATION_BACKENDS = ['users.auth_backends.PooledModelBackend']
+# Password checks off the request thread (users/auth_backends.py). EXECUTOR: thread | process | inline
+PASSWORD_PIPELINE = {
+    'EXECUTOR': os.environ.get('PASSWORD_EXECUTOR', 'thread'),
+    'MAX_WORKERS': int(os.environ.get('PASSWORD_MAX_WORKERS', 4)),
+    'MAX_PENDING': int(os.environ.get('PASSWORD_MAX_PENDING', 64)),
+    'WAIT_SECONDS': float(os.environ.get('PASSWORD_WAIT_SECONDS', 5)),
+    'NEGATIVE_CACHE_SECONDS': int(os.environ.get('PASSWORD_NEGATIVE_CACHE_SECONDS', 60)),
+}
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'oauth2_provider.contrib.rest_framework.OAuth2Authentication',
@@ -33,16 +109,85 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.IsAuthenticated',),
 }
 OAUTH2_PROVIDER = {
-    # 'OAUTH2_VALIDATOR_CLASS': 'otp_grant.oauth2_validators.OTPGrantValidator',
     'OAUTH2_VALIDATOR_CLASS': 'users.oauth_validators.OTPGrantValidator',
     'ACCESS_TOKEN_EXPIRE_SECONDS': int(os.environ.get('ACCESS_TOKEN_EXPIRE_SECONDS', 3600)),
     'REFRESH_TOKEN_EXPIRE_SECONDS': int(os.environ.get('REFRESH_TOKEN_EXPIRE_SECONDS', 60*60*24*14)),
     'AUTHORIZATION_CODE_EXPIRE_SECONDS': int(os.environ.get('AUTHORIZATION_CODE_EXPIRE_SECONDS', 300)),
     'ROTATE_REFRESH_TOKEN': True,
-    'SCOPES': {'read': 'Read', 'write': 'Write'},
+    # concurrent or retried refreshes of the same token get the same new pair within this window
+    'REFRESH_TOKEN_GRACE_PERIOD_SECONDS': int(os.environ.get('REFRESH_TOKEN_GRACE_PERIOD_SECONDS', 10)),
+    'SCOPES': {'read': 'Read', 'write': 'Write', 'openid': 'OpenID Connect', 'profile': 'Profile', 'email': 'Email'},
+    # ID tokens only when a client asks for openid
+    'DEFAULT_SCOPES': ['read', 'write'],
+    # OpenID Connect: ID tokens are signed with the JWT_ACCESS_TOKENS keys (users/jwt_tokens.py)
+    'OIDC_ENABLED': os.environ.get('OIDC_ENABLED', 'True') == 'True',
+    # oauthlib servers with grant_type=otp registered (otp_grant/server.py); set explicitly, this also replaces OIDC_SERVER_CLASS
+    'OAUTH2_SERVER_CLASS': 'otp_grant.server.OIDCServer' if os.environ.get('OIDC_ENABLED', 'True') == 'True'
+                           else 'otp_grant.server.Server',
+    'OIDC_ISS_ENDPOINT': os.environ.get('JWT_ISSUER', 'http://localhost:8000'),
+    'OIDC_JWKS_MAX_AGE_SECONDS': int(os.environ.get('OIDC_JWKS_MAX_AGE_SECONDS', 3600)),
+    # repeat logins skip the consent page once the scopes were approved (users/consent.py); 'force' always asks
+    'REQUEST_APPROVAL_PROMPT': os.environ.get('REQUEST_APPROVAL_PROMPT', 'auto'),
     'OAUTH2_BACKEND_CLASS': 'oauth2_provider.oauth2_backends.OAuthLibCore',
     'ALLOWED_REDIRECT_URI_SCHEMES': ['http','https'],
     'ERROR_RESPONSE_WITH_SCOPES': False,
+    # JWT for applications listed in JWT_ACCESS_TOKENS['CLIENT_IDS'], opaque for the rest
+    'ACCESS_TOKEN_GENERATOR': 'users.jwt_tokens.access_token_generator',
+    # opaque tokens carry their token shard (users/db_router.py) as a prefix
+    'REFRESH_TOKEN_GENERATOR': 'users.jwt_tokens.refresh_token_generator',
+}
+# Signed JWT access tokens (users/jwt_tokens.py); keys are created with `manage.py rotate_jwt_key`
+JWT_ACCESS_TOKENS = {
+    'CLIENT_IDS': [c for c in os.environ.get('JWT_CLIENT_IDS', '').split(',') if c],
+    'KEYS_DIR': os.environ.get('JWT_KEYS_DIR', BASE_DIR / 'keys'),
+    'ACTIVE_KID': os.environ.get('JWT_ACTIVE_KID') or None,
+    'ISSUER': os.environ.get('JWT_ISSUER', 'http://localhost:8000'),
+}
+# Access-token validation cache (users/token_cache.py). TTL is also capped by each token's expiry.
+# A worker keeps its own copy for LOCAL_TTL_SECONDS: that is how long other workers may still accept a revoked token.
+TOKEN_CACHE = {
+    'MAX_ENTRIES': int(os.environ.get('TOKEN_CACHE_MAX_ENTRIES', 10000)),
+    'TTL_SECONDS': int(os.environ.get('TOKEN_CACHE_TTL_SECONDS', 300)),
+    'LOCAL_TTL_SECONDS': float(os.environ.get('TOKEN_CACHE_LOCAL_TTL_SECONDS', 2)),
+    'SHARED_CACHE_ALIAS': 'shared' if 'shared' in CACHES else None,
+}
+# Per-user claims for /api/userinfo/ and /api/profile/ (users/claims.py), dropped by User/group signals.
+# Without REDIS_URL a signal only reaches its own worker: the TTL bounds how long the others serve old claims
+USER_CLAIMS = {
+    'TTL_SECONDS': int(os.environ.get('USER_CLAIMS_TTL_SECONDS', 300 if 'shared' in CACHES else 2)),
+    'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+}
+# Authorization codes (users/grant_store.py). CacheGrantStore needs a cache shared by all workers (REDIS_URL).
+GRANT_STORE = {
+    'STORE': os.environ.get('GRANT_STORE', 'users.grant_store.CacheGrantStore' if 'shared' in CACHES
+                            else 'users.grant_store.DatabaseGrantStore'),
+    'TTL_SECONDS': OAUTH2_PROVIDER['AUTHORIZATION_CODE_EXPIRE_SECONDS'],
+    'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+}
+# Token pair writes (users/token_minting.py). GROUP_COMMIT batches concurrent logins into one transaction.
+TOKEN_MINTING = {
+    'GROUP_COMMIT': os.environ.get('TOKEN_GROUP_COMMIT', 'False') == 'True',
+    'GROUP_COMMIT_WINDOW_MS': float(os.environ.get('TOKEN_GROUP_COMMIT_WINDOW_MS', 5)),
+    'GROUP_COMMIT_MAX_BATCH': int(os.environ.get('TOKEN_GROUP_COMMIT_MAX_BATCH', 100)),
+}
+# One-time codes (otp_grant/backends.py). CacheOTPStore needs a cache shared by all workers (REDIS_URL).
+OTP = {
+    'STORE': os.environ.get('OTP_STORE', 'otp_grant.backends.DatabaseOTPStore'),
+    'TTL_SECONDS': int(os.environ.get('OTP_TTL_SECONDS', 300)),
+    'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+}
+# Expired row cleanup (users/purge.py, `manage.py purge_expired`); set PURGE_SCHEDULE_SECONDS to also run in-process
+PURGE = {
+    'BATCH_SIZE': int(os.environ.get('PURGE_BATCH_SIZE', 1000)),
+    'SLEEP_SECONDS': float(os.environ.get('PURGE_SLEEP_SECONDS', 0)),
+    'SCHEDULE_SECONDS': int(os.environ.get('PURGE_SCHEDULE_SECONDS', 0)),
+    'LOCK_CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+}
+# Batch token introspection at /o/introspect/ (users/introspection.py)
+INTROSPECTION = {
+    'MAX_BATCH': int(os.environ.get('INTROSPECTION_MAX_BATCH', 1000)),
+    'MAX_CACHE_SECONDS': int(os.environ.get('INTROSPECTION_MAX_CACHE_SECONDS', 60)),
+    'CLIENT_AUTH_CACHE_SECONDS': 60,
 }
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS','http://localhost:3000').split(',')
 CORS_ALLOW_CREDENTIALS = True
@@ -59,6 +204,25 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
 ]
+# cached_db reads sessions from the cache and writes through to the table; SESSION_BACKEND=cache skips the table.
+# Both only with REDIS_URL: in a per-worker cache, a logout would only end the session on the worker that served it
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + os.environ.get(
+    'SESSION_BACKEND', 'cached_db' if 'shared' in CACHES else 'db')
+SESSION_CACHE_ALIAS = 'shared' if 'shared' in CACHES else 'default'
+# Revoked access tokens for resource servers at /api/revocations/ (users/revocation_feed.py). With it, they can cache
+# introspection results for the token lifetime: raise INTROSPECTION_MAX_CACHE_SECONDS to ACCESS_TOKEN_EXPIRE_SECONDS
+REVOCATION_FEED = {
+    'PAGE_SIZE': int(os.environ.get('REVOCATION_FEED_PAGE_SIZE', 500)),
+    'MAX_WAIT_SECONDS': int(os.environ.get('REVOCATION_FEED_MAX_WAIT_SECONDS', 30)),
+    'POLL_INTERVAL_SECONDS': 1,
+    'STREAM_SECONDS': int(os.environ.get('REVOCATION_FEED_STREAM_SECONDS', 300)),
+}
+# Approved (user, application, scopes) for /o/authorize/ (users/consent.py); 0 turns it off. Off by default without
+# REDIS_URL: revoking a user's tokens could only forget their consents on the worker that did it
+CONSENT = {
+    'TTL_SECONDS': int(os.environ.get('CONSENT_TTL_SECONDS', 60*60*24*30 if 'shared' in CACHES else 0)),
+    'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+}
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SECURE = os.environ.get('SESSION_COOKIE_SECURE','False')=='True'
 CSRF_COOKIE_SECURE = os.environ.get('CSRF_COOKIE_SECURE','False')=='True'
@@ -67,6 +231,8 @@ SECURE_SSL_REDIRECT = os.environ.get('SECURE_SSL_REDIRECT','False')=='True'
 CSRF_TRUSTED_ORIGINS = ['http://localhost:3000', 'http://127.0.0.1:3000']
 STATIC_URL = '/static/'
 
+# INFO by default: at DEBUG the oauthlib/DOT records alone cost noticeable throughput.
+OAUTH_LOG_LEVEL = os.environ.get('OAUTH_LOG_LEVEL', 'INFO')
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -76,11 +242,23 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        # DEBUG from the OAuth libraries is very chatty; keep a sample of it
+        'sample_debug': {
+            '()': 'users.log_filters.SampleDebug',
+            'rate': float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', 0.01)),
+        },
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
+        'sampled_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'verbose',
+            'filters': ['sample_debug'],
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -88,8 +266,8 @@ LOGGING = {
     },
     'loggers': {
         'oauth2_provider': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
+            'handlers': ['sampled_console'],
+            'level': OAUTH_LOG_LEVEL,
             'propagate': False,
         },
         'django.request': {
@@ -103,8 +281,8 @@ LOGGING = {
             'propagate': False,
         },
         'oauthlib': {
-            'handlers': ['console'],
-            'level': 'DEBUG',
+            'handlers': ['sampled_console'],
+            'level': OAUTH_LOG_LEVEL,
             'propagate': False,
         },
     },
@@ -113,6 +291,48 @@ LOGGING = {
 # Service API key for trusted server-to-server calls
 import os
 SERVICE_API_KEY = "Zi9_p8gUaLUfUXzHH4WcW6ITjjRi9l2U4ZO37mvV0og" # change SERVICE_API_KEY
+# client_id the service token endpoints issue for; keys: default, token_by_password, token_by_otp, token_bulk.
+# Without one, the first confidential application (by id) is used.
+SERVICE_APPLICATIONS = {
+    'default': os.environ.get('SERVICE_CLIENT_ID', ''),
+    'token_by_password': os.environ.get('SERVICE_CLIENT_ID_PASSWORD', ''),
+    'token_by_otp': os.environ.get('SERVICE_CLIENT_ID_OTP', ''),
+    'token_bulk': os.environ.get('SERVICE_CLIENT_ID_BULK', ''),
+}
+# Application lookups cache (users/app_registry.py). Without REDIS_URL the version bump only reaches its own worker:
+# the TTL bounds how long the others accept a deleted client or an old secret
+APPLICATION_REGISTRY = {
+    'TTL_SECONDS': int(os.environ.get('APPLICATION_REGISTRY_TTL_SECONDS', 300 if 'shared' in CACHES else 2)),
+    'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+}
+BULK_TOKEN_MAX_ITEMS = int(os.environ.get('BULK_TOKEN_MAX_ITEMS', 50000))
+# Throttling (users/ratelimit.py), checked before any hashing or DB work. Rates are 'count/[n](s|m|h)';
+# override one with RATE_LIMIT_<SCOPE>_<KEY>, e.g. RATE_LIMIT_TOKEN_OTP_USERNAME=3/10m ('' disables it).
+_rate = lambda scope, key, default: os.environ.get(f'RATE_LIMIT_{scope}_{key}'.upper(), default)
+RATE_LIMITS = {
+    'ENABLED': os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True',
+    # token buckets per process, or sliding windows shared through the cache
+    'BACKEND': 'users.ratelimit.CacheBackend' if 'shared' in CACHES else 'users.ratelimit.MemoryBackend',
+    'CACHE_ALIAS': 'shared' if 'shared' in CACHES else 'default',
+    'TRUST_X_FORWARDED_FOR': os.environ.get('RATE_LIMIT_TRUST_X_FORWARDED_FOR', 'False') == 'True',
+    # proxies in front that append to X-Forwarded-For; the client address is that many entries from the right
+    'TRUSTED_PROXIES': int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 1)),
+    'RULES': {
+        scope: {key: _rate(scope, key, rate) for key, rate in limits.items()}
+        for scope, limits in {
+            'request_otp': {'username': '3/m', 'ip': '30/m'},
+            'token': {'username': '10/m', 'client_id': '600/m', 'ip': '60/m'},
+            'token_otp': {'username': '5/5m', 'ip': '60/m'},
+            'token_password': {'username': '10/m', 'ip': '60/m'},
+        }.items()
+    },
+    # keys anyone can put in a request only count failed attempts (400/401/403), so they cannot lock a victim out
+    'FAILURES_ONLY': {
+        'token': ['username', 'client_id'],
+        'token_otp': ['username'],
+        'token_password': ['username'],
+    },
+}
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
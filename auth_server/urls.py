@@ -1,15 +1,24 @@
+from django.conf import settings
 from django.contrib import admin
 from users.token_proxy import token_proxy
+from users.metrics import metrics_view
 from django.urls import path, include
 from users import views as user_views
 from users import token_endpoints
 from users.otp_views import request_otp
+from users.revocation_feed import revocation_feed
+from users import async_views
 
 from client_backend import views as client_views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('o/token/', token_proxy, name='oauth2_token'),
+    path('o/introspect/', user_views.IntrospectView.as_view(), name='introspect'),
+    # DOT's own discovery/JWKS views only know OIDC_RSA_PRIVATE_KEY; ID tokens are signed by users.jwt_tokens
+    path('o/.well-known/openid-configuration', user_views.OIDCDiscoveryView.as_view()),
+    path('o/.well-known/jwks.json', user_views.JWKSView.as_view()),
+    path('o/authorize/', user_views.AuthorizeView.as_view(), name='authorize'),
     path('o/', include('oauth2_provider.urls', namespace='oauth2_provider')),
     path('accounts/', include('django.contrib.auth.urls')),
     path('api/userinfo/', user_views.UserInfoView.as_view(), name='user-info'),
@@ -17,8 +26,27 @@ urlpatterns = [
     path('api/logout/', user_views.LogoutView.as_view(), name='logout'),
     path('api/roles/', user_views.RoleListView.as_view(), name='roles'),
     path('api/validate-token/', user_views.ValidateTokenView.as_view(), name='validate-token'),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/db-pool/', user_views.DBPoolStatsView.as_view(), name='db-pool'),
+    path('.well-known/jwks.json', user_views.JWKSView.as_view(), name='jwks'),
+    path('.well-known/openid-configuration', user_views.OIDCDiscoveryView.as_view(), name='openid-configuration'),
     path('client/exchange/', client_views.exchange_code, name='client-exchange'),
     path('api/token/password/', token_endpoints.token_by_password, name='token-by-password'),
     path('api/token/otp/', token_endpoints.token_by_otp, name='token-by-otp'),
+    path('api/token/bulk/', token_endpoints.token_bulk, name='token-bulk'),
     path('api/request-otp/', request_otp, name='request-otp'),
+    path('api/revocations/', revocation_feed, name='revocations'),
 ]
+
+if settings.ASYNC_VIEWS:
+    # same names and paths; URL resolution takes the first match
+    urlpatterns = [
+        path('o/introspect/', async_views.aintrospect, name='introspect'),
+        path('api/userinfo/', async_views.auserinfo, name='user-info'),
+        path('api/validate-token/', async_views.avalidate_token, name='validate-token'),
+        path('api/token/password/', async_views.atoken_by_password, name='token-by-password'),
+        path('api/token/otp/', async_views.atoken_by_otp, name='token-by-otp'),
+        path('api/request-otp/', async_views.arequest_otp, name='request-otp'),
+        path('api/revocations/', async_views.arevocation_feed, name='revocations'),
+        path('client/exchange/', client_views.aexchange_code, name='client-exchange'),
+    ] + urlpatterns
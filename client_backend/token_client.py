@@ -0,0 +1,129 @@
+import asyncio
+import json
+import os
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpRequest
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import httpx
+except ImportError:  # only needed by AsyncTokenClient
+    httpx = None
+
+TOKEN_URL = os.environ.get('OAUTH_TOKEN_URL', 'http://localhost:8000/o/token/')
+TIMEOUT = float(os.environ.get('OAUTH_TOKEN_TIMEOUT', 5))
+RETRIES = int(os.environ.get('OAUTH_TOKEN_RETRIES', 2))
+BACKOFF = float(os.environ.get('OAUTH_TOKEN_BACKOFF', 0.2))
+POOL_SIZE = int(os.environ.get('OAUTH_TOKEN_POOL_SIZE', 10))
+# the auth server runs in this same Django process: call token_proxy directly, no HTTP loopback
+IN_PROCESS = os.environ.get('OAUTH_TOKEN_IN_PROCESS', 'False') == 'True'
+
+# only statuses where the server did not act on the request; a code exchange is single-use
+RETRY_STATUSES = (502, 503, 504)
+# request metadata passed to the in-process call (host for absolute URIs, client IP for rate limits)
+FORWARDED_META = ('SERVER_NAME', 'SERVER_PORT', 'HTTP_HOST', 'REMOTE_ADDR', 'HTTP_X_FORWARDED_FOR',
+                  'HTTP_X_FORWARDED_PROTO', 'HTTP_USER_AGENT', 'wsgi.url_scheme')
+
+
+class TokenError(Exception):
+    """The token endpoint could not be reached or did not answer with JSON."""
+
+
+def _parse(status, content):
+    try:
+        return status, json.loads(content)
+    except ValueError:
+        raise TokenError(f'token endpoint returned {status} without a JSON body')
+
+
+def _in_process_request(payload, source=None):
+    request = HttpRequest()
+    request.method = 'POST'
+    request.path = request.path_info = '/o/token/'
+    if source is not None:
+        request.META.update({k: v for k, v in source.META.items() if k in FORWARDED_META})
+    request.META.setdefault('SERVER_NAME', 'localhost')
+    request.META.setdefault('SERVER_PORT', '80')
+    request.META['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+    request.POST.update(payload)
+    return request
+
+
+def _token_proxy():
+    from users.token_proxy import token_proxy
+    return token_proxy
+
+
+class TokenClient:
+    """
+    POSTs to the token endpoint over a keep-alive connection pool, with a
+    timeout and retries (connection failures and 502/503/504 only, with
+    exponential backoff). exchange() returns (status, json body).
+    """
+
+    def __init__(self, token_url=TOKEN_URL, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 pool_size=POOL_SIZE, in_process=IN_PROCESS):
+        self.token_url = token_url
+        self.timeout = timeout
+        self.in_process = in_process
+        self.session = requests.Session()
+        retry = Retry(total=retries, connect=retries, read=0, status=retries, backoff_factor=backoff,
+                      status_forcelist=RETRY_STATUSES, allowed_methods=frozenset({'POST'}),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def exchange(self, payload, source=None):
+        if self.in_process:
+            response = _token_proxy()(_in_process_request(payload, source))
+            return _parse(response.status_code, response.content)
+        try:
+            r = self.session.post(self.token_url, data=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise TokenError(str(e)) from e
+        return _parse(r.status_code, r.content)
+
+
+class AsyncTokenClient:
+    """TokenClient for async views, on an httpx.AsyncClient (pip install httpx)."""
+
+    def __init__(self, token_url=TOKEN_URL, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF,
+                 pool_size=POOL_SIZE, in_process=IN_PROCESS):
+        self.token_url = token_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.in_process = in_process
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            if httpx is None:
+                raise ImproperlyConfigured('AsyncTokenClient needs httpx (pip install httpx)')
+            # transport retries cover connection failures; status retries are done below. The limits go on the
+            # transport: httpx ignores the client's own when a transport is given
+            self._client = httpx.AsyncClient(timeout=self.timeout, transport=httpx.AsyncHTTPTransport(
+                retries=self.retries, limits=httpx.Limits(max_keepalive_connections=self.pool_size)))
+        return self._client
+
+    async def exchange(self, payload, source=None):
+        if self.in_process:
+            response = await sync_to_async(_token_proxy())(_in_process_request(payload, source))
+            return _parse(response.status_code, response.content)
+        for attempt in range(self.retries + 1):
+            try:
+                r = await self.client.post(self.token_url, data=payload)
+            except httpx.HTTPError as e:
+                raise TokenError(str(e)) from e
+            if r.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return _parse(r.status_code, r.content)
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+
+token_client = TokenClient()
+async_token_client = AsyncTokenClient()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for the WSGI vs ASGI profiles.
+
+Gets a token from /api/token/password/, then drives /api/userinfo/ and
+/api/validate-token/ from many concurrent clients against each --url and
+prints requests/second and latency percentiles.
+
+    python loadtest.py --url http://localhost:8000 --url http://localhost:8001 --concurrency 64
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SERVICE_KEY = os.environ.get("SERVICE_API_KEY", "Zi9_p8gUaLUfUXzHH4WcW6ITjjRi9l2U4ZO37mvV0og")
+
+
+def get_token(base, username, password):
+    r = requests.post(f"{base}/api/token/password/", data={"username": username, "password": password},
+                      headers={"X-Service-Key": SERVICE_KEY}, timeout=30)
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+def run(base, token, requests_per_client, concurrency):
+    def client(_):
+        session = requests.Session()
+        timings, errors = [], 0
+        for i in range(requests_per_client):
+            start = time.perf_counter()
+            if i % 2:
+                r = session.post(f"{base}/api/validate-token/", data={"token": token}, timeout=30)
+            else:
+                r = session.get(f"{base}/api/userinfo/", headers={"Authorization": f"Bearer {token}"}, timeout=30)
+            timings.append(time.perf_counter() - start)
+            errors += r.status_code != 200
+        return timings, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    timings = sorted(t for ts, _ in results for t in ts)
+    errors = sum(e for _, e in results)
+    q = statistics.quantiles(timings, n=100)
+    print(f"{base}: {len(timings)} requests, {errors} errors, {len(timings) / elapsed:.0f} req/s, "
+          f"p50 {q[49] * 1000:.1f} ms, p95 {q[94] * 1000:.1f} ms, p99 {q[98] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", action="append", help="server base URL (repeatable)")
+    parser.add_argument("--username", default="ranjeet")
+    parser.add_argument("--password", default="ranjeetpass")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=50, help="requests per client")
+    args = parser.parse_args()
+    for base in args.url or ["http://localhost:8000"]:
+        base = base.rstrip("/")
+        run(base, get_token(base, args.username, args.password), args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
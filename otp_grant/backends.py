@@ -0,0 +1,114 @@
+# otp_grant/backends.py
+import time
+from datetime import timedelta
+from functools import lru_cache
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OTPCode
+
+# consume() results; the failure values double as the API error codes
+VALID = "valid"
+INVALID = "invalid_otp"
+EXPIRED = "expired_otp"
+
+
+class BaseOTPStore:
+    """
+    Storage for one-time codes. consume() must be atomic: when two requests
+    redeem the same code concurrently, exactly one of them gets VALID.
+    """
+
+    def __init__(self, ttl_seconds=300, **options):
+        self.ttl_seconds = ttl_seconds
+
+    def issue(self, user, code):
+        raise NotImplementedError
+
+    def consume(self, user, code):
+        raise NotImplementedError
+
+    async def aissue(self, user, code):
+        return await sync_to_async(self.issue)(user, code)
+
+    async def aconsume(self, user, code):
+        return await sync_to_async(self.consume)(user, code)
+
+
+def _codes(user):
+    # the user as routing hint: codes live on the user's token shard (users.db_router)
+    return OTPCode.objects.db_manager(hints={"instance": user})
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    """OTPCode table. Consuming a live code is a single DELETE; its row count decides the winner."""
+
+    def issue(self, user, code):
+        now = timezone.now()
+        # keep the table bounded: a user's expired codes go when they ask for a new one
+        _codes(user).filter(user=user, expires_at__lt=now).delete()
+        return _codes(user).create(user=user, code=code, expires_at=now + timedelta(seconds=self.ttl_seconds))
+
+    def consume(self, user, code):
+        deleted, _ = _codes(user).filter(user=user, code=code, expires_at__gte=timezone.now()).delete()
+        if deleted:
+            return VALID
+        # failure path only: tell expired from unknown, dropping the stale row
+        expired, _ = _codes(user).filter(user=user, code=code).delete()
+        return EXPIRED if expired else INVALID
+
+    async def aconsume(self, user, code):
+        deleted, _ = await _codes(user).filter(user=user, code=code, expires_at__gte=timezone.now()).adelete()
+        if deleted:
+            return VALID
+        expired, _ = await _codes(user).filter(user=user, code=code).adelete()
+        return EXPIRED if expired else INVALID
+
+
+class CacheOTPStore(BaseOTPStore):
+    """
+    Django cache (Redis in production, LocMemCache locally). Entries expire
+    natively; they are kept GRACE_SECONDS past expiry only so a late attempt
+    is reported as expired_otp rather than invalid_otp.
+    """
+
+    GRACE_SECONDS = 60
+
+    def __init__(self, ttl_seconds=300, cache_alias="default", **options):
+        super().__init__(ttl_seconds)
+        self.cache = caches[cache_alias]
+
+    def _key(self, user, code):
+        return f"otp:{user.pk}:{code}"
+
+    def issue(self, user, code):
+        self.cache.set(self._key(user, code), time.time() + self.ttl_seconds,
+                       timeout=self.ttl_seconds + self.GRACE_SECONDS)
+
+    def consume(self, user, code):
+        key = self._key(user, code)
+        expires_at = self.cache.get(key)
+        # delete() reports whether this caller removed the key (DEL on Redis), so only one redemption wins
+        if expires_at is None or not self.cache.delete(key):
+            return INVALID
+        return VALID if expires_at >= time.time() else EXPIRED
+
+    async def aissue(self, user, code):
+        await self.cache.aset(self._key(user, code), time.time() + self.ttl_seconds,
+                              timeout=self.ttl_seconds + self.GRACE_SECONDS)
+
+    async def aconsume(self, user, code):
+        key = self._key(user, code)
+        expires_at = await self.cache.aget(key)
+        if expires_at is None or not await self.cache.adelete(key):
+            return INVALID
+        return VALID if expires_at >= time.time() else EXPIRED
+
+
+@lru_cache(maxsize=None)
+def get_otp_store():
+    conf = dict(getattr(settings, "OTP", {}))
+    store_class = import_string(conf.pop("STORE", "otp_grant.backends.DatabaseOTPStore"))
+    return store_class(**{k.lower(): v for k, v in conf.items()})
@@ -0,0 +1,58 @@
+# otp_grant/grant_types.py
+import json
+import logging
+from oauthlib.oauth2.rfc6749 import errors
+from oauthlib.oauth2.rfc6749.grant_types.base import GrantTypeBase
+
+log = logging.getLogger(__name__)
+
+
+class OTPGrant(GrantTypeBase):
+    """
+    grant_type=otp at the token endpoint: username plus a one-time code from
+    /api/request-otp/, in the `otp` parameter (`password` is accepted for
+    older clients). Shaped like the password grant, but the request validator
+    answers validate_otp_user() instead of validate_user(), so a login never
+    touches the password hasher and a password login never looks up OTPs.
+
+    validate_otp_user() only resolves the user; the code itself is consumed
+    by save_bearer_token, in the same transaction as the token inserts.
+    """
+
+    def create_token_response(self, request, token_handler):
+        headers = self._get_default_headers()
+        try:
+            self.validate_token_request(request)
+        except errors.OAuth2Error as e:
+            log.debug("Client error in token request, %s.", e)
+            headers.update(e.headers)
+            return headers, e.json, e.status_code
+
+        token = token_handler.create_token(request, self.refresh_token)
+        for modifier in self._token_modifiers:
+            token = modifier(token)
+        self.request_validator.save_token(token, request)
+        return headers, json.dumps(token), 200
+
+    def validate_token_request(self, request):
+        for validator in self.custom_validators.pre_token:
+            validator(request)
+
+        request.otp = getattr(request, "otp", None) or getattr(request, "password", None)
+        for param in ("grant_type", "username", "otp"):
+            if not getattr(request, param, None):
+                raise errors.InvalidRequestError("Request is missing %s parameter." % param, request=request)
+        for param in ("grant_type", "username", "otp", "password", "scope"):
+            if param in request.duplicate_params:
+                raise errors.InvalidRequestError(description="Duplicate %s parameter." % param, request=request)
+        if request.grant_type != "otp":
+            raise errors.UnsupportedGrantTypeError(request=request)
+
+        self.validate_client_authentication(request)
+        if not self.request_validator.validate_otp_user(request.username, request.client, request):
+            raise errors.InvalidGrantError("Invalid credentials given.", request=request)
+        self.validate_grant_type(request)
+        self.validate_scopes(request)
+
+        for validator in self.custom_validators.post_token:
+            validator(request)
@@ -5,9 +5,17 @@ from datetime import timedelta
 
 class OTPCode(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    code = models.CharField(max_length=16, db_index=True)
+    code = models.CharField(max_length=16)
     created = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            # consume(): user = ? AND code = ? AND expires_at >= now
+            models.Index(fields=['user', 'code', 'expires_at'], name='otp_user_code_expires_idx'),
+            # purge and the per-user cleanup in issue(): expires_at < now
+            models.Index(fields=['expires_at'], name='otp_expires_idx'),
+        ]
+
     def is_valid(self):
         return self.expires_at >= timezone.now()
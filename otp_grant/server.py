@@ -0,0 +1,20 @@
+# otp_grant/server.py
+from oauthlib import oauth2, openid
+from .grant_types import OTPGrant
+
+
+class OTPGrantServerMixin:
+    """Registers grant_type=otp next to the grants of the oauthlib server it is mixed into."""
+
+    def __init__(self, request_validator, *args, **kwargs):
+        super().__init__(request_validator, *args, **kwargs)
+        self.otp_grant = OTPGrant(request_validator)
+        self._grant_types["otp"] = self.otp_grant
+
+
+class Server(OTPGrantServerMixin, oauth2.Server):
+    """OAUTH2_PROVIDER['OAUTH2_SERVER_CLASS'] without OpenID Connect."""
+
+
+class OIDCServer(OTPGrantServerMixin, openid.Server):
+    """OAUTH2_PROVIDER['OAUTH2_SERVER_CLASS'] with OIDC_ENABLED."""
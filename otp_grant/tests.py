@@ -0,0 +1,115 @@
+# otp_grant/tests.py
+import threading
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connections
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from .backends import EXPIRED, INVALID, VALID, CacheOTPStore, DatabaseOTPStore
+from .models import OTPCode
+
+User = get_user_model()
+
+
+def race(consume, attempts=8):
+    """Call consume() from `attempts` threads released together; the results in any order."""
+    barrier = threading.Barrier(attempts)
+    results = []
+
+    def attempt():
+        barrier.wait()
+        try:
+            while True:
+                try:
+                    results.append(consume())
+                    break
+                except OperationalError as e:
+                    # the in-memory test database locks whole tables without waiting; the statement did nothing
+                    if "locked" not in str(e):
+                        raise
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=attempt) for _ in range(attempts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class OTPStoreChecks:
+    """consume() contract shared by every store: single use, even under concurrent redemption."""
+
+    def make_store(self):
+        raise NotImplementedError
+
+    def expire(self, store, user, code):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.user = User.objects.create_user("otp-user", "otp@example.com", "pw")
+        self.store = self.make_store()
+
+    def test_consume_is_single_use(self):
+        self.store.issue(self.user, "123456")
+        self.assertEqual(self.store.consume(self.user, "123456"), VALID)
+        self.assertEqual(self.store.consume(self.user, "123456"), INVALID)
+
+    def test_unknown_code_is_invalid(self):
+        self.store.issue(self.user, "123456")
+        self.assertEqual(self.store.consume(self.user, "654321"), INVALID)
+        self.assertEqual(self.store.consume(self.user, "123456"), VALID)
+
+    def test_code_is_bound_to_its_user(self):
+        other = User.objects.create_user("otp-other", "other@example.com", "pw")
+        self.store.issue(self.user, "123456")
+        self.assertEqual(self.store.consume(other, "123456"), INVALID)
+        self.assertEqual(self.store.consume(self.user, "123456"), VALID)
+
+    def test_expired_code_is_reported_once(self):
+        self.store.issue(self.user, "123456")
+        self.expire(self.store, self.user, "123456")
+        self.assertEqual(self.store.consume(self.user, "123456"), EXPIRED)
+        self.assertEqual(self.store.consume(self.user, "123456"), INVALID)
+
+    def test_concurrent_consume_has_one_winner(self):
+        self.store.issue(self.user, "123456")
+        results = race(lambda: self.store.consume(self.user, "123456"))
+        self.assertEqual(len(results), 8)
+        self.assertEqual(results.count(VALID), 1)
+        self.assertEqual(results.count(INVALID), len(results) - 1)
+
+    def test_aconsume_is_single_use(self):
+        async_to_sync(self.store.aissue)(self.user, "123456")
+        self.assertEqual(async_to_sync(self.store.aconsume)(self.user, "123456"), VALID)
+        self.assertEqual(async_to_sync(self.store.aconsume)(self.user, "123456"), INVALID)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                       "LOCATION": "otp-tests"}})
+class CacheOTPStoreTests(OTPStoreChecks, TransactionTestCase):
+    def make_store(self):
+        store = CacheOTPStore()
+        store.cache.clear()
+        return store
+
+    def expire(self, store, user, code):
+        store.cache.set(store._key(user, code), 0, timeout=store.GRACE_SECONDS)
+
+
+class DatabaseOTPStoreTests(OTPStoreChecks, TransactionTestCase):
+    # TransactionTestCase: the racing threads each use their own connection and must see the committed code
+
+    def make_store(self):
+        return DatabaseOTPStore()
+
+    def expire(self, store, user, code):
+        OTPCode.objects.filter(user=user, code=code).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_issue_drops_the_users_expired_codes(self):
+        self.store.issue(self.user, "111111")
+        self.expire(self.store, self.user, "111111")
+        self.store.issue(self.user, "222222")
+        self.assertEqual(list(OTPCode.objects.values_list("code", flat=True)), ["222222"])
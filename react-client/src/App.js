@@ -32,9 +32,21 @@ async function exchangeCodeForToken(code){
   return result;
 }
 
+// The ID token comes straight from the token endpoint over TLS, so its claims can be read
+// without another round trip to /api/userinfo/ (OIDC Core 3.1.3.7).
+function idTokenClaims(idToken){
+  if(!idToken) return null;
+  try {
+    const payload = idToken.split('.')[1].replace(/-/g,'+').replace(/_/g,'/');
+    return JSON.parse(atob(payload));
+  } catch (error) {
+    return null;
+  }
+}
+
 export default function App(){
   const [token,setToken]=useState(localStorage.getItem('access_token')||null);
-  const [profile,setProfile]=useState(null);
+  const [profile,setProfile]=useState(idTokenClaims(localStorage.getItem('id_token')));
   const [loading, setLoading] = useState(false);
   
   useEffect(()=>{
@@ -46,7 +58,9 @@ export default function App(){
         if(data.access_token){
           localStorage.setItem('access_token',data.access_token);
           localStorage.setItem('refresh_token',data.refresh_token||'');
+          localStorage.setItem('id_token',data.id_token||'');
           setToken(data.access_token);
+          setProfile(idTokenClaims(data.id_token));
           window.history.replaceState({}, document.title, '/');
         } else console.error('Token error',data);
         setLoading(false);
@@ -64,7 +78,7 @@ export default function App(){
       localStorage.setItem('pkce_verifier',verifier);
       console.log('PKCE Debug - Stored verifier in localStorage');
       
-      const params=new URLSearchParams({response_type:'code',client_id:OAUTH_CLIENT_ID,redirect_uri:OAUTH_REDIRECT_URI,scope:'read',code_challenge:challenge,code_challenge_method:'S256'});
+      const params=new URLSearchParams({response_type:'code',client_id:OAUTH_CLIENT_ID,redirect_uri:OAUTH_REDIRECT_URI,scope:'read openid',code_challenge:challenge,code_challenge_method:'S256'});
       console.log('PKCE Debug - Authorization params:', params.toString());
       
       window.location = `${OAUTH_AUTH_URL}?${params.toString()}`;
@@ -96,6 +110,7 @@ export default function App(){
     }
     localStorage.removeItem('access_token'); 
     localStorage.removeItem('refresh_token'); 
+    localStorage.removeItem('id_token');
     setToken(null); 
     setProfile(null);
     setLoading(false);
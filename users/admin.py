@@ -1,6 +1,32 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from oauth2_provider.admin import application_admin_class
+from oauth2_provider.models import Application
 from .models import User
+from .revocation import revoke_tokens
+
+
+def _revoke_action(field, description):
+    @admin.action(description=description)
+    def action(modeladmin, request, queryset):
+        totals = {}
+        for obj in queryset:
+            for kind, n in revoke_tokens(**{field: obj}).items():
+                totals[kind] = totals.get(kind, 0) + n
+        modeladmin.message_user(request, 'Revoked {access_tokens} access tokens and {refresh_tokens} refresh tokens'.format(
+            access_tokens=totals.get('access_tokens', 0), refresh_tokens=totals.get('refresh_tokens', 0)))
+    action.__name__ = f'revoke_{field}_tokens'
+    return action
+
+
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
     fieldsets = UserAdmin.fieldsets + (('Custom', {'fields': ('role',)}),)
+    actions = [_revoke_action('user', 'Revoke all tokens of the selected users')]
+
+
+admin.site.unregister(Application)
+
+@admin.register(Application)
+class ApplicationAdmin(application_admin_class):
+    actions = [_revoke_action('application', 'Revoke all tokens issued to the selected applications')]
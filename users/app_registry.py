@@ -0,0 +1,85 @@
+# users/app_registry.py
+import copy
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from oauth2_provider.models import Application
+
+VERSION_KEY = "app_registry:version"
+FIRST_CONFIDENTIAL = object()
+
+
+def _conf():
+    return getattr(settings, "APPLICATION_REGISTRY", {})
+
+
+class ApplicationRegistry:
+    """
+    Per-process cache of Application rows by client_id.
+
+    Entries are tagged with a registry version kept in a (shared) Django
+    cache. Saving or deleting any Application bumps the version, so every
+    worker sharing that cache reloads on its next lookup; with a per-process
+    cache only this one does, and TTL_SECONDS bounds the others.
+    """
+
+    def __init__(self, ttl=300, cache_alias="default"):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._apps = {}
+        self._lock = threading.Lock()
+
+    def _version(self):
+        return caches[self.cache_alias].get(VERSION_KEY, 0)
+
+    def get(self, client_id):
+        return self._get(client_id, lambda: Application.objects.filter(client_id=client_id).first())
+
+    def get_by_pk(self, pk):
+        return self._get(("pk", pk), lambda: Application.objects.filter(pk=pk).first())
+
+    def first_confidential(self):
+        # legacy fallback for the service endpoints; ordered so the choice is stable
+        return self._get(FIRST_CONFIDENTIAL, lambda: Application.objects.filter(
+            client_type=Application.CLIENT_CONFIDENTIAL).order_by("pk").first())
+
+    def service_application(self, endpoint):
+        """
+        The application an endpoint issues tokens for: SERVICE_APPLICATIONS[endpoint],
+        else SERVICE_APPLICATIONS['default'], else the first confidential app.
+        """
+        apps = getattr(settings, "SERVICE_APPLICATIONS", {})
+        client_id = apps.get(endpoint) or apps.get("default")
+        return self.get(client_id) if client_id else self.first_confidential()
+
+    def _get(self, key, load):
+        version = self._version()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._apps.get(key)
+        if entry is not None and entry[0] == version and entry[1] > now:
+            app = entry[2]
+        else:
+            app = load()
+            if app is None:
+                return None
+            with self._lock:
+                self._apps[key] = (version, now + self.ttl, app)
+        # callers hang request state off the instance (request.client), hand out a copy
+        return copy.copy(app)
+
+    def invalidate(self):
+        with self._lock:
+            self._apps.clear()
+        shared = caches[self.cache_alias]
+        try:
+            shared.incr(VERSION_KEY)
+        except ValueError:
+            shared.set(VERSION_KEY, 1, timeout=None)
+
+
+app_registry = ApplicationRegistry(
+    ttl=_conf().get("TTL_SECONDS", 300),
+    cache_alias=_conf().get("CACHE_ALIAS", "default"),
+)
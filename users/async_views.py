@@ -0,0 +1,214 @@
+# users/async_views.py
+"""
+Async variants of the hot token and resource endpoints, routed instead of the
+sync views when settings.ASYNC_VIEWS is on and the app is served over ASGI
+(auth_server.asgi). Responses match the sync views field for field.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aauthenticate, get_user_model
+from django.http import HttpResponseNotModified, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from oauth2_provider.models import AccessToken
+from oauth2_provider.settings import oauth2_settings
+from otp_grant.backends import get_otp_store
+from .app_registry import app_registry
+from .auth_backends import HashingPoolSaturated
+from .claims import claims_cache, not_modified, set_cache_headers, userinfo
+from .db_router import replica_reads, shard_for_token
+from .introspection import aload_active_tokens, authenticate_client, cache_max_age, introspect_tokens
+from .metrics import count_token_requests
+from .ratelimit import ratelimit
+from . import revocation_feed
+from .otp_views import generate_numeric_otp
+from .token_cache import token_cache, token_checksum
+from .token_endpoints import has_service_key, hashing_unavailable
+from .token_minting import OTPRejected, token_minter, token_payload
+
+User = get_user_model()
+
+
+async def _issue_token_pair(user, endpoint, otp=None):
+    app = await sync_to_async(app_registry.service_application)(endpoint)
+    if not app:
+        return JsonResponse({"error": "no_service_app"}, status=500)
+    try:
+        tokens = await token_minter.amint(user, app, otp=otp)
+    except OTPRejected as e:
+        return JsonResponse({"error": e.code}, status=400)
+    return JsonResponse(token_payload(*tokens))
+
+
+async def _bearer_token(request):
+    """The valid AccessToken for the request's bearer token, or None."""
+    auth = request.META.get("HTTP_AUTHORIZATION", "")
+    if auth[:7].lower() != "bearer ":
+        return None
+    token = auth[7:].strip()
+    access_token = await sync_to_async(token_cache.get)(token)
+    if access_token is None:
+        db = shard_for_token(token)
+        if db == "default":
+            access_token = await AccessToken.objects.select_related("user", "application").filter(
+                token_checksum=token_checksum(token)).afirst()
+        else:
+            # no join across databases: the user comes from default, the application from the registry
+            access_token = await AccessToken.objects.using(db).filter(token_checksum=token_checksum(token)).afirst()
+            if access_token is not None:
+                access_token.user = await User.objects.filter(pk=access_token.user_id).afirst()
+                access_token.application = await sync_to_async(app_registry.get_by_pk)(access_token.application_id)
+        if access_token is not None:
+            await sync_to_async(token_cache.set)(token, access_token)
+    if access_token is None or not access_token.is_valid():
+        return None
+    if access_token.user is None or not access_token.user.is_active:
+        return None
+    return access_token
+
+
+def _unauthorized():
+    response = JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    response["WWW-Authenticate"] = 'Bearer realm="api"'
+    return response
+
+
+@csrf_exempt
+@count_token_requests("api/token/password", grant_type="password")
+@ratelimit("token_password")
+async def atoken_by_password(request):
+    if not has_service_key(request):
+        return JsonResponse({"error": "unauthorized"}, status=401)
+    if request.method != "POST":
+        return JsonResponse({"error": "method_not_allowed"}, status=405)
+    username = request.POST.get("username")
+    password = request.POST.get("password")
+    if not username or not password:
+        return JsonResponse({"error": "missing_credentials"}, status=400)
+    try:
+        user = await aauthenticate(username=username, password=password)
+    except HashingPoolSaturated:
+        return hashing_unavailable()
+    if user is None:
+        return JsonResponse({"error": "invalid_credentials"}, status=400)
+    return await _issue_token_pair(user, "token_by_password")
+
+
+@csrf_exempt
+@count_token_requests("api/token/otp", grant_type="otp")
+@ratelimit("token_otp")
+async def atoken_by_otp(request):
+    if not has_service_key(request):
+        return JsonResponse({"error": "unauthorized"}, status=401)
+    if request.method != "POST":
+        return JsonResponse({"error": "method_not_allowed"}, status=405)
+    username = request.POST.get("username")
+    otp = request.POST.get("otp")
+    if not username or not otp:
+        return JsonResponse({"error": "missing_parameters"}, status=400)
+    try:
+        user = await User.objects.aget(username=username)
+    except User.DoesNotExist:
+        return JsonResponse({"error": "no_user"}, status=400)
+    return await _issue_token_pair(user, "token_by_otp", otp=otp)
+
+
+@csrf_exempt
+@ratelimit("request_otp")
+async def arequest_otp(request):
+    if request.method != "POST":
+        return JsonResponse({"error": "method_not_allowed"}, status=405)
+    username = request.POST.get("username") or request.GET.get("username")
+    if not username:
+        return JsonResponse({"error": "missing_username"}, status=400)
+    try:
+        user = await User.objects.aget(username=username)
+    except User.DoesNotExist:
+        return JsonResponse({"error": "no_user"}, status=400)
+    code = generate_numeric_otp(6)
+    await get_otp_store().aissue(user, code)
+    return JsonResponse({"detail": "otp_sent", "debug_otp": code})  # debug_otp only for dev
+
+
+async def auserinfo(request):
+    access_token = await _bearer_token(request)
+    if access_token is None:
+        return _unauthorized()
+    entry = await claims_cache.aget(access_token.user_id)
+    if entry is None:
+        return JsonResponse({"detail": "User not found"}, status=404)
+    claims, etag = entry
+    if not_modified(request, etag):
+        return set_cache_headers(HttpResponseNotModified(), etag)
+    return set_cache_headers(JsonResponse(userinfo(claims)), etag)
+
+
+def _request_data(request):
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+@csrf_exempt
+async def avalidate_token(request):
+    if request.method != "POST":
+        return JsonResponse({"detail": 'Method "%s" not allowed.' % request.method}, status=405)
+    data = _request_data(request) or {}
+    token_value = data.get("token")
+    if not token_value:
+        return JsonResponse({"active": False, "detail": "No token provided"}, status=400)
+    with replica_reads():
+        row = (await aload_active_tokens([token_value])).get(token_checksum(token_value))
+    if row is None:
+        return JsonResponse({"active": False})
+    return JsonResponse({"active": True, "user_id": row["user_id"], "username": row["user__username"],
+                         "scope": row["scope"], "expires": row["expires"]})
+
+
+@csrf_exempt
+async def aintrospect(request):
+    if request.method != "POST":
+        return JsonResponse({"detail": 'Method "%s" not allowed.' % request.method}, status=405)
+    data = _request_data(request)
+    if data is None:
+        return JsonResponse({"error": "invalid_request"}, status=400)
+    request.data = data  # authenticate_client reads client credentials from request.data
+    if await sync_to_async(authenticate_client)(request) is None:
+        response = JsonResponse({"error": "invalid_client"}, status=401)
+        response["WWW-Authenticate"] = 'Basic realm="introspect"'
+        return response
+    if "tokens" in data:
+        tokens = data.getlist("tokens") if hasattr(data, "getlist") else data["tokens"]
+        if not isinstance(tokens, list) or not all(isinstance(t, str) for t in tokens):
+            return JsonResponse({"error": "invalid_request"}, status=400)
+        if len(tokens) > settings.INTROSPECTION["MAX_BATCH"]:
+            return JsonResponse({"error": "invalid_request", "error_description": "Too many tokens"}, status=400)
+        results = introspect_tokens(tokens, await aload_active_tokens(tokens))
+        response = JsonResponse({"results": results})
+    else:
+        token_value = data.get("token")
+        if not token_value:
+            return JsonResponse({"error": "invalid_request"}, status=400)
+        results = introspect_tokens([token_value], await aload_active_tokens([token_value]))
+        response = JsonResponse(results[0])
+    response["Cache-Control"] = f"private, max-age={cache_max_age(request, results)}"
+    return response
+
+
+async def arevocation_feed(request):
+    """users.revocation_feed.revocation_feed; long polls and streams wait on the event loop, not a thread."""
+    if request.method != "GET":
+        return JsonResponse({"detail": 'Method "%s" not allowed.' % request.method}, status=405)
+    if await sync_to_async(authenticate_client)(request) is None:
+        return revocation_feed.unauthorized()
+    params = revocation_feed.parse_request(request)
+    if params is None:
+        return JsonResponse({"error": "invalid_request"}, status=400)
+    after, limit, wait, wants_stream = params
+    if wants_stream:
+        return revocation_feed.event_stream_response(revocation_feed.astream(after))
+    return JsonResponse(await revocation_feed.await_page(after, limit, wait))
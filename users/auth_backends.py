@@ -0,0 +1,238 @@
+# users/auth_backends.py
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
+from django.core.cache import caches
+from django.utils.crypto import get_random_string
+
+logger = logging.getLogger(__name__)
+
+
+def _conf():
+    return getattr(settings, "PASSWORD_PIPELINE", {})
+
+
+class HashingPoolSaturated(TimeoutError):
+    """No hashing slot freed up within WAIT_SECONDS: the login can be retried, it did not fail."""
+
+
+def _verify(password, encoded):
+    """(is_correct, must_update) for an encoded password; runs inside the pool."""
+    preferred = get_hasher("default")
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        # unusable/unknown hash: spend the same time as a real check
+        make_password(get_random_string(12))
+        return False, False
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = hasher.verify(password, encoded)
+    if not is_correct and not hasher_changed and must_update:
+        hasher.harden_runtime(password, encoded)
+    return is_correct, must_update
+
+
+class PasswordPipeline:
+    """
+    Runs password hashing in a bounded thread or process pool instead of the
+    request thread, rehashes with the preferred hasher on a successful login,
+    and remembers recently failed (user, password) pairs so replayed bad
+    credentials are rejected without hashing.
+
+    MAX_PENDING bounds queued + running checks; a check that cannot get a
+    slot within WAIT_SECONDS raises HashingPoolSaturated rather than piling
+    up work, for the caller to answer 503 + Retry-After.
+    """
+
+    def __init__(self, executor="thread", max_workers=4, max_pending=64, wait_seconds=5,
+                 negative_cache_seconds=60, cache_alias="default"):
+        self.executor_kind = executor
+        self.max_workers = max_workers
+        self.wait_seconds = wait_seconds
+        self.negative_cache_seconds = negative_cache_seconds
+        self.cache_alias = cache_alias
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None and self.executor_kind != "inline":
+            with self._lock:
+                if self._executor is None:
+                    if self.executor_kind == "process":
+                        self._executor = ProcessPoolExecutor(
+                            self.max_workers, mp_context=multiprocessing.get_context("fork"))
+                    else:
+                        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def _run(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            logger.warning("password check rejected: hashing pool saturated")
+            raise HashingPoolSaturated("password hashing pool is saturated")
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    async def _arun(self, fn, *args):
+        if self.executor is None:
+            return fn(*args)
+        # never block the event loop waiting for a slot
+        deadline = time.monotonic() + self.wait_seconds
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                logger.warning("password check rejected: hashing pool saturated")
+                raise HashingPoolSaturated("password hashing pool is saturated")
+            await asyncio.sleep(0.005)
+        try:
+            return await asyncio.wrap_future(self.executor.submit(fn, *args))
+        finally:
+            self._slots.release()
+
+    def _failure_key(self, *parts):
+        digest = hashlib.sha256(":".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+        return f"password_fail:{digest}"
+
+    def _recently_failed(self, key):
+        return bool(self.negative_cache_seconds) and caches[self.cache_alias].get(key)
+
+    def _remember_failure(self, key):
+        if self.negative_cache_seconds:
+            caches[self.cache_alias].set(key, True, timeout=self.negative_cache_seconds)
+
+    def check_password(self, user, raw_password):
+        # the stored hash is part of the key, so a password change clears old failures
+        key = self._failure_key(user.pk, user.password, raw_password)
+        if self._recently_failed(key):
+            return False
+        is_correct, must_update = self._run(_verify, raw_password, user.password)
+        if not is_correct:
+            self._remember_failure(key)
+            return False
+        if must_update:
+            # transparent upgrade to the preferred hasher (e.g. PBKDF2 -> Argon2)
+            user.password = self._run(make_password, raw_password)
+            user.save(update_fields=["password"])
+        return True
+
+    def check_passwords(self, pairs):
+        """
+        check_password() for many (user, raw_password) pairs, hashed
+        concurrently by the pool; one bool per pair, or None where no slot
+        freed up within WAIT_SECONDS.
+        """
+        keys = [self._failure_key(user.pk, user.password, raw) for user, raw in pairs]
+        futures = []
+        for (user, raw_password), key in zip(pairs, keys):
+            if self._recently_failed(key):
+                futures.append(False)
+            elif self.executor is None:
+                futures.append(_verify(raw_password, user.password))
+            elif not self._slots.acquire(timeout=self.wait_seconds):
+                futures.append(None)
+            else:
+                future = self.executor.submit(_verify, raw_password, user.password)
+                future.add_done_callback(lambda _: self._slots.release())
+                futures.append(future)
+        results = []
+        for (user, raw_password), key, outcome in zip(pairs, keys, futures):
+            if outcome is None or outcome is False:
+                results.append(outcome)
+                continue
+            is_correct, must_update = outcome if isinstance(outcome, tuple) else outcome.result()
+            if not is_correct:
+                self._remember_failure(key)
+            elif must_update:
+                user.password = self._run(make_password, raw_password)
+                user.save(update_fields=["password"])
+            results.append(is_correct)
+        return results
+
+    def reject_unknown_user(self, username, raw_password):
+        # hash anyway to equalise timing with real users, as ModelBackend does
+        key = self._failure_key("unknown", username, raw_password)
+        if self._recently_failed(key):
+            return
+        self._run(make_password, raw_password)
+        self._remember_failure(key)
+
+    async def acheck_password(self, user, raw_password):
+        cache = caches[self.cache_alias]
+        key = self._failure_key(user.pk, user.password, raw_password)
+        if self.negative_cache_seconds and await cache.aget(key):
+            return False
+        is_correct, must_update = await self._arun(_verify, raw_password, user.password)
+        if not is_correct:
+            if self.negative_cache_seconds:
+                await cache.aset(key, True, timeout=self.negative_cache_seconds)
+            return False
+        if must_update:
+            user.password = await self._arun(make_password, raw_password)
+            await user.asave(update_fields=["password"])
+        return True
+
+    async def areject_unknown_user(self, username, raw_password):
+        cache = caches[self.cache_alias]
+        key = self._failure_key("unknown", username, raw_password)
+        if self.negative_cache_seconds and await cache.aget(key):
+            return
+        await self._arun(make_password, raw_password)
+        if self.negative_cache_seconds:
+            await cache.aset(key, True, timeout=self.negative_cache_seconds)
+
+
+password_pipeline = PasswordPipeline(
+    executor=_conf().get("EXECUTOR", "thread"),
+    max_workers=_conf().get("MAX_WORKERS", 4),
+    max_pending=_conf().get("MAX_PENDING", 64),
+    wait_seconds=_conf().get("WAIT_SECONDS", 5),
+    negative_cache_seconds=_conf().get("NEGATIVE_CACHE_SECONDS", 60),
+    cache_alias=_conf().get("CACHE_ALIAS", "default"),
+)
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend that checks passwords through password_pipeline."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        User = get_user_model()
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            password_pipeline.reject_unknown_user(username, password)
+            return None
+        if password_pipeline.check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        User = get_user_model()
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            await password_pipeline.areject_unknown_user(username, password)
+            return None
+        if await password_pipeline.acheck_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,227 @@
+# users/benchmark.py
+import base64
+import hashlib
+import platform
+import secrets
+import statistics
+import subprocess
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from oauth2_provider.models import Application
+
+USERNAME_PREFIX = "bench"
+PASSWORD = "bench-password"
+PASSWORD_CLIENT = ("benchmark-password-client", "benchmark-password-secret")
+PKCE_CLIENT_ID = "benchmark-pkce-client"
+REDIRECT_URI = "http://localhost/bench/callback"
+
+
+def seed(count, password=PASSWORD):
+    """Create bench0..bench<count-1> (one shared hash, bulk insert) and the two benchmark applications."""
+    User = get_user_model()
+    usernames = [f"{USERNAME_PREFIX}{i}" for i in range(count)]
+    existing = set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+    encoded = make_password(password)
+    User.objects.bulk_create(
+        [User(username=u, email=f"{u}@example.com", password=encoded, role="user")
+         for u in usernames if u not in existing], batch_size=1000)
+
+    client_id, client_secret = PASSWORD_CLIENT
+    app, _ = Application.objects.get_or_create(client_id=client_id, defaults={
+        "name": "Benchmark Password Client", "client_type": Application.CLIENT_CONFIDENTIAL,
+        "authorization_grant_type": Application.GRANT_PASSWORD,
+    })
+    app.client_secret = client_secret  # hashed on save
+    app.save()
+    Application.objects.get_or_create(client_id=PKCE_CLIENT_ID, defaults={
+        "name": "Benchmark PKCE Client", "client_type": Application.CLIENT_PUBLIC,
+        "authorization_grant_type": Application.GRANT_AUTHORIZATION_CODE,
+        "redirect_uris": REDIRECT_URI, "skip_authorization": True,
+    })
+    return len(usernames) - len(existing)
+
+
+class Worker:
+    """One simulated client: its own test Client, bench user and token pair."""
+
+    def __init__(self, index, user_count):
+        self.client = Client(HTTP_HOST="localhost")
+        self.username = f"{USERNAME_PREFIX}{index % user_count}"
+        self.access_token = self.refresh_token = None
+
+    def password_grant(self):
+        client_id, client_secret = PASSWORD_CLIENT
+        return self.client.post("/o/token/", {
+            "grant_type": "password", "username": self.username, "password": PASSWORD,
+            "client_id": client_id, "client_secret": client_secret, "scope": "read",
+        })
+
+    def ensure_tokens(self):
+        if self.access_token is None:
+            self.remember(self.password_grant())
+
+    def remember(self, response):
+        if response.status_code == 200:
+            data = response.json()
+            self.access_token, self.refresh_token = data["access_token"], data.get("refresh_token")
+
+    def request_otp(self):
+        return self.client.post("/api/request-otp/", {"username": self.username}).json()["debug_otp"]
+
+
+# scenario: prepare(worker) does untimed setup and returns the timed request
+def _password(worker):
+    return lambda: worker.password_grant()
+
+
+def _otp(worker):
+    otp = worker.request_otp()
+    client_id, client_secret = PASSWORD_CLIENT
+    return lambda: worker.client.post("/o/token/", {
+        "grant_type": "otp", "username": worker.username, "otp": otp,
+        "client_id": client_id, "client_secret": client_secret,
+    })
+
+
+def _service_otp(worker):
+    otp = worker.request_otp()
+    return lambda: worker.client.post("/api/token/otp/", {"username": worker.username, "otp": otp},
+                                      HTTP_X_SERVICE_KEY=settings.SERVICE_API_KEY)
+
+
+def _pkce(worker):
+    verifier = secrets.token_urlsafe(48)
+    challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).rstrip(b"=").decode()
+    worker.client.force_login(get_user_model().objects.get(username=worker.username))
+    response = worker.client.get("/o/authorize/", {
+        "response_type": "code", "client_id": PKCE_CLIENT_ID, "redirect_uri": REDIRECT_URI,
+        "code_challenge": challenge, "code_challenge_method": "S256", "scope": "read",
+    })
+    code = parse_qs(urlparse(response.get("Location", "")).query).get("code", [""])[0]
+    return lambda: worker.client.post("/o/token/", {
+        "grant_type": "authorization_code", "code": code, "redirect_uri": REDIRECT_URI,
+        "client_id": PKCE_CLIENT_ID, "code_verifier": verifier,
+    })
+
+
+def _refresh(worker):
+    worker.ensure_tokens()
+    client_id, client_secret = PASSWORD_CLIENT
+
+    def send():
+        response = worker.client.post("/o/token/", {
+            "grant_type": "refresh_token", "refresh_token": worker.refresh_token,
+            "client_id": client_id, "client_secret": client_secret,
+        })
+        worker.remember(response)  # rotation: the next refresh uses the new token
+        return response
+    return send
+
+
+def _validate(worker):
+    worker.ensure_tokens()
+    return lambda: worker.client.post("/api/validate-token/", {"token": worker.access_token})
+
+
+def _userinfo(worker):
+    worker.ensure_tokens()
+    return lambda: worker.client.get("/api/userinfo/", HTTP_AUTHORIZATION=f"Bearer {worker.access_token}")
+
+
+SCENARIOS = {
+    "password": _password,
+    "otp": _otp,
+    "service_otp": _service_otp,
+    "pkce": _pkce,
+    "refresh": _refresh,
+    "validate": _validate,
+    "userinfo": _userinfo,
+}
+
+
+def _percentile(quantiles, p):
+    return round(quantiles[p - 1] * 1000, 2)
+
+
+def run_scenario(name, concurrency, requests_per_worker, user_count):
+    """
+    Drive one scenario from `concurrency` threads in this process. Only the
+    scenario's own request is timed; queries are counted per request on the
+    worker thread's connection (async views run queries on other threads and
+    are not counted).
+    """
+    prepare = SCENARIOS[name]
+    timings, queries, errors, busy = [], [], [], []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(concurrency)
+
+    def work(index):
+        worker = Worker(index, user_count)
+        local_timings, local_queries, local_errors = [], [], 0
+        try:
+            start_barrier.wait()
+            for _ in range(requests_per_worker):
+                try:
+                    send = prepare(worker)
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = send()
+                        local_timings.append(time.perf_counter() - started)
+                except Exception:
+                    # e.g. "database is locked" on SQLite under concurrent writes
+                    local_errors += 1
+                    continue
+                local_queries.append(len(captured))
+                local_errors += response.status_code >= 400
+        finally:
+            connection.close()
+        with lock:
+            timings.extend(local_timings)
+            queries.extend(local_queries)
+            errors.append(local_errors)
+            busy.append(sum(local_timings))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # untimed setup (OTP requests, /o/authorize/) is excluded: rate over the busiest worker's timed span
+    elapsed = max(busy)
+    if not timings:
+        return {"requests": 0, "errors": sum(errors)}
+
+    q = statistics.quantiles(timings, n=100) if len(timings) > 1 else [timings[0]] * 99
+    return {
+        "requests": len(timings),
+        "errors": sum(errors),
+        "throughput_rps": round(len(timings) / elapsed, 1),
+        "p50_ms": _percentile(q, 50),
+        "p95_ms": _percentile(q, 95),
+        "p99_ms": _percentile(q, 99),
+        "queries_per_request": round(statistics.mean(queries), 2),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, cwd=settings.BASE_DIR).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "database": connection.vendor,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "password_hasher": settings.PASSWORD_HASHERS[0].rsplit(".", 1)[-1],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
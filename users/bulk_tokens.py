@@ -0,0 +1,68 @@
+# users/bulk_tokens.py
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, RefreshToken
+from oauth2_provider.settings import oauth2_settings
+from .db_router import shard_for_user
+from .jwt_tokens import new_access_token, new_opaque_token
+from .auth_backends import password_pipeline
+
+BATCH_SIZE = 1000
+# items per streamed chunk: users loaded, passwords checked and pairs written together
+CHUNK_SIZE = 100
+
+
+def issue_tokens_bulk(items, app, scope="read", check_password=True, chunk_size=CHUNK_SIZE):
+    """
+    Issue one token pair per item ({"username": ..., "password": ...}).
+
+    Yields one result dict per item, in input order, a chunk at a time: each
+    chunk's users are loaded with one query, its passwords are checked
+    concurrently by users.auth_backends.password_pipeline, and its pairs are
+    inserted with bulk_create in one transaction (one per token shard with
+    TOKEN_SHARDS) before its results are yielded.
+    """
+    for start in range(0, len(items), chunk_size):
+        yield from _issue_chunk(items[start:start + chunk_size], app, scope, check_password)
+
+
+def _issue_chunk(items, app, scope, check_password):
+    User = get_user_model()
+    usernames = {item.get("username") for item in items if item.get("username")}
+    users = {u.get_username(): u for u in User.objects.filter(**{f"{User.USERNAME_FIELD}__in": usernames})}
+
+    results = [{"username": item.get("username"), "error": "invalid_credentials"} for item in items]
+    candidates = [(i, users.get(item.get("username"))) for i, item in enumerate(items)]
+    candidates = [(i, user) for i, user in candidates if user is not None and user.is_active]
+    if check_password:
+        checked = password_pipeline.check_passwords([(user, items[i].get("password") or "") for i, user in candidates])
+        for (i, _), ok in zip(candidates, checked):
+            if ok is None:
+                # the hashing pool stayed saturated: worth a retry, unlike a wrong password
+                results[i]["error"] = "temporarily_unavailable"
+        candidates = [c for c, ok in zip(candidates, checked) if ok]
+
+    expires_in = oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS
+    expires = timezone.now() + timedelta(seconds=expires_in)
+    shards = {}
+    for i, user in candidates:
+        access_token = AccessToken(
+            user=user, scope=scope, expires=expires, application=app,
+            token=new_access_token(app, user, scope, expires_in),
+        )
+        results[i] = {"username": results[i]["username"], "access_token": access_token.token, "token_type": "Bearer",
+                      "expires_in": expires_in, "scope": scope}
+        shards.setdefault(shard_for_user(user.pk), []).append((access_token, results[i]))
+    for db, chunk in shards.items():
+        with transaction.atomic(using=db):
+            access_tokens = AccessToken.objects.using(db).bulk_create([at for at, _ in chunk], batch_size=BATCH_SIZE)
+            refresh_tokens = [
+                RefreshToken(user=at.user, token=new_opaque_token(at.user), application=app, access_token=at)
+                for at in access_tokens
+            ]
+            RefreshToken.objects.using(db).bulk_create(refresh_tokens, batch_size=BATCH_SIZE)
+        for (_, result), refresh_token in zip(chunk, refresh_tokens):
+            result["refresh_token"] = refresh_token.token
+    return results
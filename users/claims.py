@@ -0,0 +1,109 @@
+# users/claims.py
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from .models import User
+from .serializers import UserSerializer
+
+FIELDS = ("id", "username", "email", "first_name", "last_name", "role", "is_staff")
+
+
+def _conf():
+    return getattr(settings, "USER_CLAIMS", {})
+
+
+class ClaimsCache:
+    """
+    Per-user claims (profile fields plus group names) with a precomputed
+    ETag, kept in a Django cache and dropped by the User/group signals in
+    users.signals. A miss costs one query, always against the primary so a
+    lagging replica cannot put back what was just invalidated.
+    """
+
+    def __init__(self, ttl=300, cache_alias="default"):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, user_id):
+        return f"user_claims:{user_id}"
+
+    def get(self, user_id):
+        """(claims, etag) for a user id, or None if the user does not exist."""
+        entry = self.cache.get(self._key(user_id)) if self.ttl else None
+        if entry is None:
+            entry = self._load(user_id)
+            if entry is not None and self.ttl:
+                self.cache.set(self._key(user_id), entry, timeout=self.ttl)
+        return entry
+
+    async def aget(self, user_id):
+        entry = await self.cache.aget(self._key(user_id)) if self.ttl else None
+        if entry is None:
+            entry = await self._aload(user_id)
+            if entry is not None and self.ttl:
+                await self.cache.aset(self._key(user_id), entry, timeout=self.ttl)
+        return entry
+
+    def invalidate(self, *user_ids):
+        if user_ids:
+            self.cache.delete_many([self._key(pk) for pk in user_ids])
+
+    def _rows(self, user_id):
+        # one row per group (LEFT JOIN), so fields and group names come back in one query
+        return User.objects.using(router.db_for_write(User)).filter(pk=user_id) \
+            .values_list(*FIELDS, "groups__name").order_by("groups__name")
+
+    def _load(self, user_id):
+        return self._entry(list(self._rows(user_id)))
+
+    async def _aload(self, user_id):
+        return self._entry([row async for row in self._rows(user_id)])
+
+    def _entry(self, rows):
+        if not rows:
+            return None
+        claims = dict(zip(FIELDS, rows[0]))
+        claims["groups"] = [row[-1] for row in rows if row[-1] is not None]
+        digest = hashlib.sha256(json.dumps(claims, sort_keys=True).encode()).hexdigest()[:32]
+        return claims, f'W/"{digest}"'
+
+
+def userinfo(claims):
+    return {field: claims[field] for field in UserSerializer.Meta.fields}
+
+
+def profile(claims):
+    return {"username": claims["username"], "email": claims["email"],
+            "is_staff": claims["is_staff"], "roles": claims["groups"]}
+
+
+def not_modified(request, etag):
+    """True if the request's If-None-Match already names this ETag."""
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    tags = parse_etags(header)
+    # weak comparison, as If-None-Match requires
+    return "*" in tags or etag.removeprefix("W/") in (t.removeprefix("W/") for t in tags)
+
+
+def set_cache_headers(response, etag):
+    response["ETag"] = etag
+    # clients may keep the body but must revalidate; shared caches must not store it
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ("Authorization",))
+    return response
+
+
+claims_cache = ClaimsCache(
+    ttl=_conf().get("TTL_SECONDS", 300),
+    cache_alias=_conf().get("CACHE_ALIAS", "default"),
+)
@@ -0,0 +1,57 @@
+# users/consent.py
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+
+def _conf():
+    return getattr(settings, "CONSENT", {})
+
+
+class ConsentCache:
+    """
+    Scope sets a user approved per application, so a repeat /o/authorize/
+    with approval_prompt=auto redirects straight away instead of DOT scanning
+    the AccessToken table for a token with those scopes. One cache entry per
+    user ({(application_id, scopes): expires}), so revoking a user's tokens
+    forgets all of their consents with one delete. An entry also records the
+    application's `updated` time: editing the application asks again.
+    """
+
+    def __init__(self, ttl=3600, cache_alias="default"):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _key(self, user_id):
+        return f"consent:{user_id}"
+
+    def _scopes(self, application, scopes):
+        return application.pk, application.updated.timestamp(), " ".join(sorted(set(scopes)))
+
+    def allows(self, user_id, application, scopes):
+        if not self.ttl:
+            return False
+        expires = (self.cache.get(self._key(user_id)) or {}).get(self._scopes(application, scopes))
+        return expires is not None and expires > time.time()
+
+    def remember(self, user_id, application, scopes):
+        if not self.ttl:
+            return
+        now = time.time()
+        entry = {k: v for k, v in (self.cache.get(self._key(user_id)) or {}).items() if v > now}
+        entry[self._scopes(application, scopes)] = now + self.ttl
+        self.cache.set(self._key(user_id), entry, timeout=self.ttl)
+
+    def forget(self, *user_ids):
+        if user_ids:
+            self.cache.delete_many([self._key(pk) for pk in user_ids])
+
+
+consent_cache = ConsentCache(
+    ttl=_conf().get("TTL_SECONDS", 3600),
+    cache_alias=_conf().get("CACHE_ALIAS", "default"),
+)
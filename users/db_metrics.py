@@ -0,0 +1,23 @@
+# users/db_metrics.py
+from collections import Counter
+from django.db import connections
+
+# per-process count of new DB connections by alias, fed by the connection_created signal
+connections_opened = Counter()
+
+
+def pool_stats():
+    """Connection reuse and pool figures for every configured database, for this process."""
+    stats = {}
+    for alias in connections:
+        wrapper = connections[alias]
+        entry = {
+            "vendor": wrapper.vendor,
+            "conn_max_age": wrapper.settings_dict.get("CONN_MAX_AGE", 0),
+            "connections_opened": connections_opened[alias],
+        }
+        pool = getattr(wrapper, "pool", None)  # psycopg pool, Django >= 5.1
+        if pool is not None:
+            entry["pool"] = pool.get_stats()
+        stats[alias] = entry
+    return stats
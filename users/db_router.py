@@ -0,0 +1,191 @@
+# users/db_router.py
+import base64
+import contextvars
+import functools
+import json
+import zlib
+from contextlib import contextmanager
+from django.conf import settings
+
+REPLICA = "replica"
+_use_replica = contextvars.ContextVar("use_replica", default=False)
+
+
+@contextmanager
+def replica_reads():
+    """Route ORM reads in this block to the replica, when one is configured."""
+    reset = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(reset)
+
+
+def read_replica(view_method):
+    """
+    Decorator for a view handler (get/post) whose queries can tolerate
+    replication lag. Authentication has already run against the primary by
+    the time the handler is called, so a token issued a moment ago still works.
+    """
+    @functools.wraps(view_method)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view_method(*args, **kwargs)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    """Writes and migrations go to default; reads go to the replica only inside replica_reads()."""
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as default
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+# token, grant and OTP rows; users, applications and everything else stay on default
+SHARDED_MODELS = frozenset({
+    "oauth2_provider.accesstoken", "oauth2_provider.refreshtoken", "oauth2_provider.idtoken",
+    "oauth2_provider.grant", "otp_grant.otpcode",
+})
+_token_shard = contextvars.ContextVar("token_shard", default=None)
+
+
+def token_shards():
+    return getattr(settings, "TOKEN_SHARDS", [])
+
+
+def token_databases():
+    """Every database that can hold token rows: default (user-less tokens, rows from before sharding) and the shards."""
+    return ["default", *token_shards()]
+
+
+def shard_for_user(user_id):
+    """The database holding a user's tokens and codes: a stable hash of the user id over TOKEN_SHARDS."""
+    shards = token_shards()
+    if not shards or user_id is None:
+        return "default"
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def tag_token(value, user_id):
+    """Prefix an opaque token or code with its shard's index, so a lookup by value goes to one database."""
+    db = shard_for_user(user_id)
+    if db == "default":
+        return value
+    return f"{token_shards().index(db)}.{value}"
+
+
+def _jwt_shard(value):
+    try:
+        payload = value.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return "default"
+    # client_credentials tokens carry the client as their subject and are not sharded
+    sub = claims.get("sub")
+    return "default" if sub is None or sub == claims.get("client_id") else shard_for_user(sub)
+
+
+def shard_for_token(value):
+    """
+    The database to look a token or code up in: the tag_token() prefix of an
+    opaque value, or the (unverified, routing only) subject of a JWT access or
+    ID token. Untagged values were issued before sharding and live on default.
+    """
+    shards = token_shards()
+    if not shards or not value:
+        return "default"
+    head, _, rest = value.partition(".")
+    if not rest:
+        return "default"
+    if "." in rest:
+        return _jwt_shard(value)
+    return shards[int(head)] if head.isdigit() and int(head) < len(shards) else "default"
+
+
+@contextmanager
+def token_shard(db):
+    """Route token queries that carry no instance hint (DOT's lookups by value, revoke()) to `db` in this block."""
+    reset = _token_shard.set(db)
+    try:
+        yield
+    finally:
+        _token_shard.reset(reset)
+
+
+def drop_shard_foreign_keys(using):
+    """
+    Shards hold token rows whose users and applications live on default, so
+    they cannot enforce foreign keys: drop the token tables' constraints on
+    shard `using` after migrate. SQLite shards use users.shard_sqlite3 instead.
+    """
+    from django.apps import apps
+    from django.db import connections
+    connection = connections[using]
+    if connection.vendor == "sqlite" or using not in token_shards():
+        return
+    with connection.cursor() as cursor:
+        tables = set(connection.introspection.table_names(cursor))
+        constraints = [
+            (model._meta.db_table, name)
+            for model in apps.get_models()
+            if model._meta.label_lower in SHARDED_MODELS and model._meta.db_table in tables
+            for name, info in connection.introspection.get_constraints(cursor, model._meta.db_table).items()
+            if info["foreign_key"]
+        ]
+    with connection.schema_editor() as editor:
+        for table, name in constraints:
+            editor.execute(editor.sql_delete_fk % {"table": editor.quote_name(table), "name": editor.quote_name(name)})
+
+
+class TokenShardRouter:
+    """
+    Token, grant and OTP rows live on TOKEN_SHARDS, picked by shard_for_user().
+    New rows go to their user's shard; a loaded row's relations follow the row
+    (its user and application back to default); lookups by token value run
+    inside token_shard(shard_for_token(value)). Anything else is left to the
+    next router. With no TOKEN_SHARDS configured it never answers.
+    """
+
+    def _db(self, model, hints):
+        if not token_shards():
+            return None
+        instance = hints.get("instance")
+        if model._meta.label_lower not in SHARDED_MODELS:
+            # a user or application reached from a token loaded on a shard
+            if instance is not None and instance._state.db in token_shards():
+                return "default"
+            return None
+        if instance is not None:
+            label = instance._meta.label_lower
+            if label in SHARDED_MODELS:
+                return shard_for_user(instance.user_id) if instance._state.adding else instance._state.db
+            if label == settings.AUTH_USER_MODEL.lower():
+                return shard_for_user(instance.pk)
+        return _token_shard.get()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # a token row references its user and application by id, across databases
+        if SHARDED_MODELS.intersection((obj1._meta.label_lower, obj2._meta.label_lower)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
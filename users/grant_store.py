@@ -0,0 +1,118 @@
+# users/grant_store.py
+import hashlib
+import time
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from oauth2_provider.models import get_grant_model
+from .db_router import shard_for_token
+from .private_api import raw_delete
+
+# what the token endpoint needs back from /o/authorize/, besides the code itself
+FIELDS = ("application_id", "user_id", "redirect_uri", "scope", "code_challenge",
+          "code_challenge_method", "nonce", "claims", "resource")
+
+
+class BaseGrantStore:
+    """
+    Storage for authorization codes between /o/authorize/ and /o/token/.
+    Grants are dicts of FIELDS plus "expires" (epoch seconds). consume() must
+    be atomic: when a code is redeemed twice concurrently, exactly one caller
+    gets the grant back.
+    """
+
+    def __init__(self, ttl_seconds=300, **options):
+        self.ttl_seconds = ttl_seconds
+
+    def save(self, code, grant):
+        raise NotImplementedError
+
+    def get(self, code):
+        """The grant for a code without consuming it, or None."""
+        raise NotImplementedError
+
+    def consume(self, code, application_id):
+        """Remove and return the grant if it belongs to the application, else None."""
+        raise NotImplementedError
+
+
+class DatabaseGrantStore(BaseGrantStore):
+    """
+    DOT's Grant table, on the token shard the code is tagged with
+    (users.db_router). Expired rows are left to `manage.py purge_expired`.
+    """
+
+    def __init__(self, ttl_seconds=300, **options):
+        super().__init__(ttl_seconds)
+        self.model = get_grant_model()
+
+    def save(self, code, grant):
+        expires = timezone.now() + timedelta(seconds=self.ttl_seconds)
+        self.model.objects.using(shard_for_token(code)).create(code=code, expires=expires, **grant)
+
+    def _row(self, code, **filters):
+        rows = self.model.objects.using(shard_for_token(code)).filter(code=code, **filters)
+        row = rows.values("pk", "expires", *FIELDS).first()
+        if row is not None:
+            row["expires"] = row["expires"].timestamp()
+        return row
+
+    def get(self, code):
+        row = self._row(code)
+        if row is not None:
+            del row["pk"]
+        return row
+
+    def consume(self, code, application_id):
+        row = self._row(code, application_id=application_id)
+        if row is None:
+            return None
+        db = shard_for_token(code)
+        # the DELETE's row count decides which of two concurrent redemptions wins
+        if not raw_delete(self.model.objects.using(db).filter(pk=row.pop("pk")), db):
+            return None
+        return row
+
+
+class CacheGrantStore(BaseGrantStore):
+    """
+    Django cache (Redis in production, LocMemCache locally): no table writes,
+    and codes expire natively, so nothing needs purging. Keys hold a digest
+    of the code, never the code itself.
+    """
+
+    def __init__(self, ttl_seconds=300, cache_alias="default", **options):
+        super().__init__(ttl_seconds)
+        self.cache = caches[cache_alias]
+
+    def _key(self, code):
+        return "grant:" + hashlib.sha256(code.encode()).hexdigest()
+
+    def save(self, code, grant):
+        self.cache.set(self._key(code), {**grant, "expires": time.time() + self.ttl_seconds},
+                       timeout=self.ttl_seconds)
+
+    def get(self, code):
+        return self.cache.get(self._key(code))
+
+    def consume(self, code, application_id):
+        key = self._key(code)
+        grant = self.cache.get(key)
+        # delete() reports whether this caller removed the key (DEL on Redis), so only one redemption wins
+        if grant is None or grant["application_id"] != application_id or not self.cache.delete(key):
+            return None
+        return grant
+
+
+def is_expired(grant):
+    return grant["expires"] <= time.time()
+
+
+@lru_cache(maxsize=None)
+def get_grant_store():
+    conf = dict(getattr(settings, "GRANT_STORE", {}))
+    store_class = import_string(conf.pop("STORE", "users.grant_store.DatabaseGrantStore"))
+    return store_class(**{k.lower(): v for k, v in conf.items()})
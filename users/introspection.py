@@ -0,0 +1,139 @@
+# users/introspection.py
+import base64
+import calendar
+import hashlib
+import re
+from urllib.parse import unquote_plus
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Application
+from .app_registry import app_registry
+from .db_router import shard_for_token
+from .private_api import check_client_secret
+from .token_cache import token_checksum
+
+User = get_user_model()
+
+INACTIVE = {"active": False}
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+def _conf():
+    return getattr(settings, "INTROSPECTION", {})
+
+
+def client_credentials(request):
+    auth = request.META.get("HTTP_AUTHORIZATION", "")
+    if auth[:6].lower() == "basic ":
+        try:
+            decoded = base64.b64decode(auth[6:].strip()).decode("utf-8")
+            client_id, client_secret = decoded.split(":", 1)
+        except (ValueError, UnicodeDecodeError):
+            return None, None
+        return unquote_plus(client_id), unquote_plus(client_secret)
+    data = getattr(request, "data", request.POST)
+    return data.get("client_id"), data.get("client_secret")
+
+
+def authenticate_client(request):
+    """
+    Return the client_id of the confidential client calling the endpoint, or None.
+    Successful checks are cached briefly so a busy gateway does not pay for a
+    client-secret hash on every call.
+    """
+    client_id, client_secret = client_credentials(request)
+    if not client_id or not client_secret:
+        return None
+    key = "introspect_client:" + hashlib.sha256(f"{client_id}:{client_secret}".encode("utf-8")).hexdigest()
+    if cache.get(key):
+        return client_id
+    app = app_registry.get(client_id)
+    if app is None or app.client_type != Application.CLIENT_CONFIDENTIAL:
+        return None
+    if not check_client_secret(client_secret, app.client_secret):
+        return None
+    cache.set(key, True, timeout=_conf().get("CLIENT_AUTH_CACHE_SECONDS", 60))
+    return client_id
+
+
+def _active_tokens_queries(tokens):
+    # one query per database holding any of the tokens; only default can join users and applications
+    checksums = {}
+    for token in tokens:
+        checksums.setdefault(shard_for_token(token), set()).add(token_checksum(token))
+    now = timezone.now()
+    for db, chunk in checksums.items():
+        query = AccessToken.objects.filter(token_checksum__in=chunk, expires__gt=now)
+        fields = ("token_checksum", "scope", "expires", "user_id", "application_id")
+        if db == "default":
+            yield query.values(*fields, "user__username", "application__client_id")
+        else:
+            yield query.using(db).values(*fields)
+
+
+def _with_owners(rows):
+    # rows read on a shard: usernames from default, client ids from the registry
+    sharded = [row for row in rows if "user__username" not in row]
+    if sharded:
+        usernames = dict(User.objects.filter(pk__in={row["user_id"] for row in sharded}).values_list("pk", "username"))
+        for row in sharded:
+            app = app_registry.get_by_pk(row["application_id"]) if row["application_id"] else None
+            row["user__username"] = usernames.get(row["user_id"])
+            row["application__client_id"] = app.client_id if app else None
+    return {row["token_checksum"]: row for row in rows}
+
+
+def load_active_tokens(tokens):
+    """Map token checksum -> row for the live tokens among `tokens`, using one query per token database."""
+    return _with_owners([row for query in _active_tokens_queries(tokens) for row in query])
+
+
+async def aload_active_tokens(tokens):
+    rows = [row for query in _active_tokens_queries(tokens) async for row in query]
+    if all("user__username" in row for row in rows):
+        return {row["token_checksum"]: row for row in rows}
+    return await sync_to_async(_with_owners)(rows)
+
+
+def introspect_tokens(tokens, rows=None):
+    """RFC 7662 response dict for each token, in input order."""
+    if rows is None:
+        rows = load_active_tokens(tokens)
+    results = []
+    for token in tokens:
+        row = rows.get(token_checksum(token))
+        if row is None:
+            results.append(INACTIVE)
+            continue
+        data = {
+            "active": True,
+            "scope": row["scope"],
+            "client_id": row["application__client_id"],
+            "token_type": "Bearer",
+            "exp": calendar.timegm(row["expires"].utctimetuple()),
+        }
+        if row["user_id"] is not None:
+            data["sub"] = str(row["user_id"])
+            data["username"] = row["user__username"]
+        results.append(data)
+    return results
+
+
+def cache_max_age(request, results):
+    """
+    Seconds the caller may cache these results: the client's own
+    `Cache-Control: max-age=N` hint, capped by the server limit and by the
+    earliest expiry among the active tokens.
+    """
+    max_age = _conf().get("MAX_CACHE_SECONDS", 60)
+    hint = MAX_AGE_RE.search(request.META.get("HTTP_CACHE_CONTROL", ""))
+    if hint:
+        max_age = min(max_age, int(hint.group(1)))
+    now = calendar.timegm(timezone.now().utctimetuple())
+    for result in results:
+        if result["active"]:
+            max_age = min(max_age, result["exp"] - now)
+    return max(max_age, 0)
@@ -0,0 +1,159 @@
+# users/jwt_tokens.py
+import json
+import time
+import uuid
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from jwcrypto import jwk, jwt
+from jwcrypto.common import JWException
+from oauthlib.oauth2.rfc6749.tokens import random_token_generator
+from .db_router import tag_token
+
+ALGORITHMS = {"RS256": {"kty": "RSA", "size": 2048}, "ES256": {"kty": "EC", "crv": "P-256"}}
+
+
+def _conf():
+    return getattr(settings, "JWT_ACCESS_TOKENS", {})
+
+
+def _alg_for(key):
+    return "ES256" if key.get("kty") == "EC" else "RS256"
+
+
+class KeyStore:
+    """
+    Signing keys stored as PEM files named <kid>.pem. The newest file (or
+    JWT_ACCESS_TOKENS['ACTIVE_KID']) signs new tokens; older keys stay in the
+    JWKS so tokens they signed keep verifying until the files are removed.
+    """
+
+    def __init__(self, keys_dir, active_kid=None):
+        self.keys_dir = Path(keys_dir)
+        self.active_kid = active_kid
+        self._keys = None
+
+    def load(self):
+        keys = []
+        for path in sorted(self.keys_dir.glob("*.pem"), key=lambda p: p.stat().st_mtime):
+            key = jwk.JWK.from_pem(path.read_bytes())
+            key.update(kid=path.stem, alg=_alg_for(key), use="sig")
+            keys.append(key)
+        self._keys = keys
+        return keys
+
+    @property
+    def keys(self):
+        # loaded once per process; call reload() after a rotation. While there are none yet,
+        # look again each time, so a key created by `rotate_jwt_key` is picked up without a restart
+        if not self._keys:
+            self.load()
+        return self._keys
+
+    def reload(self):
+        self._keys = None
+
+    @property
+    def active(self):
+        if not self.keys:
+            raise ImproperlyConfigured(
+                f"No JWT signing keys in {self.keys_dir}; run `python manage.py rotate_jwt_key`."
+            )
+        if self.active_kid:
+            for key in self.keys:
+                if key.get("kid") == self.active_kid:
+                    return key
+            raise ImproperlyConfigured(f"JWT signing key {self.active_kid} not found in {self.keys_dir}")
+        return self.keys[-1]
+
+    def generate(self, algorithm="RS256"):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unsupported algorithm {algorithm}; use one of {', '.join(ALGORITHMS)}")
+        key = jwk.JWK.generate(**ALGORITHMS[algorithm])
+        kid = key.thumbprint()
+        self.keys_dir.mkdir(parents=True, exist_ok=True)
+        path = self.keys_dir / f"{kid}.pem"
+        path.write_bytes(key.export_to_pem(private_key=True, password=None))
+        path.chmod(0o600)
+        self.reload()
+        return kid
+
+    def jwks(self):
+        return {"keys": [key.export_public(as_dict=True) for key in self.keys]}
+
+    def public_keyset(self):
+        keyset = jwk.JWKSet()
+        for key in self.keys:
+            keyset.add(jwk.JWK(**key.export_public(as_dict=True)))
+        return keyset
+
+
+key_store = KeyStore(
+    _conf().get("KEYS_DIR", Path(settings.BASE_DIR) / "keys"),
+    active_kid=_conf().get("ACTIVE_KID"),
+)
+
+
+def uses_jwt(application):
+    """Opaque tokens stay the default; JWT is opted into per client_id (or '*' for all)."""
+    client_ids = _conf().get("CLIENT_IDS", [])
+    return application is not None and ("*" in client_ids or application.client_id in client_ids)
+
+
+def encode_access_token(application, user, scope, expires_in):
+    key = key_store.active
+    now = int(time.time())
+    claims = {
+        "iss": _conf().get("ISSUER", ""),
+        "sub": str(user.pk) if user is not None else application.client_id,
+        "client_id": application.client_id,
+        "scope": scope,
+        "iat": now,
+        "exp": now + int(expires_in),
+        "jti": uuid.uuid4().hex,
+    }
+    if user is not None:
+        claims["username"] = user.get_username()
+    token = jwt.JWT(header={"alg": key.get("alg"), "kid": key.get("kid"), "typ": "at+jwt"}, claims=claims)
+    token.make_signed_token(key)
+    return token.serialize()
+
+
+def new_access_token(application, user, scope, expires_in):
+    """Token string for the custom token endpoints: JWT or opaque per application."""
+    if uses_jwt(application):
+        return encode_access_token(application, user, scope, expires_in)
+    return new_opaque_token(user)
+
+
+def new_opaque_token(user):
+    """Opaque token string, tagged with the user's token shard."""
+    return tag_token(uuid.uuid4().hex, user.pk if user is not None else None)
+
+
+def access_token_generator(request, refresh_token=False):
+    """OAUTH2_PROVIDER['ACCESS_TOKEN_GENERATOR'] hook used by DOT's TokenView."""
+    client = getattr(request, "client", None)
+    user = getattr(request, "user", None)
+    if request.grant_type == "client_credentials":
+        user = None
+    if not uses_jwt(client):
+        return tag_token(random_token_generator(request), getattr(user, "pk", None))
+    return encode_access_token(client, user, " ".join(request.scopes or []), request.expires_in)
+
+
+def refresh_token_generator(request):
+    """OAUTH2_PROVIDER['REFRESH_TOKEN_GENERATOR'] hook: an opaque token tagged with the user's token shard."""
+    return tag_token(random_token_generator(request), getattr(getattr(request, "user", None), "pk", None))
+
+
+def decode_access_token(token, keyset=None):
+    """
+    Verify signature and expiry locally, as a resource server would with the
+    published JWKS. Returns the claims dict, or None if the token is not valid.
+    """
+    try:
+        verified = jwt.JWT(jwt=token, key=keyset or key_store.public_keyset(), check_claims={"exp": None})
+    except (JWException, ValueError):
+        return None
+    return json.loads(verified.claims)
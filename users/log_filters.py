@@ -0,0 +1,14 @@
+# users/log_filters.py
+import logging
+import random
+
+
+class SampleDebug(logging.Filter):
+    """Pass only `rate` of DEBUG records (0..1); other levels always pass."""
+
+    def __init__(self, rate=0.01):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
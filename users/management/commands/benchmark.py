@@ -0,0 +1,64 @@
+import json
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from users import benchmark
+from users.ratelimit import limiter
+
+METRICS = ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+
+class Command(BaseCommand):
+    help = ('Benchmark the token, OTP and introspection endpoints in-process against the configured database '
+            '(seed first with: manage.py seed_demo_users --bench-users N)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', choices=[[]] + list(benchmark.SCENARIOS),
+                            help='scenarios to run (default: all)')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=50, help='timed requests per worker')
+        parser.add_argument('--output', help='write results as JSON to this file')
+        parser.add_argument('--compare', help='JSON file from an earlier run to compare against')
+        parser.add_argument('--rate-limits', action='store_true',
+                            help='keep RATE_LIMITS on (off by default: every worker shares one IP)')
+        parser.add_argument('--verbose-logging', action='store_true',
+                            help='keep DEBUG..WARNING logging on (it is muted by default so it does not skew timings)')
+
+    def handle(self, *args, **options):
+        user_count = get_user_model().objects.filter(username__startswith=benchmark.USERNAME_PREFIX).count()
+        if not user_count:
+            raise CommandError('No benchmark users; run: manage.py seed_demo_users --bench-users 100')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+        if not options['rate_limits']:
+            limiter.enabled = False
+        if not options['verbose_logging']:
+            logging.disable(logging.WARNING)
+
+        report = {'environment': benchmark.environment(),
+                  'settings': {'concurrency': options['concurrency'], 'requests_per_worker': options['requests'],
+                               'users': user_count},
+                  'results': {}}
+        for name in options['scenarios'] or benchmark.SCENARIOS:
+            result = benchmark.run_scenario(name, options['concurrency'], options['requests'], user_count)
+            report['results'][name] = result
+            if not result['requests']:
+                self.stdout.write(self.style.ERROR(f'{name:12} all {result["errors"]} requests failed'))
+                continue
+            line = (f'{name:12} {result["requests"]:6} req {result["errors"]:4} err '
+                    f'{result["throughput_rps"]:8} req/s  p50 {result["p50_ms"]:7} ms  p95 {result["p95_ms"]:7} ms  '
+                    f'p99 {result["p99_ms"]:7} ms  {result["queries_per_request"]:5} queries/req')
+            if baseline and name in baseline:
+                changes = []
+                for metric in METRICS:
+                    before = baseline[name].get(metric)
+                    if before:
+                        changes.append(f'{metric} {(result[metric] - before) / before:+.0%}')
+                line += '\n' + ' ' * 13 + 'vs baseline: ' + ', '.join(changes)
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
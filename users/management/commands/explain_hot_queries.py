@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, RefreshToken
+from otp_grant.models import OTPCode
+from users.purge import purge_targets
+from users.token_cache import token_checksum
+
+class Command(BaseCommand):
+    help = 'Print the EXPLAIN plan of each hot query, to check which indexes the database uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (Postgres; runs the queries)')
+
+    def hot_queries(self):
+        now = timezone.now()
+        user_id, app_id = 1, 1
+        yield 'otp consume (user, code, live)', OTPCode.objects.filter(user_id=user_id, code='123456', expires_at__gte=now)
+        yield 'otp issue cleanup (user, expired)', OTPCode.objects.filter(user_id=user_id, expires_at__lt=now)
+        yield 'token lookup by checksum', AccessToken.objects.filter(
+            token_checksum=token_checksum('x'), expires__gt=now).select_related('user', 'application')
+        yield 'logout: access tokens by user', AccessToken.objects.filter(user_id=user_id)
+        yield 'logout: refresh tokens by user', RefreshToken.objects.filter(user_id=user_id)
+        yield 'revoke by user and application', AccessToken.objects.filter(user_id=user_id, application_id=app_id)
+        # same shape as one purge_expired batch
+        for name, model, query in purge_targets(now):
+            yield f'purge {name}', model.objects.filter(query, pk__gt=0).order_by('pk').values_list('pk', flat=True)[:1000]
+
+    def handle(self, *args, **options):
+        explain_options = {'analyze': True} if options['analyze'] and connection.vendor == 'postgresql' else {}
+        self.stdout.write(f'database: {connection.vendor}')
+        for label, queryset in self.hot_queries():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{label}'))
+            self.stdout.write(queryset.explain(**explain_options))
@@ -0,0 +1,39 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from oauth2_provider.models import Application
+from users.app_registry import app_registry
+from users.bulk_tokens import issue_tokens_bulk
+
+class Command(BaseCommand):
+    help = 'Issue access/refresh tokens for many users at once; prints one JSON result per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='one "username" or "username,password" per line; "-" for stdin')
+        parser.add_argument('--client-id', help="application to issue for (default: SERVICE_APPLICATIONS['token_bulk'], as /api/token/bulk/)")
+        parser.add_argument('--no-password', action='store_true', help='skip the password check (trusted operator input)')
+
+    def handle(self, *args, **options):
+        if options['file'] == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(options['file']) as f:
+                lines = f.read().splitlines()
+        items = []
+        for line in filter(None, (l.strip() for l in lines)):
+            username, _, password = line.partition(',')
+            items.append({'username': username, 'password': password})
+
+        if options['client_id']:
+            app = Application.objects.filter(client_type=Application.CLIENT_CONFIDENTIAL,
+                                             client_id=options['client_id']).first()
+        else:
+            app = app_registry.service_application('token_bulk')
+        if not app:
+            raise CommandError('No confidential application found — run create_service_app first')
+
+        issued = 0
+        for result in issue_tokens_bulk(items, app, check_password=not options['no_password']):
+            self.stdout.write(json.dumps(result))
+            issued += 'access_token' in result
+        self.stderr.write(self.style.SUCCESS(f'Issued {issued} of {len(items)} token pairs for {app.name}'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from users.purge import purge_expired, purge_targets
+
+class Command(BaseCommand):
+    help = 'Delete expired/revoked tokens, grants and OTP codes in small batches (safe to run on a live database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='rows per DELETE (default PURGE_BATCH_SIZE)')
+        parser.add_argument('--sleep', type=float, help='seconds to pause between batches (default PURGE_SLEEP_SECONDS)')
+        parser.add_argument('--max-batches', type=int, help='stop after this many batches; run again to continue')
+        parser.add_argument('--only', action='append', choices=[name for name, _, _ in purge_targets()],
+                            help='limit to one kind of row (repeatable)')
+
+    def handle(self, *args, **options):
+        def progress(name, stats):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{name}: {stats["deleted"]} deleted in {stats["batches"]} batches ({stats["seconds"]}s)')
+
+        stats = purge_expired(batch_size=options['batch_size'], sleep=options['sleep'],
+                              max_batches=options['max_batches'], only=options['only'], progress=progress)
+        for name, target in stats.items():
+            rate = int(target['deleted'] / target['seconds']) if target['seconds'] else target['deleted']
+            self.stdout.write(f'{name}: {target["deleted"]} rows, {target["batches"]} batches, {rate} rows/s')
+        self.stdout.write(self.style.SUCCESS(f'Purged {sum(t["deleted"] for t in stats.values())} rows'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from oauth2_provider.models import Application
+from users.revocation import revoke_tokens
+
+class Command(BaseCommand):
+    help = 'Revoke all tokens of a client, a user and/or a scope in one pass (e.g. a compromised client)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--client-id', help='application client_id')
+        parser.add_argument('--username')
+        parser.add_argument('--scope', help='only tokens carrying this scope')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not (options['client_id'] or options['username'] or options['scope']):
+            raise CommandError('Give at least one of --client-id, --username or --scope')
+        application = user = None
+        if options['client_id']:
+            application = Application.objects.filter(client_id=options['client_id']).first()
+            if application is None:
+                raise CommandError(f'No application with client_id {options["client_id"]}')
+        if options['username']:
+            User = get_user_model()
+            user = User.objects.filter(username=options['username']).first()
+            if user is None:
+                raise CommandError(f'No user {options["username"]}')
+        counts = revoke_tokens(user=user, application=application, scope=options['scope'],
+                               batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Revoked {counts["access_tokens"]} access tokens, {counts["refresh_tokens"]} refresh tokens, '
+            f'{counts["id_tokens"]} ID tokens'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from users.jwt_tokens import ALGORITHMS, key_store
+
+class Command(BaseCommand):
+    help = 'Generate a new JWT signing key; it becomes the active key and older keys stay in the JWKS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='RS256')
+        parser.add_argument('--if-missing', action='store_true',
+                            help='only create a key when there is none yet (safe to run on every start)')
+
+    def handle(self, *args, **options):
+        if options['if_missing'] and key_store.keys:
+            self.stdout.write(f'Signing key present: kid={key_store.active.get("kid")}')
+            return
+        kid = key_store.generate(options['algorithm'])
+        self.stdout.write(self.style.SUCCESS(f'New {options["algorithm"]} signing key: kid={kid}'))
+        self.stdout.write(f'Keys published in JWKS: {", ".join(k.get("kid") for k in key_store.keys)}')
+        self.stdout.write('Restart the server processes (or set JWT_ACTIVE_KID) to start signing with it.')
@@ -1,8 +1,14 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from users import benchmark
 
 class Command(BaseCommand):
     help = 'Seed demo users (admin and regular)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bench-users', type=int, default=0,
+                            help=f'also create N {benchmark.USERNAME_PREFIX}<i> users and the benchmark applications')
+
     def handle(self, *args, **kwargs):
         User = get_user_model()
         if not User.objects.filter(username='admin').exists():
@@ -13,3 +19,7 @@ class Command(BaseCommand):
             u.role = 'user'
             u.save()
             self.stdout.write(self.style.SUCCESS('Created user: ranjeet / ranjeetpass'))
+        if kwargs['bench_users']:
+            created = benchmark.seed(kwargs['bench_users'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {created} benchmark users ({benchmark.USERNAME_PREFIX}0.. / {benchmark.PASSWORD}) and benchmark apps'))
@@ -0,0 +1,239 @@
+# users/metrics.py
+"""
+In-process metrics in the Prometheus text format, served at /metrics.
+
+Values are per worker process; scrape each worker (or run a single worker per
+container) the same way as /api/db-pool/.
+"""
+import functools
+import json
+import threading
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+# label values that come from the request are folded into "other": a client must not be able to mint new series
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+GRANT_TYPES = frozenset({"", "authorization_code", "password", "refresh_token", "client_credentials", "otp",
+                         "urn:ietf:params:oauth:grant-type:device_code"})
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _conf():
+    return getattr(settings, "METRICS", {})
+
+
+def _labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in zip(labelnames, values))
+    return "{%s}" % pairs
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            lines.extend(self._samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one slot per bucket, then +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def _samples(self, key, counts):
+        names = self.labelnames + ("le",)
+        lines = [f"{self.name}_bucket{_labels(names, key + (bound,))} {counts[i]}" for i, bound in enumerate(self.buckets)]
+        lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {counts[-2]}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {counts[-2]}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+request_duration = Histogram("http_request_duration_seconds", "Request latency by route.",
+                             ("route", "method", "status"))
+request_queries = Histogram("http_request_db_queries", "DB queries per request by route.", ("route",), QUERY_BUCKETS)
+request_db_duration = Histogram("http_request_db_duration_seconds", "DB time per request by route.", ("route",))
+token_requests = Counter("oauth_token_requests_total", "Token endpoint results by grant type and outcome.",
+                         ("endpoint", "grant_type", "outcome"))
+refresh_rotations = Counter("oauth_refresh_rotations_total", "Refresh token rotations by outcome.", ("outcome",))
+otp_verifications = Counter("otp_verifications_total", "OTP checks by outcome.", ("outcome",))
+
+
+def render():
+    from .db_metrics import connections_opened
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines += ["# HELP db_connections_opened_total New DB connections opened.",
+              "# TYPE db_connections_opened_total counter"]
+    lines += [f'db_connections_opened_total{{alias="{alias}"}} {n}' for alias, n in sorted(connections_opened.items())]
+    return "\n".join(lines) + "\n"
+
+
+class _QueryTimer:
+    """connection.execute_wrapper that counts and times queries; no DEBUG cursor needed."""
+
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def _known(value, known):
+    return value if value in known else "other"
+
+
+def _route(request):
+    match = getattr(request, "resolver_match", None)
+    # the route pattern, not the path, keeps label cardinality bounded
+    return match.route if match is not None else "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Latency, DB query count and DB time per route. Under ASGI the async views
+    run their queries in sync_to_async threads, so only latency is recorded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, None)
+        return response
+
+    def _record(self, request, response, elapsed, timer):
+        route = _route(request)
+        request_duration.observe(elapsed, route=route, method=_known(request.method, HTTP_METHODS),
+                                 status=response.status_code)
+        if timer is not None:
+            request_queries.observe(timer.count, route=route)
+            request_db_duration.observe(timer.seconds, route=route)
+
+
+def _outcome(response):
+    if response.status_code == 200:
+        return "issued"
+    if getattr(response, "streaming", False):
+        return f"http_{response.status_code}"
+    try:
+        return json.loads(response.content).get("error") or f"http_{response.status_code}"
+    except (ValueError, AttributeError):
+        return f"http_{response.status_code}"
+
+
+def count_token_requests(endpoint, grant_type=None):
+    """
+    Count a token view's results in oauth_token_requests_total. The outcome
+    is "issued" or the OAuth error code of the response; grant_type defaults
+    to the request's grant_type parameter, "other" when it is not a known one.
+    """
+    def decorator(view):
+        def record(requested_grant, response):
+            token_requests.inc(endpoint=endpoint, grant_type=_known(requested_grant, GRANT_TYPES),
+                               outcome=_outcome(response))
+
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                requested_grant = grant_type or request.POST.get("grant_type", "")
+                response = await view(request, *args, **kwargs)
+                record(requested_grant, response)
+                return response
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            requested_grant = grant_type or request.POST.get("grant_type", "")
+            response = view(request, *args, **kwargs)
+            record(requested_grant, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def metrics_view(request):
+    token = _conf().get("AUTH_TOKEN")
+    if token and request.META.get("HTTP_AUTHORIZATION", "") != f"Bearer {token}":
+        return HttpResponse(status=401)
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,48 @@
+# Indexes on django-oauth-toolkit tables for the queries this project runs
+# (logout/revocation by user and application, batched purge of dead rows).
+# The tables belong to oauth2_provider, so they are created with SQL rather
+# than AddIndex; the same statements work on SQLite and Postgres, and on
+# Postgres they are built CONCURRENTLY so a live table is not locked.
+
+from django.db import migrations
+
+INDEXES = [
+    # (model, index name, columns, partial-index condition)
+    ('AccessToken', 'oauth_at_user_app_idx', ['user_id', 'application_id'], None),
+    ('AccessToken', 'oauth_at_expires_idx', ['expires'], None),
+    ('RefreshToken', 'oauth_rt_revoked_idx', ['revoked'], 'revoked IS NOT NULL'),
+    ('RefreshToken', 'oauth_rt_orphaned_idx', ['id'], 'revoked IS NULL AND access_token_id IS NULL'),
+    ('Grant', 'oauth_grant_expires_idx', ['expires'], None),
+    ('IDToken', 'oauth_idt_expires_idx', ['expires'], None),
+]
+
+
+def create_indexes(apps, schema_editor):
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    quote = schema_editor.quote_name
+    for model_name, name, columns, condition in INDEXES:
+        table = apps.get_model('oauth2_provider', model_name)._meta.db_table
+        sql = 'CREATE INDEX %sIF NOT EXISTS %s ON %s (%s)' % (
+            concurrently, quote(name), quote(table), ', '.join(quote(c) for c in columns))
+        if condition:
+            sql += ' WHERE ' + condition
+        schema_editor.execute(sql)
+
+
+def drop_indexes(apps, schema_editor):
+    for _, name, _, _ in INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(name))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('oauth2_provider', '0022_refreshtoken_token_family_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes, atomic=False),
+    ]
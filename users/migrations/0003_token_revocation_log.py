@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_token_table_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenRevocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_checksum', models.CharField(max_length=64)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('revoked', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -5,3 +5,10 @@ class User(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user')
     def __str__(self):
         return self.username
+
+class TokenRevocation(models.Model):
+    """Append-only log of revoked access tokens for resource servers (users/revocation_feed.py)."""
+    token_checksum = models.CharField(max_length=64)
+    # the token's own expiry: past it the entry is of no use to anyone and is purged
+    expires = models.DateTimeField(db_index=True)
+    revoked = models.DateTimeField(auto_now_add=True)
@@ -1,63 +1,346 @@
 # users/oauth_validators.py
+import base64
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+from jwcrypto import jwt
+from oauth2_provider.bcp import bcp_compliant
+from oauth2_provider.models import AccessToken, RefreshToken
 from oauth2_provider.oauth2_validators import OAuth2Validator
+from oauth2_provider.settings import oauth2_settings
+from oauthlib.oauth2.rfc6749 import errors
 from django.contrib.auth import get_user_model
-from otp_grant.models import OTPCode
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from otp_grant.backends import VALID
+from .token_cache import token_cache
+from .app_registry import app_registry
+from .claims import claims_cache
+from .db_router import shard_for_token, shard_for_user, tag_token, token_shard
+from .grant_store import get_grant_store, is_expired
+from .jwt_tokens import key_store
+from .metrics import otp_verifications, refresh_rotations
+from .private_api import raw_delete
+from .revocation_feed import record
+from .token_minting import OTPRejected, token_minter
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+def _user_claims(request):
+    # one users.claims lookup per token request, shared by all the claim callables
+    if not hasattr(request, "user_claims"):
+        entry = claims_cache.get(request.user.pk)
+        request.user_claims = entry[0] if entry else {}
+    return request.user_claims
+
+
+def _claim(name):
+    return lambda request: _user_claims(request).get(name)
+
 
 class OTPGrantValidator(OAuth2Validator):
     """
-    Accepts otp grant and also treats password-as-OTP if it looks like OTP.
-    Compatible signature for validate_grant_type used by oauthlib/DOT.
+    DOT's validator plus the otp grant (otp_grant.server), OpenID Connect
+    claims and signing, grant_store codes and single-transaction token writes.
     """
 
+    # role and username come with the bare openid scope, so a client learns who
+    # logged in from the ID token alone, without calling /api/userinfo/
+    oidc_claim_scope = {
+        **OAuth2Validator.oidc_claim_scope,
+        "preferred_username": "openid",
+        "role": "openid",
+        "groups": "openid",
+    }
+
     def validate_grant_type(self, client_id, grant_type, client, request, *args, **kwargs):
-        # Accept 'otp' at validator-level (though token_proxy maps to password)
+        # otp is offered to the clients allowed the password grant
         if grant_type == "otp":
-            return True
+            return client.allows_grant_type(client.GRANT_PASSWORD)
         return super().validate_grant_type(client_id, grant_type, client, request, *args, **kwargs)
 
-    def validate_user(self, username, password, client, request, *args, **kwargs):
-        # If grant_type explicitly 'otp' treat as OTP
-        if getattr(request, "grant_type", None) == "otp":
-            return self._validate_otp_user(username, password, request)
-
-        # Also: if grant_type is 'password' but password looks like OTP (numeric, length 4/6)
-        # and there exists an OTPCode for this user with that code, treat it as OTP.
-        is_possible_otp = False
-        try:
-            if getattr(request, "grant_type", None) == "password":
-                if isinstance(password, str) and password.isdigit() and len(password) in (4,6):
-                    is_possible_otp = True
-        except Exception:
-            is_possible_otp = False
-
-        if is_possible_otp:
-            ok = self._validate_otp_user(username, password, request)
-            if ok:
-                return True
-            # else fallthrough to normal password validation (in case numeric password is real password)
-
-        # fallback to default (password grant normal behavior, PKCE etc.)
-        return super().validate_user(username, password, client, request, *args, **kwargs)
-
-    def _validate_otp_user(self, username, otp_code, request):
-        # validate OTPCode model, consume if valid
-        try:
-            user = User.objects.get(username=username)
-        except User.DoesNotExist:
+    def validate_otp_user(self, username, client, request, *args, **kwargs):
+        """otp_grant.grant_types.OTPGrant: the user the code was sent to; the code is checked when the tokens are saved."""
+        user = User.objects.filter(username=username, is_active=True).first()
+        if user is None:
+            otp_verifications.inc(outcome="no_user")
             return False
+        request.user = user
+        return True
 
-        otp_qs = OTPCode.objects.filter(user=user, code=otp_code).order_by("-created")
-        if not otp_qs.exists():
+    def _load_application(self, client_id, request):
+        # authenticate_client, validate_redirect_uri, validate_code, ... all come through
+        # here; seed request.client from the registry so DOT reuses it instead of querying
+        if not request.client:
+            request.client = app_registry.get(client_id)
+        return super()._load_application(client_id, request)
+
+    # authorization codes live in users.grant_store instead of DOT's Grant table
+    def save_authorization_code(self, client_id, code, request, *args, **kwargs):
+        if request.code_challenge_method == "plain" and bcp_compliant(
+                "COMPLIANT_BCP_RFC9700_PKCE_METHOD", 'The PKCE "plain" code_challenge_method'):
+            raise errors.InvalidRequestError(description='Unsupported "plain" code_challenge_method; use "S256".',
+                                             request=request)
+        # the code goes back in the redirect: tag it so /o/token/ finds the grant on the user's shard
+        code["code"] = tag_token(code["code"], request.user.pk)
+        get_grant_store().save(code["code"], {
+            "application_id": request.client.pk,
+            "user_id": request.user.pk,
+            "redirect_uri": request.redirect_uri,
+            "scope": " ".join(request.scopes),
+            "code_challenge": request.code_challenge or "",
+            "code_challenge_method": request.code_challenge_method or "",
+            "nonce": request.nonce or "",
+            "claims": json.dumps(request.claims or {}),
+            "resource": getattr(request, "resource", []),
+        })
+
+    def validate_code(self, client_id, code, client, request, *args, **kwargs):
+        # the code is spent here, before any other check: a second redemption can never pass validation
+        grant = request.grant = get_grant_store().consume(code, client.pk)
+        if grant is None or is_expired(grant):
+            return False
+        user = User.objects.filter(pk=grant["user_id"]).first()
+        if user is None:
             return False
-        otp = otp_qs.first()
-        if otp.is_valid():
-            otp.delete()
-            # note: oauthlib's request object expects request.user on success
-            try:
-                request.user = user
-            except Exception:
-                pass
+        request.scopes = grant["scope"].split(" ")
+        request.user = user
+        if grant["nonce"]:
+            request.nonce = grant["nonce"]
+        if grant["claims"]:
+            request.claims = json.loads(grant["claims"])
+        return True
+
+    def _grant(self, code, request):
+        # consumed by validate_code, or read once for the calls oauthlib makes before it
+        if getattr(request, "grant", None) is None:
+            request.grant = get_grant_store().get(code)
+        return request.grant or {}
+
+    def get_authorization_code_scopes(self, client_id, code, redirect_uri, request):
+        return self._grant(code, request).get("scope", "").split()
+
+    def get_code_challenge(self, code, request):
+        return self._grant(code, request).get("code_challenge") or None
+
+    def get_code_challenge_method(self, code, request):
+        return self._grant(code, request).get("code_challenge_method") or None
+
+    def confirm_redirect_uri(self, client_id, code, redirect_uri, client, request, *args, **kwargs):
+        return redirect_uri == self._grant(code, request).get("redirect_uri")
+
+    def get_authorization_code_nonce(self, client_id, code, redirect_uri, request):
+        return self._grant(code, request).get("nonce") or None
+
+    def invalidate_authorization_code(self, client_id, code, request, *args, **kwargs):
+        # already consumed by validate_code
+        if getattr(request, "grant", None) is None:
+            raise errors.InvalidGrantError(request=request)
+
+    def _check_and_set_request_resource(self, request):
+        if request.grant_type != "authorization_code":
+            return super()._check_and_set_request_resource(request)
+        # DOT narrows against the Grant row; normalise the requested resources with that branch
+        # skipped, then narrow against the consumed grant (RFC 8707)
+        request.grant_type = None
+        try:
+            super()._check_and_set_request_resource(request)
+        finally:
+            request.grant_type = "authorization_code"
+        granted = (getattr(request, "grant", None) or {}).get("resource") or []
+        if granted and not request.resource:
+            self._validate_resource_uris(request, granted)
+            request.resource = granted
+        elif granted:
+            for res in request.resource:
+                if res not in granted:
+                    raise errors.CustomOAuth2Error(
+                        error="invalid_target", request=request,
+                        description=f"The requested resource '{res}' is not allowed. Token request cannot "
+                                    "escalate resource permissions beyond the original authorization grant")
+
+    def _load_access_token(self, token):
+        # validate_bearer_token runs for OAuth2TokenMiddleware and again for DRF's
+        # OAuth2Authentication; serve both from users.token_cache instead of the DB.
+        # Expiry and scopes are still checked on every call by validate_bearer_token.
+        access_token = token_cache.get(token)
+        if access_token is None:
+            access_token = self._load_sharded_access_token(token)
+            if access_token is not None:
+                token_cache.set(token, access_token)
+        # as in async_views._bearer_token: a deactivated user's tokens stop working at once
+        if access_token is not None and access_token.user_id and not access_token.user.is_active:
+            return None
+        return access_token
+
+    def validate_jwt_bearer_token(self, token, scopes, request):
+        # the OIDC server sends every "ey..." bearer token here, and DOT only looks them up as ID tokens:
+        # JWT access tokens (users.jwt_tokens) are AccessToken rows like opaque ones
+        if self.validate_bearer_token(token, scopes, request):
             return True
-        return False
+        return super().validate_jwt_bearer_token(token, scopes, request)
+
+    def _load_sharded_access_token(self, token):
+        db = shard_for_token(token)
+        if db == "default":
+            return super()._load_access_token(token)
+        # no join across databases: the user comes from default, the application from the registry
+        checksum = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        access_token = AccessToken.objects.using(db).filter(token_checksum=checksum).first()
+        if access_token is not None:
+            access_token.application = app_registry.get_by_pk(access_token.application_id)
+            access_token.user = User.objects.filter(pk=access_token.user_id).first()
+            if access_token.user is None:
+                return None
+        return access_token
+
+    # DOT looks these up by value, and revokes through queries without a hint: run them on the token's shard
+    def validate_refresh_token(self, refresh_token, client, request, *args, **kwargs):
+        with token_shard(shard_for_token(refresh_token)):
+            return super().validate_refresh_token(refresh_token, client, request, *args, **kwargs)
+
+    def get_original_scopes(self, refresh_token, request, *args, **kwargs):
+        with token_shard(request.refresh_token_instance._state.db):
+            return super().get_original_scopes(refresh_token, request, *args, **kwargs)
+
+    def revoke_token(self, token, token_type_hint, request, *args, **kwargs):
+        with token_shard(shard_for_token(token)):
+            return super().revoke_token(token, token_type_hint, request, *args, **kwargs)
+
+    def _load_id_token(self, token):
+        with token_shard(shard_for_token(token)):
+            return super()._load_id_token(token)
+
+    def get_additional_claims(self):
+        # request-agnostic form, so the claim names are listed in the discovery document
+        return {
+            "preferred_username": _claim("username"),
+            "role": _claim("role"),
+            "groups": _claim("groups"),
+            "email": _claim("email"),
+            "given_name": _claim("first_name"),
+            "family_name": _claim("last_name"),
+        }
+
+    def finalize_id_token(self, id_token, token, token_handler, request):
+        """Sign with users.jwt_tokens.key_store (loaded once per process, published at /.well-known/jwks.json)."""
+        claims, expiration_time = self.get_id_token_dictionary(token, token_handler, request)
+        id_token.update(**claims)
+        if "nonce" not in id_token and request.nonce:
+            id_token["nonce"] = request.nonce
+        try:
+            key = key_store.active
+        except ImproperlyConfigured as e:
+            logger.error("ID token not issued: %s", e)
+            # DOT turns an OAuth2Error into the token response; oauthlib's ServerError would be a 400
+            raise errors.CustomOAuth2Error(error="server_error", description="ID tokens cannot be signed.",
+                                           status_code=500, request=request)
+        signed = jwt.JWT(header={"typ": "JWT", "alg": key.get("alg"), "kid": key.get("kid")},
+                         claims=json.dumps(id_token, default=str))
+        signed.make_signed_token(key)
+        db = shard_for_user(request.user.pk if request.user else None)
+        # DOT saves through IDToken.objects.create(), which carries no routing hint
+        with token_shard(db), transaction.atomic(using=db):
+            request.id_token = request.access_token = self._save_id_token(id_token["jti"], request, expiration_time)
+        return signed.serialize()
+
+    def _get_key_for_token(self, token):
+        # ID tokens are signed by key_store, not per application
+        return key_store.public_keyset() if key_store.keys else None
+
+    def _password_id_token(self, token, request):
+        # oauthlib only adds ID tokens to code/implicit/refresh flows; password and otp logins get one here
+        digest = hashlib.sha256(token["access_token"].encode()).digest()
+        at_hash = base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+        id_token = {"aud": request.client.client_id, "iat": int(time.time()), "at_hash": at_hash}
+        return self.finalize_id_token(id_token, token, None, request)
+
+    def save_bearer_token(self, token, request, *args, **kwargs):
+        if (request.grant_type in ("password", "otp") and "openid" in (request.scopes or [])
+                and oauth2_settings.OIDC_ENABLED and "id_token" not in token):
+            token["id_token"] = self._password_id_token(token, request)
+        if request.grant_type in ("password", "otp") and token.get("refresh_token"):
+            return self._mint_token_pair(token, request)
+        previous = getattr(request, "refresh_token_instance", None)
+        if (request.grant_type != "refresh_token" or not token.get("refresh_token")
+                or not self.rotate_refresh_token(request) or not isinstance(previous, RefreshToken)):
+            return super().save_bearer_token(token, request, *args, **kwargs)
+        with transaction.atomic(using=previous._state.db):
+            return self._rotate_refresh_token(token, request, previous)
+
+    def _mint_token_pair(self, token, request):
+        """A fresh pair for a login grant, written by users.token_minting (so it can join a group commit)."""
+        if "scope" not in token:
+            raise errors.FatalClientError("Failed to renew access token: missing scope")
+        self._check_and_set_request_resource(request)
+        access_token = AccessToken(
+            user=request.user, scope=token["scope"], application=request.client,
+            expires=timezone.now() + timedelta(seconds=token.get("expires_in", oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)),
+            id_token=request.id_token if token.get("id_token") else None, resource=request.resource,
+        )
+        self._set_token_value(access_token, token["access_token"])
+        refresh_token = RefreshToken(user=request.user, application=request.client, token_family=uuid.uuid4(),
+                                     resource=request.resource)
+        self._set_token_value(refresh_token, token["refresh_token"])
+        if request.grant_type != "otp":
+            return token_minter.save(access_token, refresh_token)
+        try:
+            token_minter.save(access_token, refresh_token, otp=(request.user, request.otp))
+        except OTPRejected as e:
+            otp_verifications.inc(outcome=e.code)
+            if access_token.id_token:
+                access_token.id_token.delete()
+            raise errors.InvalidGrantError("Invalid credentials given.", request=request)
+        otp_verifications.inc(outcome=VALID)
+
+    def _rotate_refresh_token(self, token, request, previous):
+        """
+        Refresh rotation in four statements instead of DOT's locking reads: a
+        conditional UPDATE claims the old refresh token (its row lock is what
+        serialises concurrent refreshes), then the old access token is deleted
+        and the new pair inserted. A request that lost the race, or retries an
+        already rotated token, gets the winner's pair back while inside
+        REFRESH_TOKEN_GRACE_PERIOD_SECONDS, otherwise invalid_grant.
+        """
+        if "scope" not in token:
+            raise errors.FatalClientError("Failed to renew access token: missing scope")
+        self._check_and_set_request_resource(request)
+        db = previous._state.db
+        now = timezone.now()
+        claimed = previous.revoked is None and RefreshToken.objects.using(db).filter(
+            pk=previous.pk, revoked__isnull=True).update(revoked=now, access_token=None, updated=now)
+        if not claimed:
+            return self._reissue_successor(token, request, previous, db)
+
+        if previous.access_token_id:
+            # nothing else references the old access token once the refresh token lets go of it; no signals
+            # fire for a raw delete, so its cache entry and revocation log entry are handled here
+            raw_delete(AccessToken.objects.using(db).filter(pk=previous.access_token_id), db)
+            token_cache.invalidate(previous.access_token.token_checksum)
+            record([(previous.access_token.token_checksum, previous.access_token.expires)], using=db)
+        expires = now + timedelta(seconds=token.get("expires_in", oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS))
+        access_token = self._create_access_token(expires, request, token, source_refresh_token=previous)
+        self._create_refresh_token(request, token["refresh_token"], access_token, previous)
+        refresh_rotations.inc(outcome="rotated")
+
+    def _reissue_successor(self, token, request, previous, db):
+        # validate_refresh_token already enforced the window for tokens revoked earlier;
+        # a token revoked by the concurrent winner just now is inside it by definition
+        successor = None
+        if oauth2_settings.REFRESH_TOKEN_GRACE_PERIOD_SECONDS:
+            successor = AccessToken.objects.using(db).filter(source_refresh_token=previous).first()
+        if successor is None:
+            refresh_rotations.inc(outcome="rejected")
+            raise errors.InvalidGrantError(request=request)
+        successor_refresh = RefreshToken.objects.using(db).filter(access_token=successor).first() \
+            or self._create_refresh_token(request, token["refresh_token"], successor, previous)
+        token["access_token"] = successor.token
+        token["refresh_token"] = successor_refresh.token
+        token["scope"] = successor.scope
+        refresh_rotations.inc(outcome="grace_reuse")
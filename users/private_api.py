@@ -0,0 +1,26 @@
+# users/private_api.py
+"""
+The private Django and django-oauth-toolkit APIs this app depends on, kept
+behind one module so an upgrade of either has a single place to check.
+"""
+from oauth2_provider.oauth2_validators import OAuth2Validator
+
+
+def raw_delete(queryset, using):
+    """
+    Delete the queryset's rows with one DELETE ... WHERE and return the count
+    (QuerySet._raw_delete). Nothing is loaded or collected: no cascades and no
+    pre/post_delete signals. Deleting AccessTokens this way therefore skips
+    users.signals, and the caller must drop them from users.token_cache and
+    record them in users.revocation_feed itself.
+    """
+    return queryset._raw_delete(using)
+
+
+def check_client_secret(provided_secret, stored_secret):
+    """
+    DOT's client secret comparison (OAuth2Validator._check_secret): a hashed
+    stored secret is checked with the password hashers, a plain one compared
+    in constant time, as /o/token/ does.
+    """
+    return OAuth2Validator()._check_secret(provided_secret, stored_secret)
@@ -0,0 +1,132 @@
+# users/purge.py
+import logging
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db import models, transaction
+from django.utils import timezone
+from oauth2_provider.models import (
+    get_access_token_model, get_grant_model, get_id_token_model, get_refresh_token_model,
+    refresh_token_expire_timedelta,
+)
+from oauth2_provider.settings import oauth2_settings
+from otp_grant.models import OTPCode
+from .db_router import token_databases
+from .models import TokenRevocation
+
+logger = logging.getLogger(__name__)
+
+# stats of the most recent run in this process, for monitoring
+last_run = {}
+
+
+def _conf():
+    return getattr(settings, "PURGE", {})
+
+
+def purge_targets(now=None):
+    """
+    (name, model, filter) for every kind of dead row, in dependency order.
+    Mirrors oauth2_provider.models.clear_expired, plus expired OTP codes and
+    revocation log entries.
+    """
+    now = now or timezone.now()
+    refresh_expire_delta = refresh_token_expire_timedelta()
+    refresh_expire_at = now - refresh_expire_delta if refresh_expire_delta else None
+    revoked_before = now - timedelta(seconds=oauth2_settings.REFRESH_TOKEN_GRACE_PERIOD_SECONDS or 0)
+    if oauth2_settings.REFRESH_TOKEN_REUSE_PROTECTION:
+        # revoked rows are what reuse detection looks at, keep them until they expire
+        revoked_before = refresh_expire_at
+
+    targets = []
+    if revoked_before:
+        targets.append(("revoked_refresh_tokens", get_refresh_token_model(), models.Q(revoked__lte=revoked_before)))
+    targets.append(("orphaned_refresh_tokens", get_refresh_token_model(),
+                    models.Q(revoked__isnull=True, access_token__isnull=True)))
+    if refresh_expire_at:
+        targets.append(("expired_refresh_tokens", get_refresh_token_model(),
+                        models.Q(revoked__isnull=True, access_token__expires__lte=refresh_expire_at)))
+    targets += [
+        ("expired_access_tokens", get_access_token_model(), models.Q(refresh_token__isnull=True, expires__lt=now)),
+        ("expired_id_tokens", get_id_token_model(), models.Q(access_token__isnull=True, expires__lt=now)),
+        ("expired_grants", get_grant_model(), models.Q(expires__lt=now)),
+        ("expired_otp_codes", OTPCode, models.Q(expires_at__lt=now)),
+        ("expired_revocations", TokenRevocation, models.Q(expires__lt=now)),
+    ]
+    return targets
+
+
+def purge_expired(batch_size=None, sleep=None, max_batches=None, only=None, progress=None):
+    """
+    Delete dead rows in short, separately committed batches.
+
+    Each batch selects up to `batch_size` primary keys past the previous
+    batch's last key (an index range scan, never an OFFSET) and deletes
+    them in their own transaction, so locks are held briefly and an
+    interrupted run simply continues where it stopped when started again.
+    `progress(name, stats)` is called after every batch.
+    """
+    batch_size = batch_size or _conf().get("BATCH_SIZE", 1000)
+    sleep = _conf().get("SLEEP_SECONDS", 0) if sleep is None else sleep
+    started = time.monotonic()
+    stats = {}
+    batches_left = max_batches
+    for name, model, query in purge_targets():
+        if only and name not in only:
+            continue
+        if batches_left is not None and batches_left <= 0:
+            break
+        target = stats[name] = {"deleted": 0, "batches": 0, "seconds": 0.0}
+        target_started = time.monotonic()
+        # the token tables exist on default and on every token shard
+        for db in token_databases():
+            cursor = 0
+            while batches_left is None or batches_left > 0:
+                pks = list(
+                    model.objects.using(db).filter(query, pk__gt=cursor).order_by("pk")
+                    .values_list("pk", flat=True)[:batch_size]
+                )
+                if not pks:
+                    break
+                with transaction.atomic(using=db):
+                    model.objects.using(db).filter(pk__in=pks).delete()
+                cursor = pks[-1]
+                target["deleted"] += len(pks)
+                target["batches"] += 1
+                target["seconds"] = round(time.monotonic() - target_started, 3)
+                if batches_left is not None:
+                    batches_left -= 1
+                if progress:
+                    progress(name, target)
+                if len(pks) < batch_size:
+                    break
+                if sleep:
+                    time.sleep(sleep)
+        logger.info("purge %s: %s rows in %s batches", name, target["deleted"], target["batches"])
+    last_run.clear()
+    last_run.update(finished=timezone.now().isoformat(), seconds=round(time.monotonic() - started, 3), targets=stats)
+    return stats
+
+
+def _scheduler_loop(interval):
+    while True:
+        time.sleep(interval)
+        # one worker per interval when the cache is shared between them
+        if not caches[_conf().get("LOCK_CACHE_ALIAS", "default")].add("purge:lock", True, timeout=interval):
+            continue
+        try:
+            purge_expired()
+        except Exception:
+            logger.exception("scheduled purge failed")
+
+
+def start_scheduler(interval=None):
+    """Run purge_expired() every `interval` seconds in a daemon thread of this process."""
+    interval = interval or _conf().get("SCHEDULE_SECONDS")
+    if not interval:
+        return None
+    thread = threading.Thread(target=_scheduler_loop, args=(interval,), name="purge-scheduler", daemon=True)
+    thread.start()
+    return thread
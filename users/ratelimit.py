@@ -0,0 +1,253 @@
+# users/ratelimit.py
+import functools
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from django.utils.module_loading import import_string
+from .introspection import client_credentials
+
+RATE_RE = re.compile(r"^(\d+)/(\d*)([smh])$")
+UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def _conf():
+    return getattr(settings, "RATE_LIMITS", {})
+
+
+def parse_rate(rate):
+    """'5/m' -> (5, 60); '5/10m' -> (5, 600)."""
+    match = RATE_RE.match(rate.strip())
+    if not match:
+        raise ValueError(f"invalid rate {rate!r}, expected e.g. '10/m' or '5/10m'")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * UNITS[unit]
+
+
+class MemoryBackend:
+    """
+    Per-process token buckets: bursts up to `limit`, refilled at limit/period
+    per second. Buckets are kept in least recently used order, each with its
+    own period: the oldest are dropped once idle for their period (full
+    again, same as absent) or beyond max_entries, in O(1) per hit.
+    """
+
+    def __init__(self, max_entries=100000, **options):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        """Seconds to wait before retrying, or 0 if the hit is allowed."""
+        now = time.monotonic()
+        rate = limit / period
+        with self._lock:
+            tokens, last, _ = self._buckets.get(key, (limit, now, period))
+            tokens = min(limit, tokens + (now - last) * rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now, period)
+            self._buckets.move_to_end(key)
+            self._evict(now)
+        return 0 if allowed else math.ceil((1 - tokens) / rate)
+
+    def peek(self, key, limit, period):
+        """hit() without taking a token: seconds until one would be allowed."""
+        now = time.monotonic()
+        rate = limit / period
+        with self._lock:
+            tokens, last, _ = self._buckets.get(key, (limit, now, period))
+        tokens = min(limit, tokens + (now - last) * rate)
+        return 0 if tokens >= 1 else math.ceil((1 - tokens) / rate)
+
+    async def ahit(self, key, limit, period):
+        return self.hit(key, limit, period)
+
+    async def apeek(self, key, limit, period):
+        return self.peek(key, limit, period)
+
+    def _evict(self, now):
+        while self._buckets:
+            _, last, period = next(iter(self._buckets.values()))
+            if now - last < period and len(self._buckets) <= self.max_entries:
+                break
+            self._buckets.popitem(last=False)
+
+
+class CacheBackend:
+    """
+    Sliding-window counter in a Django cache shared by all workers (Redis):
+    the previous fixed window is weighted by how much of it still overlaps.
+    Rejected attempts count too, so hammering keeps a key locked out.
+    """
+
+    def __init__(self, cache_alias="default", **options):
+        self.cache_alias = cache_alias
+
+    def _windows(self, key, period):
+        now = time.time()
+        window = int(now // period)
+        return f"ratelimit:{key}:{window}", f"ratelimit:{key}:{window - 1}", (now % period) / period
+
+    def hit(self, key, limit, period):
+        cache = caches[self.cache_alias]
+        current_key, previous_key, elapsed = self._windows(key, period)
+        cache.add(current_key, 0, timeout=period * 2)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:  # expired between add and incr
+            cache.set(current_key, 1, timeout=period * 2)
+            current = 1
+        return self._retry_after(current, cache.get(previous_key, 0), elapsed, limit, period)
+
+    def peek(self, key, limit, period):
+        """hit() without counting: seconds until one more would be allowed."""
+        current_key, previous_key, elapsed = self._windows(key, period)
+        found = caches[self.cache_alias].get_many([current_key, previous_key])
+        return self._retry_after(found.get(current_key, 0) + 1, found.get(previous_key, 0), elapsed, limit, period)
+
+    def _retry_after(self, current, previous, elapsed, limit, period):
+        if previous * (1 - elapsed) + current <= limit:
+            return 0
+        if current > limit or not previous:
+            return math.ceil((1 - elapsed) * period)
+        # wait until enough of the previous window has slid out
+        needed = 1 - (limit - current) / previous
+        return max(1, math.ceil((needed - elapsed) * period))
+
+    async def ahit(self, key, limit, period):
+        return await sync_to_async(self.hit)(key, limit, period)
+
+    async def apeek(self, key, limit, period):
+        return await sync_to_async(self.peek)(key, limit, period)
+
+
+def client_ip(request):
+    if _conf().get("TRUST_X_FORWARDED_FOR"):
+        # each proxy appends the address it got the request from: with TRUSTED_PROXIES of them in front,
+        # the client is that many entries from the right; anything further left was written by the client
+        forwarded = [ip.strip() for ip in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if ip.strip()]
+        if forwarded:
+            return forwarded[-min(_conf().get("TRUSTED_PROXIES", 1), len(forwarded))]
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _identifiers(request):
+    data = request.POST if request.method == "POST" else request.GET
+    return {
+        "username": data.get("username") or request.GET.get("username"),
+        "client_id": client_credentials(request)[0],
+        "ip": client_ip(request),
+    }
+
+
+class RateLimiter:
+    """
+    Applies RATE_LIMITS['RULES'][scope]: one limit per identifier (username,
+    client_id, ip). Identifiers listed in failures_only[scope] are taken from
+    the unauthenticated request, so only failed attempts count against them:
+    otherwise anyone could lock a user or client out by sending its name.
+    """
+
+    def __init__(self, enabled=True, backend=None, rules=None, failures_only=None):
+        self.enabled = enabled
+        self.backend = backend
+        self.rules = {scope: {ident: parse_rate(rate) for ident, rate in limits.items() if rate}
+                      for scope, limits in (rules or {}).items()}
+        self.failures_only = {scope: frozenset(idents) for scope, idents in (failures_only or {}).items()}
+
+    def _hits(self, scope, request):
+        ids = _identifiers(request)
+        failures_only = self.failures_only.get(scope, ())
+        for ident, (limit, period) in self.rules.get(scope, {}).items():
+            value = ids.get(ident)
+            if value:
+                yield ident in failures_only, (f"{scope}:{ident}:{value}", limit, period)
+
+    def check(self, scope, request):
+        """Largest Retry-After across the scope's limits, 0 if allowed."""
+        if not self.enabled:
+            return 0
+        return max((self.backend.peek(*hit) if on_failure else self.backend.hit(*hit)
+                    for on_failure, hit in self._hits(scope, request)), default=0)
+
+    def record_failure(self, scope, request):
+        """Count a failed attempt against the scope's failures_only limits."""
+        if self.enabled:
+            for on_failure, hit in self._hits(scope, request):
+                if on_failure:
+                    self.backend.hit(*hit)
+
+    async def acheck(self, scope, request):
+        if not self.enabled:
+            return 0
+        return max([await (self.backend.apeek(*hit) if on_failure else self.backend.ahit(*hit))
+                    for on_failure, hit in self._hits(scope, request)], default=0)
+
+    async def arecord_failure(self, scope, request):
+        if self.enabled:
+            for on_failure, hit in self._hits(scope, request):
+                if on_failure:
+                    await self.backend.ahit(*hit)
+
+
+def _from_settings():
+    conf = _conf()
+    options = {k.lower(): v for k, v in conf.items() if k in ("CACHE_ALIAS", "MAX_ENTRIES")}
+    backend = import_string(conf.get("BACKEND", "users.ratelimit.MemoryBackend"))(**options)
+    return RateLimiter(enabled=conf.get("ENABLED", True), backend=backend, rules=conf.get("RULES", {}),
+                       failures_only=conf.get("FAILURES_ONLY", {}))
+
+
+limiter = _from_settings()
+
+
+def _too_many_requests(retry_after):
+    response = JsonResponse({"error": "rate_limited", "retry_after": retry_after}, status=429)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+def _failed(response):
+    # rejected credentials, codes or clients; not 429s, nor a 503 from a saturated hashing pool
+    return response.status_code in (400, 401, 403)
+
+
+def ratelimit(scope):
+    """
+    Reject a view with 429 + Retry-After when any limit of `scope` is
+    exceeded. Runs before the view, so no hashing or DB work is spent on it;
+    a failed response then counts against the failures_only limits.
+    `scope` may also be a callable(request) returning the scope name.
+    """
+    def scope_for(request):
+        return scope(request) if callable(scope) else scope
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                retry_after = await limiter.acheck(scope_for(request), request)
+                if retry_after:
+                    return _too_many_requests(retry_after)
+                response = await view(request, *args, **kwargs)
+                if _failed(response):
+                    await limiter.arecord_failure(scope_for(request), request)
+                return response
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            retry_after = limiter.check(scope_for(request), request)
+            if retry_after:
+                return _too_many_requests(retry_after)
+            response = view(request, *args, **kwargs)
+            if _failed(response):
+                limiter.record_failure(scope_for(request), request)
+            return response
+        return wrapper
+    return decorator
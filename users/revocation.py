@@ -0,0 +1,80 @@
+# users/revocation.py
+from django.db import transaction
+from django.db.models import Q
+from oauth2_provider.models import AccessToken, IDToken, RefreshToken
+from .consent import consent_cache
+from .db_router import shard_for_user, token_databases
+from .private_api import raw_delete
+from .revocation_feed import record
+from .token_cache import token_cache
+
+BATCH_SIZE = 1000
+
+
+def _scope_q(scope):
+    # scope is a space-separated list; match the whole word
+    return Q(scope=scope) | Q(scope__startswith=f"{scope} ") | Q(scope__endswith=f" {scope}") | Q(scope__contains=f" {scope} ")
+
+
+def revoke_tokens(user=None, application=None, scope=None, batch_size=BATCH_SIZE):
+    """
+    Delete the access tokens (with their refresh and ID tokens) matching all
+    the given filters, using set-based deletes.
+
+    Rows are never loaded as model instances: each batch reads only the
+    primary keys, checksums, expiries and ID token ids it needs, deletes them
+    with plain DELETE ... WHERE id IN (...) statements in one short
+    transaction, drops the checksums from users.token_cache and appends them
+    to the users.revocation_feed log. Without a scope filter, the remaining
+    refresh tokens of the user/application (already revoked or orphaned) are
+    deleted too, and a user's remembered consents (users.consent) are
+    forgotten. Returns counts per token kind.
+    """
+    if user is None and application is None and scope is None:
+        raise ValueError("revoke_tokens needs at least one of user, application or scope")
+    owner = Q()
+    if user is not None:
+        owner &= Q(user=user)
+    if application is not None:
+        owner &= Q(application=application)
+    access_filter = owner & _scope_q(scope) if scope else owner
+    counts = {"access_tokens": 0, "refresh_tokens": 0, "id_tokens": 0}
+    # a user's rows are on their shard, or on default when issued before TOKEN_SHARDS
+    databases = token_databases() if user is None else dict.fromkeys(["default", shard_for_user(user.pk)])
+    for db in databases:
+        _revoke_on(db, owner, access_filter, scope, batch_size, counts)
+    if user is not None:
+        consent_cache.forget(user.pk)
+    return counts
+
+
+def _revoke_on(db, owner, access_filter, scope, batch_size, counts):
+    cursor = 0
+    while True:
+        rows = list(AccessToken.objects.using(db).filter(access_filter, pk__gt=cursor).order_by("pk")
+                    .values_list("pk", "token_checksum", "id_token_id", "expires")[:batch_size])
+        if not rows:
+            break
+        pks = [pk for pk, _, _, _ in rows]
+        id_token_ids = [i for _, _, i, _ in rows if i]
+        with transaction.atomic(using=db):
+            refresh = RefreshToken.objects.using(db).filter(access_token_id__in=pks)
+            # tokens outside this batch that were minted from these refresh tokens keep existing
+            AccessToken.objects.using(db).filter(source_refresh_token__in=refresh).exclude(pk__in=pks) \
+                .update(source_refresh_token=None)
+            counts["refresh_tokens"] += raw_delete(refresh, db)
+            counts["access_tokens"] += raw_delete(AccessToken.objects.using(db).filter(pk__in=pks), db)
+            if id_token_ids:
+                counts["id_tokens"] += raw_delete(IDToken.objects.using(db).filter(pk__in=id_token_ids), db)
+        # raw deletes fire no post_delete, so users.signals does not see these rows: log and uncache them here
+        record(((checksum, expires) for _, checksum, _, expires in rows), using=db)
+        token_cache.invalidate(*(checksum for _, checksum, _, _ in rows))
+        cursor = pks[-1]
+        if len(rows) < batch_size:
+            break
+
+    if not scope:
+        with transaction.atomic(using=db):
+            leftovers = RefreshToken.objects.using(db).filter(owner)
+            AccessToken.objects.using(db).filter(source_refresh_token__in=leftovers).update(source_refresh_token=None)
+            counts["refresh_tokens"] += raw_delete(leftovers, db)
@@ -0,0 +1,163 @@
+# users/revocation_feed.py
+"""
+Revocation log for resource servers that cache introspection results.
+
+Every access token deleted before its expiry (logout and revoke_tokens,
+refresh rotation, /o/revoke_token/, the admin) is appended to
+TokenRevocation as its checksum, the same sha256 /o/introspect/ and
+users.token_cache key on. /api/revocations/ serves the log in id order:
+
+- `?after=<cursor>` returns the next page at once;
+- `?after=<cursor>&wait=<seconds>` long-polls until something arrives;
+- `Accept: text/event-stream` streams one event per batch, resuming from
+  `Last-Event-ID`, for STREAM_SECONDS before the client reconnects.
+
+Long polls and streams are only served by the async view
+(users.async_views.arevocation_feed, ASYNC_VIEWS=True): under WSGI they
+would hold a worker for the whole wait, so the sync view answers 400.
+
+Entries are appended one writer at a time, so ids become visible in
+commit order and a cursor never moves past a row that commits later.
+A consumer can then cache an introspection result for the token's whole
+lifetime and drop it when its checksum shows up in the feed.
+"""
+import asyncio
+import calendar
+import json
+import time
+import zlib
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from .introspection import authenticate_client
+from .models import TokenRevocation
+
+
+# pg_advisory_xact_lock key serialising appends to the log
+APPEND_LOCK = zlib.crc32(b"users.tokenrevocation")
+
+
+def _conf():
+    return getattr(settings, "REVOCATION_FEED", {})
+
+
+def _append(tokens):
+    db = router.db_for_write(TokenRevocation)
+    with transaction.atomic(using=db):
+        connection = connections[db]
+        # ids are taken before commit: with two concurrent appends, the lower id could commit last and a
+        # consumer's cursor would already be past it. Holding the lock until commit keeps ids in commit
+        # order; SQLite already allows one writer at a time.
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [APPEND_LOCK])
+        TokenRevocation.objects.using(db).bulk_create(
+            [TokenRevocation(token_checksum=checksum, expires=expires) for checksum, expires in tokens])
+
+
+def record(tokens, using="default"):
+    """
+    Append (token_checksum, expires) pairs to the log once the transaction
+    deleting them on database `using` commits. Tokens already past their
+    expiry are left out: no resource server would accept them anyway.
+    """
+    tokens = [(checksum, expires) for checksum, expires in tokens if expires > timezone.now()]
+    if tokens:
+        transaction.on_commit(lambda: _append(tokens), using=using)
+
+
+def page(after=0, limit=None):
+    """The next revocations after cursor `after`: {"revocations": [...], "cursor": ..., "has_more": ...}."""
+    limit = min(limit or _conf().get("PAGE_SIZE", 500), _conf().get("PAGE_SIZE", 500))
+    rows = list(TokenRevocation.objects.filter(pk__gt=after, expires__gt=timezone.now())
+                .order_by("pk").values_list("pk", "token_checksum", "expires")[:limit + 1])
+    revocations = [
+        {"id": pk, "token_checksum": checksum, "exp": calendar.timegm(expires.utctimetuple())}
+        for pk, checksum, expires in rows[:limit]
+    ]
+    return {
+        "revocations": revocations,
+        "cursor": revocations[-1]["id"] if revocations else after,
+        "has_more": len(rows) > limit,
+    }
+
+
+async def await_page(after=0, limit=None, wait=0):
+    """page(), polling every POLL_INTERVAL_SECONDS for up to `wait` seconds while it is empty."""
+    deadline = time.monotonic() + min(wait, _conf().get("MAX_WAIT_SECONDS", 30))
+    while True:
+        result = await sync_to_async(page)(after, limit)
+        if result["revocations"] or time.monotonic() >= deadline:
+            return result
+        await asyncio.sleep(_conf().get("POLL_INTERVAL_SECONDS", 1))
+
+
+def _event(result):
+    return f"id: {result['cursor']}\ndata: {json.dumps(result['revocations'])}\n\n"
+
+
+def _retry():
+    # how long EventSource waits before reconnecting once STREAM_SECONDS is up
+    return f"retry: {int(_conf().get('POLL_INTERVAL_SECONDS', 1) * 1000)}\n\n"
+
+
+async def astream(after=0):
+    """text/event-stream body: a batch per event, a keepalive comment while idle."""
+    deadline = time.monotonic() + _conf().get("STREAM_SECONDS", 300)
+    yield _retry()
+    while time.monotonic() < deadline:
+        result = await sync_to_async(page)(after)
+        if result["revocations"]:
+            after = result["cursor"]
+            yield _event(result)
+            if result["has_more"]:
+                continue
+        else:
+            yield ": keepalive\n\n"
+        await asyncio.sleep(_conf().get("POLL_INTERVAL_SECONDS", 1))
+
+
+def parse_request(request):
+    """(after, limit, wait, wants_stream) from the query string and headers, or None if malformed."""
+    try:
+        after = int(request.headers.get("Last-Event-ID") or request.GET.get("after", 0))
+        limit = int(request.GET["limit"]) if "limit" in request.GET else None
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        return None
+    if after < 0 or (limit is not None and limit < 1) or wait < 0:
+        return None
+    return after, limit, wait, "text/event-stream" in request.headers.get("Accept", "")
+
+
+def unauthorized():
+    response = JsonResponse({"error": "invalid_client"}, status=401)
+    response["WWW-Authenticate"] = 'Basic realm="revocations"'
+    return response
+
+
+def event_stream_response(body):
+    response = StreamingHttpResponse(body, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx would otherwise buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def revocation_feed(request):
+    """GET /api/revocations/ for confidential clients (HTTP Basic, as for /o/introspect/); pages only."""
+    if request.method != "GET":
+        return JsonResponse({"detail": 'Method "%s" not allowed.' % request.method}, status=405)
+    if authenticate_client(request) is None:
+        return unauthorized()
+    params = parse_request(request)
+    if params is None:
+        return JsonResponse({"error": "invalid_request"}, status=400)
+    after, limit, wait, wants_stream = params
+    if wait or wants_stream:
+        # each would pin a WSGI worker for up to MAX_WAIT_SECONDS/STREAM_SECONDS
+        return JsonResponse({"error": "invalid_request",
+                             "error_description": "wait and text/event-stream need ASYNC_VIEWS"}, status=400)
+    return JsonResponse(page(after, limit))
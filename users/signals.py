@@ -0,0 +1,101 @@
+# users/signals.py
+from django.db.backends.signals import connection_created
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from oauth2_provider.models import AccessToken, Application, Grant
+from otp_grant.models import OTPCode
+from .app_registry import app_registry
+from .claims import claims_cache
+from .db_metrics import connections_opened
+from .db_router import drop_shard_foreign_keys, shard_for_user
+from .models import User
+from .revocation import revoke_tokens
+from .revocation_feed import record
+from .token_cache import token_cache
+
+# saves that cannot change any claim (login stamps, hash upgrades)
+NON_CLAIM_FIELDS = frozenset({"last_login", "password"})
+
+
+@receiver(post_save, sender=AccessToken)
+@receiver(post_delete, sender=AccessToken)
+def invalidate_cached_access_token(sender, instance, created=False, **kwargs):
+    # covers LogoutView deletes, refresh rotation (RefreshToken.revoke) and /o/revoke_token/;
+    # a freshly created token cannot be cached yet
+    if created:
+        return
+    token_cache.invalidate(instance.token_checksum)
+
+
+@receiver(post_delete, sender=AccessToken)
+def log_revoked_access_token(sender, instance, **kwargs):
+    # /o/revoke_token/, the admin and RefreshToken.revoke() delete row by row; expired rows are not logged
+    record([(instance.token_checksum, instance.expires)], using=instance._state.db)
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+def invalidate_application_registry(sender, instance, **kwargs):
+    app_registry.invalidate()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_claims(sender, instance, update_fields=None, **kwargs):
+    if update_fields and NON_CLAIM_FIELDS.issuperset(update_fields):
+        return
+    claims_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_access_tokens(sender, instance, created=False, update_fields=None, **kwargs):
+    # cached tokens carry the user as it was loaded: a role change or deactivation must not wait for their TTL
+    if created or (update_fields and NON_CLAIM_FIELDS.issuperset(update_fields)):
+        return
+    for db in dict.fromkeys(["default", shard_for_user(instance.pk)]):
+        token_cache.invalidate(*AccessToken.objects.using(db).filter(user_id=instance.pk)
+                               .values_list("token_checksum", flat=True))
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_tokens(sender, instance, **kwargs):
+    # the delete cascades on default only; a user's tokens, codes and grants on a token shard go here
+    db = shard_for_user(instance.pk)
+    if db != "default":
+        revoke_tokens(user=instance)
+        OTPCode.objects.using(db).filter(user_id=instance.pk).delete()
+        Grant.objects.using(db).filter(user_id=instance.pk).delete()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_group_member_claims(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            claims_cache.invalidate(instance.pk)
+    elif action == "pre_clear":
+        # group.user_set.clear(): members are only known before the rows go
+        claims_cache.invalidate(*instance.user_set.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        claims_cache.invalidate(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_claims(sender, instance, created=False, **kwargs):
+    # a renamed or deleted group changes the claims of every member
+    if not created:
+        claims_cache.invalidate(*instance.user_set.values_list("pk", flat=True))
+
+
+@receiver(connection_created)
+def count_new_connection(sender, connection, **kwargs):
+    connections_opened[connection.alias] += 1
+
+
+@receiver(post_migrate)
+def unconstrain_token_shard(sender, using, **kwargs):
+    # post_migrate fires once per app after the whole run; the shard's tables only need one pass
+    if sender.name == "users":
+        drop_shard_foreign_keys(using)
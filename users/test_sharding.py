@@ -0,0 +1,173 @@
+"""
+Token sharding (users/db_router.py) against two SQLite files.
+
+Without TOKEN_SHARD_DBS in the environment, setUpModule adds two shard
+databases the way settings.py would for TOKEN_SHARD_DBS=<a>,<b>, creates and
+migrates them, and removes them again once the module has run.
+"""
+import base64
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import addModuleCleanup
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, Grant, RefreshToken
+from otp_grant.backends import DatabaseOTPStore
+from otp_grant.models import OTPCode
+from users.db_router import shard_for_token, shard_for_user
+from users.models import TokenRevocation, User
+from users.revocation import revoke_tokens
+from users.token_cache import token_checksum
+from users.tests import OAuthTestCase
+
+TEST_SHARDS = ["test_shard0", "test_shard1"]
+SHARDS = list(settings.TOKEN_SHARDS) or TEST_SHARDS
+
+
+def setUpModule():
+    if not settings.TOKEN_SHARDS:
+        files = tempfile.mkdtemp(prefix="token-shards-")
+        addModuleCleanup(shutil.rmtree, files)
+        for i, alias in enumerate(TEST_SHARDS):
+            name = os.path.join(files, f"shard{i}.sqlite3")
+            # the test runner only creates the databases it knew about when it started
+            connections.settings[alias] = connections.configure_settings({
+                "default": dict(connections.settings["default"]),
+                alias: {**connections.settings["default"], "ENGINE": "users.shard_sqlite3", "NAME": name,
+                        "TEST": {"NAME": name}},
+            })[alias]
+            addModuleCleanup(_remove_database, alias)
+            connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    token_shards = override_settings(TOKEN_SHARDS=SHARDS)
+    token_shards.enable()
+    addModuleCleanup(token_shards.disable)
+
+
+def _remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+
+
+class ShardedTestCase(OAuthTestCase):
+    # resolved in setUpClass, once setUpModule has added the shards
+    databases = "__all__"
+
+    def setUp(self):
+        super().setUp()
+        # alice (from OAuthTestCase) plus users until both shards have one
+        self.users = {shard_for_user(self.user.pk): self.user}
+        while len(self.users) < len(SHARDS):
+            user = User.objects.create_user(f"user{User.objects.count()}", password="pw")
+            self.users.setdefault(shard_for_user(user.pk), user)
+
+    def login_on(self, db):
+        return self.login(self.users[db].username)
+
+    def introspect(self, *tokens):
+        credentials = base64.b64encode(f"{self.app.client_id}:s3cret".encode()).decode()
+        response = self.client.post("/o/introspect/", {"tokens": list(tokens)},
+                                    HTTP_AUTHORIZATION=f"Basic {credentials}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["results"]
+
+
+class ShardRoutingTests(ShardedTestCase):
+    def test_tokens_are_written_to_their_users_shard(self):
+        for db, user in self.users.items():
+            tokens = self.login(user.username)
+            self.assertEqual(shard_for_token(tokens["access_token"]), db)
+            self.assertEqual(shard_for_token(tokens["refresh_token"]), db)
+            self.assertTrue(AccessToken.objects.using(db).filter(user_id=user.pk).exists())
+            self.assertTrue(RefreshToken.objects.using(db).filter(user_id=user.pk).exists())
+        self.assertFalse(AccessToken.objects.using("default").exists())
+
+    def test_bearer_token_on_a_shard_authenticates(self):
+        for db in SHARDS:
+            tokens = self.login_on(db)
+            response = self.client.get("/api/userinfo/", HTTP_AUTHORIZATION=f"Bearer {tokens['access_token']}")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["username"], self.users[db].username)
+
+    def test_otp_codes_are_kept_on_the_users_shard(self):
+        store = DatabaseOTPStore()
+        for db, user in self.users.items():
+            store.issue(user, "123456")
+            self.assertTrue(OTPCode.objects.using(db).filter(user_id=user.pk).exists())
+            self.assertEqual(store.consume(user, "123456"), "valid")
+        self.assertFalse(OTPCode.objects.using("default").exists())
+
+
+class ShardRotationTests(ShardedTestCase):
+    def test_refresh_rotates_the_pair_on_the_shard(self):
+        for db in SHARDS:
+            tokens = self.login_on(db)
+            response = self.refresh(tokens["refresh_token"])
+            self.assertEqual(response.status_code, 200, response.content)
+            rotated = response.json()
+            self.assertEqual(shard_for_token(rotated["refresh_token"]), db)
+            self.assertFalse(AccessToken.objects.using(db).filter(token=tokens["access_token"]).exists())
+            self.assertTrue(AccessToken.objects.using(db).filter(token=rotated["access_token"]).exists())
+            self.assertIsNotNone(RefreshToken.objects.using(db).get(token=tokens["refresh_token"]).revoked)
+            # the replaced access token is logged for resource servers, on default, once the shard commits
+            self.assertTrue(TokenRevocation.objects.filter(token_checksum=token_checksum(tokens["access_token"])).exists())
+
+    def test_retried_refresh_gets_the_same_pair(self):
+        tokens = self.login_on(SHARDS[1])
+        first = self.refresh(tokens["refresh_token"]).json()
+        retry = self.refresh(tokens["refresh_token"]).json()
+        self.assertEqual(retry["access_token"], first["access_token"])
+        self.assertEqual(AccessToken.objects.using(SHARDS[1]).count(), 1)
+
+
+class ShardIntrospectionTests(ShardedTestCase):
+    def test_batch_spans_shards_and_default(self):
+        tokens = [self.login_on(db)["access_token"] for db in SHARDS]
+        # a token issued before sharding stays on default, untagged
+        legacy = AccessToken.objects.using("default").create(
+            user=self.user, application=self.app, token="legacy-token", scope="read",
+            expires=timezone.now() + timedelta(hours=1))
+        results = self.introspect(*tokens, legacy.token, "0.unknown")
+        self.assertEqual([r["active"] for r in results], [True, True, True, False])
+        self.assertEqual([r["username"] for r in results[:2]], [self.users[db].username for db in SHARDS])
+        self.assertEqual({r["client_id"] for r in results[:3]}, {self.app.client_id})
+
+
+class ShardRevocationTests(ShardedTestCase):
+    def test_revoke_tokens_by_user_deletes_on_their_shard_only(self):
+        kept, revoked = SHARDS
+        kept_tokens = self.login_on(kept)
+        self.login_on(revoked)
+        self.login_on(revoked)
+        counts = revoke_tokens(user=self.users[revoked])
+        self.assertEqual(counts["access_tokens"], 2)
+        self.assertEqual(counts["refresh_tokens"], 2)
+        self.assertFalse(AccessToken.objects.using(revoked).exists())
+        self.assertFalse(RefreshToken.objects.using(revoked).exists())
+        self.assertTrue(AccessToken.objects.using(kept).filter(token=kept_tokens["access_token"]).exists())
+        self.assertEqual(TokenRevocation.objects.count(), 2)
+
+    def test_revoke_tokens_by_application_covers_every_shard(self):
+        for db in SHARDS:
+            self.login_on(db)
+        counts = revoke_tokens(application=self.app)
+        self.assertEqual(counts["access_tokens"], len(SHARDS))
+        for db in SHARDS:
+            self.assertFalse(AccessToken.objects.using(db).exists())
+
+    def test_deleting_a_user_clears_their_shard(self):
+        db = SHARDS[1]
+        user = self.users[db]
+        user_id = user.pk
+        self.login(user.username)
+        DatabaseOTPStore().issue(user, "123456")
+        Grant.objects.using(db).create(user=user, application=self.app, code="1.code", redirect_uri="http://localhost/",
+                                       expires=timezone.now() + timedelta(minutes=5))
+        self.assertTrue(Grant.objects.using(db).filter(user_id=user_id).exists())
+        user.delete()
+        for model in (AccessToken, RefreshToken, OTPCode, Grant):
+            self.assertFalse(model.objects.using(db).filter(user_id=user_id).exists(), model.__name__)
@@ -0,0 +1,689 @@
+import base64
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, identify_hasher
+from django.contrib.auth.models import Group
+from django.db import IntegrityError, connection, connections
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from jwcrypto import jwk, jwt
+from oauth2_provider.models import AccessToken, Application, RefreshToken
+from otp_grant.backends import get_otp_store
+from users import ratelimit
+from users.app_registry import app_registry
+from users.async_views import arevocation_feed
+from users.auth_backends import password_pipeline
+from users.bulk_tokens import issue_tokens_bulk
+from users.claims import claims_cache
+from users.consent import consent_cache
+from users.grant_store import CacheGrantStore, DatabaseGrantStore
+from users.jwt_tokens import decode_access_token, key_store
+from users.metrics import refresh_rotations
+from users.models import User
+from users.purge import purge_expired
+from users.oauth_validators import OTPGrantValidator
+from users.ratelimit import MemoryBackend, limiter
+from users.revocation import revoke_tokens
+from users.token_cache import token_checksum
+from users.token_minting import OTPRejected, TokenMinter
+
+FAST_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class OAuthTestCase(TransactionTestCase):
+    """A user and a confidential password-grant client; TransactionTestCase so queries are counted as in production."""
+
+    def setUp(self):
+        patcher = mock.patch.object(limiter, "enabled", False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.defaults["HTTP_HOST"] = "localhost"
+        self.user = User.objects.create_user("alice", "alice@example.com", "pw")
+        self.app = Application.objects.create(name="svc", client_type=Application.CLIENT_CONFIDENTIAL,
+                                              authorization_grant_type=Application.GRANT_PASSWORD,
+                                              client_secret="s3cret")
+
+    def token(self, **params):
+        return self.client.post("/o/token/", {"client_id": self.app.client_id, "client_secret": "s3cret", **params})
+
+    def login(self, username="alice", password="pw"):
+        response = self.token(grant_type="password", username=username, password=password)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def refresh(self, refresh_token):
+        return self.token(grant_type="refresh_token", refresh_token=refresh_token)
+
+
+class RefreshRotationTests(OAuthTestCase):
+    def test_query_count_per_refresh(self):
+        tokens = self.login()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.refresh(tokens["refresh_token"])
+        self.assertEqual(response.status_code, 200)
+        # refresh token, user and application lookups; BEGIN, the claiming UPDATE, DELETE of the old access token,
+        # two INSERTs, COMMIT; the revocation log insert in its own transaction; DOT's read-back for app_authorized
+        self.assertEqual(len(captured), 13, "\n".join(q["sql"] for q in captured))
+        statements = [q["sql"].split()[0] for q in captured]
+        swap = statements[statements.index("BEGIN") + 1:statements.index("COMMIT")]
+        self.assertEqual(swap, ["UPDATE", "DELETE", "INSERT", "INSERT"])
+
+    def test_rotation_replaces_the_pair(self):
+        tokens = self.login()
+        rotated = self.refresh(tokens["refresh_token"]).json()
+        self.assertNotEqual(rotated["access_token"], tokens["access_token"])
+        self.assertNotEqual(rotated["refresh_token"], tokens["refresh_token"])
+        self.assertFalse(AccessToken.objects.filter(token=tokens["access_token"]).exists())
+        self.assertIsNotNone(RefreshToken.objects.get(token=tokens["refresh_token"]).revoked)
+        self.assertEqual(self.refresh(rotated["refresh_token"]).status_code, 200)
+
+    def test_retry_within_grace_window_gets_the_same_pair(self):
+        tokens = self.login()
+        first = self.refresh(tokens["refresh_token"]).json()
+        with CaptureQueriesContext(connection) as captured:
+            retry = self.refresh(tokens["refresh_token"])
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()["access_token"], first["access_token"])
+        self.assertEqual(retry.json()["refresh_token"], first["refresh_token"])
+        self.assertFalse(any(q["sql"].startswith("INSERT") for q in captured))
+        self.assertEqual(AccessToken.objects.count(), 1)
+
+    @override_settings(OAUTH2_PROVIDER={**settings.OAUTH2_PROVIDER, "REFRESH_TOKEN_GRACE_PERIOD_SECONDS": 0})
+    def test_reuse_without_grace_window_is_rejected(self):
+        tokens = self.login()
+        self.assertEqual(self.refresh(tokens["refresh_token"]).status_code, 200)
+        response = self.refresh(tokens["refresh_token"])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "invalid_grant")
+
+    def test_losing_a_race_returns_the_winners_pair(self):
+        tokens = self.login()
+        rotate = OTPGrantValidator._rotate_refresh_token
+        winner, raced = [], []
+
+        def win():
+            try:
+                winner.append(self.refresh(tokens["refresh_token"]).json())
+            finally:
+                connections.close_all()
+
+        def race(validator, token, request, previous):
+            # the loser has loaded the unrevoked token; the winner rotates it before the loser's UPDATE runs
+            if not raced:
+                raced.append(True)
+                thread = threading.Thread(target=win)
+                thread.start()
+                thread.join()
+            return rotate(validator, token, request, previous)
+
+        reused = refresh_rotations._values.get(("grace_reuse",), 0)
+        with mock.patch.object(OTPGrantValidator, "_rotate_refresh_token", race):
+            loser = self.refresh(tokens["refresh_token"])
+        self.assertEqual(loser.status_code, 200)
+        self.assertEqual(loser.json()["access_token"], winner[0]["access_token"])
+        self.assertEqual(loser.json()["refresh_token"], winner[0]["refresh_token"])
+        self.assertEqual(refresh_rotations._values[("grace_reuse",)], reused + 1)
+        self.assertEqual(AccessToken.objects.count(), 1)
+
+
+class RevocationFeedTests(OAuthTestCase):
+    def setUp(self):
+        super().setUp()
+        credentials = base64.b64encode(f"{self.app.client_id}:s3cret".encode()).decode()
+        self.auth = {"HTTP_AUTHORIZATION": f"Basic {credentials}"}
+
+    def test_revocation_is_served_as_soon_as_it_commits(self):
+        tokens = self.login()
+        revoke_tokens(user=self.user)
+        response = self.client.get("/api/revocations/", **self.auth)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([r["token_checksum"] for r in body["revocations"]], [token_checksum(tokens["access_token"])])
+        after = self.client.get("/api/revocations/", {"after": body["cursor"]}, **self.auth).json()
+        self.assertEqual(after["revocations"], [])
+        self.assertEqual(after["cursor"], body["cursor"])
+
+    def test_sync_view_refuses_long_polls_and_streams(self):
+        self.assertEqual(self.client.get("/api/revocations/", {"wait": 5}, **self.auth).status_code, 400)
+        response = self.client.get("/api/revocations/", HTTP_ACCEPT="text/event-stream", **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_view_long_polls(self):
+        tokens = self.login()
+        revoke_tokens(user=self.user)
+        request = RequestFactory().get("/api/revocations/", {"wait": 5}, **self.auth)
+        response = async_to_sync(arevocation_feed)(request)
+        self.assertEqual(response.status_code, 200)
+        revocations = json.loads(response.content)["revocations"]
+        self.assertEqual([r["token_checksum"] for r in revocations], [token_checksum(tokens["access_token"])])
+
+
+class AuthorizeTestCase(OAuthTestCase):
+    """A logged-in user and a public authorization-code client using PKCE."""
+
+    redirect_uri = "http://localhost/cb"
+    verifier = "v" * 43
+
+    def setUp(self):
+        super().setUp()
+        self.web = Application.objects.create(name="web", client_type=Application.CLIENT_PUBLIC,
+                                              authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
+                                              redirect_uris=self.redirect_uri)
+        self.client.force_login(self.user)
+
+    def authorize_params(self, **params):
+        challenge = base64.urlsafe_b64encode(hashlib.sha256(self.verifier.encode()).digest()).rstrip(b"=").decode()
+        return {"response_type": "code", "client_id": self.web.client_id, "redirect_uri": self.redirect_uri,
+                "scope": "read", "code_challenge": challenge, "code_challenge_method": "S256", **params}
+
+    def authorize(self, **params):
+        return self.client.get("/o/authorize/", self.authorize_params(**params))
+
+    def approve(self, **params):
+        response = self.client.post("/o/authorize/", {**self.authorize_params(**params), "allow": "Authorize"})
+        self.assertEqual(response.status_code, 302, response.content)
+        return parse_qs(urlparse(response["Location"]).query)["code"][0]
+
+    def exchange(self, code, verifier=None):
+        return self.client.post("/o/token/", {"grant_type": "authorization_code", "code": code,
+                                              "redirect_uri": self.redirect_uri, "client_id": self.web.client_id,
+                                              "code_verifier": verifier or self.verifier})
+
+
+class ConsentTests(AuthorizeTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(consent_cache, "ttl", 3600)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        consent_cache.forget(self.user.pk)
+
+    def test_approved_scopes_skip_the_consent_page(self):
+        self.assertEqual(self.authorize().status_code, 200)
+        self.approve()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.authorize()
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("code=", response["Location"])
+        self.assertFalse(any("oauth2_provider_accesstoken" in q["sql"] for q in captured))
+
+    def test_other_scopes_ask_again(self):
+        self.approve()
+        self.assertEqual(self.authorize().status_code, 302)
+        self.assertEqual(self.authorize(scope="read write").status_code, 200)
+
+    def test_revoking_the_users_tokens_forgets_their_consent(self):
+        self.approve()
+        self.assertEqual(self.authorize().status_code, 302)
+        revoke_tokens(user=self.user)
+        self.assertEqual(self.authorize().status_code, 200)
+
+    def test_editing_the_application_asks_again(self):
+        self.approve()
+        self.assertEqual(self.authorize().status_code, 302)
+        self.web.name = "web (renamed)"
+        self.web.save()
+        self.assertEqual(self.authorize().status_code, 200)
+
+    @override_settings(OAUTH2_PROVIDER={**settings.OAUTH2_PROVIDER, "REQUEST_APPROVAL_PROMPT": "force"})
+    def test_force_prompt_always_asks(self):
+        self.approve()
+        self.assertEqual(self.authorize().status_code, 200)
+
+
+def concurrently(fn, calls):
+    """Run fn(i) for i in range(calls) from threads released together; {i: result or raised exception}."""
+    barrier = threading.Barrier(calls)
+    outcomes = {}
+
+    def call(i):
+        barrier.wait()
+        try:
+            outcomes[i] = fn(i)
+        except Exception as e:
+            outcomes[i] = e
+        finally:
+            connections.close_all()
+
+    # daemons: a caller stuck in the code under test fails the test instead of hanging the run
+    threads = [threading.Thread(target=call, args=(i,), daemon=True) for i in range(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    if any(thread.is_alive() for thread in threads):
+        raise AssertionError("a caller never returned")
+    return outcomes
+
+
+class GroupCommitTests(OAuthTestCase):
+    def minter(self, **options):
+        minter = TokenMinter(group_commit=True, **{"window": 0.5, **options})
+        self.batches = []
+        write = minter._write
+
+        def record(batch):
+            self.batches.append(len(batch))
+            write(batch)
+
+        minter._write = record
+        return minter
+
+    def test_concurrent_logins_share_one_batch(self):
+        minter = self.minter()
+        outcomes = concurrently(lambda i: minter.mint(self.user, self.app), 5)
+        self.assertEqual(self.batches, [5])
+        self.assertTrue(all(isinstance(pair, tuple) for pair in outcomes.values()), outcomes)
+        self.assertEqual(AccessToken.objects.count(), 5)
+        self.assertEqual(RefreshToken.objects.filter(access_token__isnull=False).count(), 5)
+
+    def test_a_full_batch_promotes_the_next_leader(self):
+        minter = self.minter(max_batch=2)
+        minter._write = lambda batch: self.batches.append(len(batch))
+        outcomes = concurrently(lambda i: minter.mint(self.user, self.app), 5)
+        self.assertEqual(self.batches, [2, 2, 1])
+        self.assertEqual(len(outcomes), 5)
+        self.assertFalse(minter._leader)
+        self.assertEqual(minter._pending, [])
+
+    def test_a_rejected_otp_fails_only_its_own_login(self):
+        minter = self.minter()
+        get_otp_store().issue(self.user, "123456")
+        codes = {0: "000000", 1: "123456"}
+        outcomes = concurrently(lambda i: minter.mint(self.user, self.app, otp=codes.get(i)), 4)
+        self.assertEqual(self.batches, [4])
+        self.assertIsInstance(outcomes[0], OTPRejected)
+        self.assertEqual(outcomes[0].code, "invalid_otp")
+        self.assertTrue(all(isinstance(outcomes[i], tuple) for i in (1, 2, 3)), outcomes)
+        self.assertEqual(AccessToken.objects.count(), 3)
+
+    def test_a_database_error_reaches_every_caller(self):
+        minter = self.minter()
+        # the same token value for every login: the batch INSERT violates the unique checksum
+        with mock.patch("users.token_minting.new_access_token", return_value="duplicate"):
+            outcomes = concurrently(lambda i: minter.mint(self.user, self.app), 3)
+        self.assertEqual(self.batches, [3])
+        self.assertTrue(all(isinstance(e, IntegrityError) for e in outcomes.values()), outcomes)
+        self.assertEqual(AccessToken.objects.count(), 0)
+
+
+class MemoryBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(ratelimit.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retry_after_counts_until_the_next_token(self):
+        backend = MemoryBackend()
+        self.assertEqual([backend.hit("k", 2, 60) for _ in range(3)], [0, 0, 30])
+        self.now += 29
+        self.assertEqual(backend.peek("k", 2, 60), 1)
+        self.now += 1
+        self.assertEqual(backend.hit("k", 2, 60), 0)
+
+    def test_a_short_rule_does_not_refill_a_long_one(self):
+        backend = MemoryBackend(max_entries=3)
+        backend.hit("ip:10.0.0.1", 60, 60)
+        backend.hit("ip:10.0.0.2", 60, 60)
+        backend.hit("username:alice", 1, 600)
+        self.now += 61
+        # the full table drops the one-minute ip buckets; alice stays locked for her own ten minutes
+        backend.hit("ip:10.0.0.3", 60, 60)
+        self.assertEqual(list(backend._buckets), ["username:alice", "ip:10.0.0.3"])
+        self.assertEqual(backend.peek("username:alice", 1, 600), 539)
+
+    def test_size_is_capped_by_dropping_the_least_recently_used(self):
+        backend = MemoryBackend(max_entries=3)
+        for key in "abcd":
+            backend.hit(key, 1, 60)
+        backend.hit("b", 1, 60)
+        backend.hit("e", 1, 60)
+        self.assertEqual(list(backend._buckets), ["d", "b", "e"])
+
+
+class RateLimitTests(OAuthTestCase):
+    def setUp(self):
+        super().setUp()
+        for name, value in {"enabled": True, "backend": MemoryBackend(),
+                            "rules": {"token": {"username": (3, 60), "ip": (20, 60)}},
+                            "failures_only": {"token": frozenset({"username"})}}.items():
+            patcher = mock.patch.object(limiter, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_exceeding_a_limit_answers_429_with_retry_after(self):
+        for _ in range(3):
+            self.assertEqual(self.token(grant_type="password", username="nobody", password="x").status_code, 400)
+        response = self.token(grant_type="password", username="nobody", password="x")
+        self.assertEqual(response.status_code, 429)
+        # one attempt back every 60/3 seconds
+        self.assertEqual(response["Retry-After"], "20")
+        self.assertEqual(response.json(), {"error": "rate_limited", "retry_after": 20})
+
+    def test_only_failed_attempts_count_against_a_username(self):
+        for _ in range(4):
+            self.login()
+        for _ in range(3):
+            self.assertEqual(self.token(grant_type="password", username="alice", password="bad").status_code, 400)
+        # locked out now, even with the right password; the ip limit is not reached yet
+        self.assertEqual(self.token(grant_type="password", username="alice", password="pw").status_code, 429)
+        self.assertNotEqual(self.token(grant_type="password", username="bob", password="pw").status_code, 429)
+
+
+class ApplicationRegistryTests(OAuthTestCase):
+    def test_lookups_are_cached_until_an_application_changes(self):
+        self.assertEqual(app_registry.get(self.app.client_id).pk, self.app.pk)
+        with CaptureQueriesContext(connection) as captured:
+            app_registry.get(self.app.client_id)
+        self.assertEqual(len(captured), 0)
+        self.app.name = "renamed"
+        self.app.save()
+        self.assertEqual(app_registry.get(self.app.client_id).name, "renamed")
+
+    def test_a_deleted_client_is_rejected_at_once(self):
+        self.login()
+        self.app.delete()
+        self.assertIsNone(app_registry.get(self.app.client_id))
+        self.assertEqual(self.token(grant_type="password", username="alice", password="pw").status_code, 401)
+
+
+class UserClaimsTests(OAuthTestCase):
+    def userinfo(self, access_token, **headers):
+        return self.client.get("/api/userinfo/", HTTP_AUTHORIZATION=f"Bearer {access_token}", **headers)
+
+    def test_unchanged_claims_answer_304(self):
+        access_token = self.login()["access_token"]
+        response = self.userinfo(access_token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.userinfo(access_token, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_a_user_change_invalidates_the_claims_and_etag(self):
+        access_token = self.login()["access_token"]
+        etag = self.userinfo(access_token)["ETag"]
+        self.user.email = "alice@example.org"
+        self.user.save()
+        response = self.userinfo(access_token, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["email"], "alice@example.org")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_a_group_change_invalidates_the_claims(self):
+        access_token = self.login()["access_token"]
+        self.assertEqual(claims_cache.get(self.user.pk)[0]["groups"], [])
+        etag = self.userinfo(access_token)["ETag"]
+        group = Group.objects.create(name="admins")
+        self.user.groups.add(group)
+        self.assertEqual(claims_cache.get(self.user.pk)[0]["groups"], ["admins"])
+        self.assertEqual(self.userinfo(access_token, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        group.name = "ops"
+        group.save()
+        self.assertEqual(claims_cache.get(self.user.pk)[0]["groups"], ["ops"])
+
+
+class SigningKeysMixin:
+    """An empty, private keys directory for users.jwt_tokens.key_store; add_key() creates a signing key."""
+
+    def setUp(self):
+        super().setUp()
+        keys_dir = tempfile.mkdtemp(prefix="jwt-keys-")
+        self.addCleanup(shutil.rmtree, keys_dir)
+        for name, value in {"keys_dir": Path(keys_dir), "active_kid": None}.items():
+            patcher = mock.patch.object(key_store, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        key_store.reload()
+        self.addCleanup(key_store.reload)
+
+    def add_key(self):
+        return key_store.generate()
+
+
+@override_settings(JWT_ACCESS_TOKENS={**settings.JWT_ACCESS_TOKENS, "CLIENT_IDS": ["*"]})
+class JWTAccessTokenTests(SigningKeysMixin, OAuthTestCase):
+    def published_keys(self):
+        response = self.client.get("/o/.well-known/jwks.json")
+        self.assertEqual(response.status_code, 200)
+        return jwk.JWKSet.from_json(response.content)
+
+    def test_access_token_verifies_against_the_published_jwks(self):
+        kid = self.add_key()
+        access_token = self.login()["access_token"]
+        self.assertEqual(jwt.JWT(jwt=access_token).token.jose_header["kid"], kid)
+        claims = decode_access_token(access_token, keyset=self.published_keys())
+        self.assertEqual(claims["sub"], str(self.user.pk))
+        self.assertEqual(claims["client_id"], self.app.client_id)
+        self.assertEqual(claims["username"], "alice")
+        header, payload, signature = access_token.split(".")
+        self.assertIsNone(decode_access_token(f"{header}.{payload}.{signature[::-1]}", keyset=self.published_keys()))
+
+    def test_tokens_signed_before_a_rotation_keep_verifying(self):
+        self.add_key()
+        old = self.login()["access_token"]
+        self.add_key()
+        new = self.login()["access_token"]
+        keyset = self.published_keys()
+        self.assertEqual(len(keyset["keys"]), 2)
+        self.assertIsNotNone(decode_access_token(old, keyset=keyset))
+        self.assertIsNotNone(decode_access_token(new, keyset=keyset))
+        for token in (old, new):
+            response = self.client.get("/api/userinfo/", HTTP_AUTHORIZATION=f"Bearer {token}")
+            self.assertEqual(response.status_code, 200)
+
+
+class IntrospectionTests(OAuthTestCase):
+    def setUp(self):
+        super().setUp()
+        credentials = base64.b64encode(f"{self.app.client_id}:s3cret".encode()).decode()
+        self.auth = {"HTTP_AUTHORIZATION": f"Basic {credentials}"}
+
+    def introspect(self, **data):
+        return self.client.post("/o/introspect/", data, **self.auth)
+
+    def test_batch_reports_each_token_in_one_query(self):
+        User.objects.create_user("bob", password="pw")
+        live = [self.login()["access_token"], self.login("bob")["access_token"], self.login()["access_token"]]
+        revoked = self.login("bob")["access_token"]
+        AccessToken.objects.get(token=revoked).delete()
+        expired = self.login()["access_token"]
+        AccessToken.objects.filter(token=expired).update(expires=timezone.now() - timedelta(seconds=1))
+        # client authentication and the application are cached after the first call
+        self.assertEqual(self.introspect(token=live[0]).status_code, 200)
+        tokens = [live[0], revoked, live[1], "unknown", expired, live[2]]
+        with CaptureQueriesContext(connection) as captured:
+            response = self.introspect(tokens=tokens)
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([r["active"] for r in results], [True, False, True, False, False, True])
+        self.assertEqual([r.get("username") for r in results[::2]], ["alice", "bob", None])
+        self.assertEqual(results[2]["client_id"], self.app.client_id)
+        self.assertEqual(len(captured), 1, "\n".join(q["sql"] for q in captured))
+        with CaptureQueriesContext(connection) as captured:
+            self.introspect(tokens=tokens * 50)
+        self.assertEqual(len(captured), 1)
+
+    def test_single_token_answers_without_results_list(self):
+        access_token = self.login()["access_token"]
+        body = self.introspect(token=access_token).json()
+        self.assertTrue(body["active"])
+        self.assertEqual(body["sub"], str(self.user.pk))
+        self.assertEqual(self.introspect(token="unknown").json(), {"active": False})
+
+    def test_unauthenticated_and_oversized_batches_are_refused(self):
+        self.assertEqual(self.client.post("/o/introspect/", {"token": "x"}).status_code, 401)
+        with override_settings(INTROSPECTION={**settings.INTROSPECTION, "MAX_BATCH": 2}):
+            self.assertEqual(self.introspect(tokens=["a", "b", "c"]).status_code, 400)
+
+
+class PurgeTests(OAuthTestCase):
+    def create_tokens(self, prefix, count, expires):
+        return [AccessToken.objects.create(user=self.user, application=self.app, token=f"{prefix}-{i}",
+                                           scope="read", expires=expires).pk for i in range(count)]
+
+    def test_deletes_dead_rows_in_batches_and_keeps_live_ones(self):
+        now = timezone.now()
+        expired = self.create_tokens("expired", 5, now - timedelta(hours=1))
+        live = self.create_tokens("live", 2, now + timedelta(hours=1))
+        tokens = self.login()
+        batches = []
+        with CaptureQueriesContext(connection) as captured:
+            stats = purge_expired(batch_size=2, only=["expired_access_tokens"],
+                                  progress=lambda name, target: batches.append(target["deleted"]))
+        self.assertEqual(stats["expired_access_tokens"]["deleted"], 5)
+        self.assertEqual(stats["expired_access_tokens"]["batches"], 3)
+        self.assertEqual(batches, [2, 4, 5])
+        # one short DELETE per batch, not one for the whole table
+        deletes = [q["sql"] for q in captured if q["sql"].startswith('DELETE FROM "oauth2_provider_accesstoken"')]
+        self.assertEqual(len(deletes), 3)
+        self.assertFalse(AccessToken.objects.filter(pk__in=expired).exists())
+        self.assertEqual(AccessToken.objects.filter(pk__in=live).count(), 2)
+        self.assertTrue(AccessToken.objects.filter(token=tokens["access_token"]).exists())
+        self.assertTrue(RefreshToken.objects.filter(token=tokens["refresh_token"]).exists())
+
+    def test_interrupted_run_continues_where_it_stopped(self):
+        self.create_tokens("expired", 3, timezone.now() - timedelta(hours=1))
+        stats = purge_expired(batch_size=2, max_batches=1, only=["expired_access_tokens"])
+        self.assertEqual(stats["expired_access_tokens"]["deleted"], 2)
+        self.assertEqual(AccessToken.objects.count(), 1)
+        stats = purge_expired(batch_size=2, only=["expired_access_tokens"])
+        self.assertEqual(stats["expired_access_tokens"]["deleted"], 1)
+        self.assertFalse(AccessToken.objects.exists())
+
+
+class BulkTokenTests(OAuthTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ("bob", "carol"):
+            User.objects.create_user(name, password="pw")
+
+    def bulk(self, users):
+        return self.client.post("/api/token/bulk/", json.dumps({"users": users}), content_type="application/json",
+                                HTTP_X_SERVICE_KEY=settings.SERVICE_API_KEY)
+
+    def test_streams_one_line_per_user_in_request_order(self):
+        users = [{"username": "bob", "password": "pw"}, {"username": "alice", "password": "wrong"},
+                 {"username": "nobody", "password": "pw"}, {"username": "carol", "password": "pw"}]
+        response = self.bulk(users)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([line["username"] for line in lines], ["bob", "alice", "nobody", "carol"])
+        self.assertEqual([line.get("error") for line in lines], [None, "invalid_credentials", "invalid_credentials", None])
+        for line in (lines[0], lines[3]):
+            self.assertTrue(AccessToken.objects.filter(token=line["access_token"], application=self.app).exists())
+            self.assertTrue(RefreshToken.objects.filter(token=line["refresh_token"]).exists())
+
+    def test_first_chunk_is_sent_before_the_rest_is_issued(self):
+        users = [{"username": name, "password": "pw"} for name in ("alice", "bob", "carol")]
+        with mock.patch("users.token_endpoints.issue_tokens_bulk", lambda items, app: issue_tokens_bulk(items, app, chunk_size=2)):
+            content = iter(self.bulk(users).streaming_content)
+            self.assertEqual(json.loads(next(content))["username"], "alice")
+            self.assertEqual(AccessToken.objects.count(), 2)
+            self.assertEqual(len(list(content)), 2)
+        self.assertEqual(AccessToken.objects.count(), 3)
+
+    def test_requires_the_service_key(self):
+        response = self.client.post("/api/token/bulk/", json.dumps({"users": []}), content_type="application/json")
+        self.assertEqual(response.status_code, 401)
+
+
+class PasswordPipelineTests(OAuthTestCase):
+    def test_saturated_pool_answers_503_with_retry_after(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(password_pipeline, "_slots", slots), \
+                mock.patch.object(password_pipeline, "wait_seconds", 0.01):
+            responses = [
+                self.token(grant_type="password", username="alice", password="pw"),
+                self.client.post("/api/token/password/", {"username": "alice", "password": "pw"},
+                                 HTTP_X_SERVICE_KEY=settings.SERVICE_API_KEY),
+            ]
+        for response in responses:
+            self.assertEqual(response.status_code, 503, response.content)
+            self.assertEqual(response.json()["error"], "temporarily_unavailable")
+            self.assertEqual(response["Retry-After"], "1")
+        # not remembered as a failed password once the pool drains
+        self.login()
+
+    @override_settings(PASSWORD_HASHERS=FAST_HASHERS + ["django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher"])
+    def test_legacy_hash_is_upgraded_after_login(self):
+        self.user.password = get_hasher("pbkdf2_sha1").encode("pw", "legacysalt", iterations=1000)
+        self.user.save(update_fields=["password"])
+        self.login()
+        self.user.refresh_from_db()
+        self.assertEqual(identify_hasher(self.user.password).algorithm, "md5")
+        self.assertTrue(self.user.check_password("pw"))
+        self.login()
+
+
+class OIDCTests(SigningKeysMixin, AuthorizeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.web.algorithm = Application.RS256_ALGORITHM
+        self.web.save(update_fields=["algorithm"])
+        self.user.role = "admin"
+        self.user.save(update_fields=["role"])
+
+    def test_id_token_carries_the_role_claim(self):
+        kid = self.add_key()
+        response = self.exchange(self.approve(scope="openid read", nonce="n-1"))
+        self.assertEqual(response.status_code, 200, response.content)
+        published = jwk.JWKSet.from_json(self.client.get("/o/.well-known/jwks.json").content)
+        id_token = jwt.JWT(jwt=response.json()["id_token"], key=published)
+        self.assertEqual(id_token.token.jose_header["kid"], kid)
+        claims = json.loads(id_token.claims)
+        self.assertEqual(claims["sub"], str(self.user.pk))
+        self.assertEqual(claims["aud"], self.web.client_id)
+        self.assertEqual(claims["nonce"], "n-1")
+        self.assertEqual(claims["role"], "admin")
+        self.assertEqual(claims["preferred_username"], "alice")
+
+    def test_openid_request_without_a_signing_key_fails_cleanly(self):
+        with self.assertLogs("users.oauth_validators", "ERROR"):
+            response = self.exchange(self.approve(scope="openid read"))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()["error"], "server_error")
+        # the same client still gets plain bearer tokens without openid
+        self.assertEqual(self.exchange(self.approve(scope="read")).status_code, 200)
+
+
+class GrantStoreTests(AuthorizeTestCase):
+    store = DatabaseGrantStore
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("users.oauth_validators.get_grant_store", return_value=self.store(ttl_seconds=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertInvalidGrant(self, response):
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.json()["error"], "invalid_grant")
+
+    def test_code_is_redeemable_once(self):
+        code = self.approve()
+        self.assertEqual(self.exchange(code).status_code, 200)
+        self.assertInvalidGrant(self.exchange(code))
+        self.assertEqual(AccessToken.objects.filter(application=self.web).count(), 1)
+
+    def test_failed_pkce_check_burns_the_code(self):
+        code = self.approve()
+        self.assertInvalidGrant(self.exchange(code, verifier="w" * 43))
+        self.assertInvalidGrant(self.exchange(code))
+        self.assertFalse(AccessToken.objects.filter(application=self.web).exists())
+
+
+class CacheGrantStoreTests(GrantStoreTests):
+    store = CacheGrantStore
@@ -0,0 +1,118 @@
+# users/token_cache.py
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+def token_checksum(token):
+    # same digest DOT stores in AccessToken.token_checksum
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """
+    Two-tier cache of validated AccessToken rows (with user and application
+    already joined), keyed by token checksum.
+
+    Tier 1 is a bounded per-process LRU; tier 2 is an optional shared Django
+    cache. Entries never outlive the token itself. Invalidation deletes the
+    shared entry and this process's copy; other workers keep theirs for at
+    most `local_ttl` seconds, so that bounds how long they can still accept a
+    revoked token or serve a changed user.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300, local_ttl=2, shared_alias=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.shared_alias = shared_alias
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def _key(self, checksum):
+        return f"token_cache:at:{checksum}"
+
+    def get(self, token):
+        if not self.ttl:
+            return None
+        checksum = token_checksum(token)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(checksum)
+            if entry is not None:
+                blob, deadline = entry
+                if deadline > now:
+                    self._local.move_to_end(checksum)
+                    return pickle.loads(blob)
+                del self._local[checksum]
+
+        if self.shared is None:
+            return None
+        blob = self.shared.get(self._key(checksum))
+        if blob is None:
+            return None
+        access_token = pickle.loads(blob)
+        ttl = self._ttl_for(access_token)
+        if ttl <= 0:
+            return None
+        self._store_local(checksum, blob, now + min(ttl, self.local_ttl))
+        return access_token
+
+    def set(self, token, access_token):
+        ttl = self._ttl_for(access_token)
+        if ttl <= 0:
+            return
+        checksum = token_checksum(token)
+        blob = pickle.dumps(access_token, pickle.HIGHEST_PROTOCOL)
+        if self.shared is not None:
+            self.shared.set(self._key(checksum), blob, timeout=ttl)
+        self._store_local(checksum, blob, time.monotonic() + min(ttl, self.local_ttl))
+
+    def invalidate(self, *checksums):
+        """Drop the given token checksums from both tiers."""
+        checksums = [c for c in checksums if c]
+        if not checksums:
+            return
+        with self._lock:
+            for checksum in checksums:
+                self._local.pop(checksum, None)
+        if self.shared is not None:
+            self.shared.delete_many([self._key(c) for c in checksums])
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+    def _ttl_for(self, access_token):
+        if not access_token.expires:
+            return 0
+        remaining = (access_token.expires - timezone.now()).total_seconds()
+        return int(min(self.ttl, remaining))
+
+    def _store_local(self, checksum, blob, deadline):
+        with self._lock:
+            self._local[checksum] = (blob, deadline)
+            self._local.move_to_end(checksum)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+
+def _from_settings():
+    conf = getattr(settings, "TOKEN_CACHE", {})
+    return TokenCache(
+        max_entries=conf.get("MAX_ENTRIES", 10000),
+        ttl=conf.get("TTL_SECONDS", 300),
+        local_ttl=conf.get("LOCAL_TTL_SECONDS", 2),
+        shared_alias=conf.get("SHARED_CACHE_ALIAS"),
+    )
+
+
+token_cache = _from_settings()
@@ -1,24 +1,40 @@
 # users/token_endpoints.py
-import uuid
-from datetime import timedelta
+import json
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib.auth import authenticate, get_user_model
-from oauth2_provider.models import Application, AccessToken, RefreshToken
-from oauth2_provider.settings import oauth2_settings
-from django.utils import timezone
-from otp_grant.models import OTPCode 
+from .bulk_tokens import issue_tokens_bulk
+from .app_registry import app_registry
+from .auth_backends import HashingPoolSaturated
+from .metrics import count_token_requests
+from .ratelimit import ratelimit
+from .token_minting import OTPRejected, token_minter, token_payload
 
 SERVICE_KEY_HEADER = "HTTP_X_SERVICE_KEY"  # header name: X-Service-Key
+# a saturated hashing pool usually drains within a second
+HASHING_RETRY_AFTER_SECONDS = 1
+
+
+def has_service_key(request):
+    return request.META.get(SERVICE_KEY_HEADER) == getattr(settings, "SERVICE_API_KEY", None)
+
+
+def hashing_unavailable():
+    """503 for a login whose password could not be checked (HashingPoolSaturated): retry it, don't re-prompt."""
+    response = JsonResponse({"error": "temporarily_unavailable"}, status=503)
+    response["Retry-After"] = str(HASHING_RETRY_AFTER_SECONDS)
+    return response
 
 @csrf_exempt
+@count_token_requests("api/token/password", grant_type="password")
+@ratelimit("token_password")
 def token_by_password(request):
     """
     Secure server-side token issuance using username/password.
     Caller must provide header: X-Service-Key: <SERVICE_API_KEY>
     """
-    if request.META.get(SERVICE_KEY_HEADER) != getattr(settings, "SERVICE_API_KEY", None):
+    if not has_service_key(request):
         return JsonResponse({"error": "unauthorized"}, status=401)
     if request.method != "POST":
         return JsonResponse({"error": "method_not_allowed"}, status=405)
@@ -28,35 +44,27 @@ def token_by_password(request):
     if not username or not password:
         return JsonResponse({"error": "missing_credentials"}, status=400)
 
-    user = authenticate(username=username, password=password)
+    try:
+        user = authenticate(username=username, password=password)
+    except HashingPoolSaturated:
+        return hashing_unavailable()
     if user is None:
         return JsonResponse({"error": "invalid_credentials"}, status=400)
 
-    # Use a confidential Application (service app) to associate tokens with
-    app = Application.objects.filter(client_type=Application.CLIENT_CONFIDENTIAL).first()
+    # Service application to associate tokens with (SERVICE_APPLICATIONS, else first confidential app)
+    app = app_registry.service_application("token_by_password")
     if not app:
         return JsonResponse({"error": "no_service_app"}, status=500)
 
-    expires = timezone.now() + timedelta(seconds=oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)
-    access_token_str = uuid.uuid4().hex
-    access_token = AccessToken.objects.create(
-        user=user, scope="read", expires=expires, token=access_token_str, application=app
-    )
-    refresh_token = RefreshToken.objects.create(user=user, token=uuid.uuid4().hex, application=app, access_token=access_token)
-
-    return JsonResponse({
-        "access_token": access_token.token,
-        "refresh_token": refresh_token.token,
-        "token_type": "Bearer",
-        "expires_in": oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS,
-        "scope": access_token.scope,
-    })
+    return JsonResponse(token_payload(*token_minter.mint(user, app)))
 
 
 
 @csrf_exempt
+@count_token_requests("api/token/otp", grant_type="otp")
+@ratelimit("token_otp")
 def token_by_otp(request):
-    if request.headers.get("X-Service-Key") != getattr(settings, "SERVICE_API_KEY", None):
+    if not has_service_key(request):
         return JsonResponse({"error": "unauthorized"}, status=401)
     if request.method != "POST":
         return JsonResponse({"error": "method_not_allowed"}, status=405)
@@ -72,36 +80,45 @@ def token_by_otp(request):
     except User.DoesNotExist:
         return JsonResponse({"error": "no_user"}, status=400)
 
-    # ✅ Check OTP from DB
-    otp_qs = OTPCode.objects.filter(user=user, code=otp).order_by("-created")
-    if not otp_qs.exists():
-        return JsonResponse({"error": "invalid_otp"}, status=400)
+    app = app_registry.service_application("token_by_otp")
+    if not app:
+        return JsonResponse({"error": "no_service_app"}, status=500)
+
+    # ✅ The OTP is consumed in the same transaction as the token inserts, so it can't be reused
+    try:
+        tokens = token_minter.mint(user, app, otp=otp)
+    except OTPRejected as e:
+        return JsonResponse({"error": e.code}, status=400)
+    return JsonResponse(token_payload(*tokens))
 
-    otp_obj = otp_qs.first()
-    if not otp_obj.is_valid():
-        return JsonResponse({"error": "expired_otp"}, status=400)
 
-    # consume OTP so it can't be reused
-    otp_obj.delete()
+@csrf_exempt
+@count_token_requests("api/token/bulk", grant_type="password")
+def token_bulk(request):
+    """
+    Issue tokens for many users in one call.
+    Caller must provide header: X-Service-Key: <SERVICE_API_KEY>
+    Body (JSON): {"users": [{"username": "...", "password": "..."}, ...]}
+    Response: one JSON object per line (NDJSON), in request order.
+    """
+    if not has_service_key(request):
+        return JsonResponse({"error": "unauthorized"}, status=401)
+    if request.method != "POST":
+        return JsonResponse({"error": "method_not_allowed"}, status=405)
 
-    # ✅ Create token (same as before)
-    app = Application.objects.filter(client_type=Application.CLIENT_CONFIDENTIAL).first()
+    try:
+        items = json.loads(request.body)["users"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "invalid_request"}, status=400)
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return JsonResponse({"error": "invalid_request"}, status=400)
+    if len(items) > getattr(settings, "BULK_TOKEN_MAX_ITEMS", 50000):
+        return JsonResponse({"error": "too_many_items"}, status=400)
+
+    app = app_registry.service_application("token_bulk")
     if not app:
         return JsonResponse({"error": "no_service_app"}, status=500)
 
-    expires = timezone.now() + timedelta(seconds=oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS)
-    access_token_str = uuid.uuid4().hex
-    access_token = AccessToken.objects.create(
-        user=user, scope="read", expires=expires, token=access_token_str, application=app
-    )
-    refresh_token = RefreshToken.objects.create(
-        user=user, token=uuid.uuid4().hex, application=app, access_token=access_token
-    )
-
-    return JsonResponse({
-        "access_token": access_token.token,
-        "refresh_token": refresh_token.token,
-        "token_type": "Bearer",
-        "expires_in": oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS,
-        "scope": access_token.scope,
-    })
+    # results go out chunk by chunk while the rest are still being checked and written
+    results = issue_tokens_bulk(items, app)
+    return StreamingHttpResponse((json.dumps(r) + "\n" for r in results), content_type="application/x-ndjson")
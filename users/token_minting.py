@@ -0,0 +1,163 @@
+# users/token_minting.py
+import threading
+import uuid
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from oauth2_provider.models import AccessToken, RefreshToken
+from oauth2_provider.settings import oauth2_settings
+from otp_grant.backends import VALID, get_otp_store
+from .db_router import shard_for_user
+from .jwt_tokens import new_access_token, new_opaque_token
+
+
+def _conf():
+    return getattr(settings, "TOKEN_MINTING", {})
+
+
+class OTPRejected(Exception):
+    """The OTP did not verify; `code` is the otp_grant.backends result (invalid_otp, expired_otp)."""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class _Pending:
+    __slots__ = ("access_token", "refresh_token", "otp", "error", "lead", "done")
+
+    def __init__(self, access_token, refresh_token, otp):
+        self.access_token, self.refresh_token, self.otp = access_token, refresh_token, otp
+        self.error = None
+        self.lead = False
+        self.done = threading.Event()
+
+
+class TokenMinter:
+    """
+    Writes token pairs, optionally redeeming an OTP first, in one transaction:
+    one commit per login instead of one per statement.
+
+    With group_commit, pairs submitted by concurrent requests within
+    `window` seconds are written together by whichever request arrived first:
+    one transaction, one multi-row INSERT per table, one commit for the lot.
+    The other requests wait for it (at most window plus the write).
+    """
+
+    def __init__(self, group_commit=False, window=0.005, max_batch=100):
+        self.group_commit = group_commit
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._leader = False
+        self._cond = threading.Condition()
+
+    def mint(self, user, application, scope="read", otp=None):
+        """New saved (access_token, refresh_token) for the custom token endpoints; raises OTPRejected."""
+        expires_in = oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS
+        access_token = AccessToken(
+            user=user, scope=scope, expires=timezone.now() + timedelta(seconds=expires_in), application=application,
+            token=new_access_token(application, user, scope, expires_in),
+        )
+        refresh_token = RefreshToken(user=user, token=new_opaque_token(user), application=application,
+                                     token_family=uuid.uuid4())
+        self.save(access_token, refresh_token, otp=(user, otp) if otp else None)
+        return access_token, refresh_token
+
+    async def amint(self, user, application, scope="read", otp=None):
+        # own thread per call: with the shared thread_sensitive executor, concurrent requests could not join a group
+        return await sync_to_async(self.mint, thread_sensitive=False)(user, application, scope, otp)
+
+    def save(self, access_token, refresh_token, otp=None):
+        """Insert an unsaved pair; `otp` is a (user, code) to consume in the same transaction."""
+        pending = _Pending(access_token, refresh_token, otp)
+        if not self.group_commit:
+            self._write([pending])
+        else:
+            self._submit(pending)
+        if pending.error is not None:
+            raise pending.error
+
+    def _submit(self, pending):
+        with self._cond:
+            self._pending.append(pending)
+            self._cond.notify_all()
+            lead, self._leader = not self._leader, True
+        while not lead:
+            pending.done.wait()
+            if pending.lead is None:
+                return
+            # promoted: the previous leader left this one at the head of the queue
+            pending.done.clear()
+            lead = True
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._pending) >= self.max_batch, timeout=self.window)
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if self._pending:
+                self._pending[0].lead = True
+                self._pending[0].done.set()
+            else:
+                self._leader = False
+        try:
+            self._write(batch)
+        finally:
+            for item in batch:
+                item.lead = None
+                item.done.set()
+
+    def _write(self, batch):
+        # one transaction per token shard the batch touches (a single one without TOKEN_SHARDS)
+        shards = {}
+        for item in batch:
+            shards.setdefault(shard_for_user(item.access_token.user_id), []).append(item)
+        for db, items in shards.items():
+            self._write_shard(db, items)
+
+    def _write_shard(self, db, batch):
+        try:
+            with transaction.atomic(using=db):
+                for item in batch:
+                    if item.otp is not None:
+                        result = get_otp_store().consume(*item.otp)
+                        if result != VALID:
+                            item.error = OTPRejected(result)
+                written = [item for item in batch if item.error is None]
+                if len(written) == 1:
+                    written[0].access_token.save(using=db)
+                else:
+                    AccessToken.objects.using(db).bulk_create([item.access_token for item in written])
+                for item in written:
+                    item.refresh_token.access_token = item.access_token
+                if len(written) == 1:
+                    written[0].refresh_token.save(using=db)
+                else:
+                    RefreshToken.objects.using(db).bulk_create([item.refresh_token for item in written])
+        except Exception as e:
+            # save() re-raises it in each caller's thread
+            for item in batch:
+                item.error = item.error or e
+
+
+def token_payload(access_token, refresh_token):
+    """Response body of the custom token endpoints."""
+    return {
+        "access_token": access_token.token,
+        "refresh_token": refresh_token.token,
+        "token_type": "Bearer",
+        "expires_in": oauth2_settings.ACCESS_TOKEN_EXPIRE_SECONDS,
+        "scope": access_token.scope,
+    }
+
+
+def _from_settings():
+    conf = _conf()
+    return TokenMinter(
+        group_commit=conf.get("GROUP_COMMIT", False),
+        window=conf.get("GROUP_COMMIT_WINDOW_MS", 5) / 1000,
+        max_batch=conf.get("GROUP_COMMIT_MAX_BATCH", 100),
+    )
+
+
+token_minter = _from_settings()
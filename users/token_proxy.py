@@ -1,32 +1,50 @@
 # users/token_proxy.py
-from django.views.decorators.csrf import csrf_exempt
-from oauth2_provider.views import TokenView
+import json
+from django.http import HttpResponse
 from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.debug import sensitive_post_parameters
+from oauth2_provider import views
+from oauth2_provider.models import AccessToken
+from oauth2_provider.signals import app_authorized
+from .auth_backends import HashingPoolSaturated
+from .db_router import shard_for_token
+from .metrics import count_token_requests
+from .ratelimit import ratelimit
+from .token_cache import token_checksum
+from .token_endpoints import hashing_unavailable
+
+
+class TokenView(views.TokenView):
+    """DOT's TokenView, reading the issued token back for app_authorized from its token shard."""
+
+    @method_decorator(sensitive_post_parameters("password", "client_secret"))
+    def authorization_flow_token_response(self, request, *args, **kwargs):
+        url, headers, body, status = self.create_token_response(request)
+        if status == 200:
+            access_token = json.loads(body).get("access_token")
+            if access_token is not None:
+                token = AccessToken.objects.using(shard_for_token(access_token)).get(
+                    token_checksum=token_checksum(access_token))
+                app_authorized.send(sender=self, request=request, token=token)
+        # token responses are JSON; an OAuth2Error raised past the grant (finalize_id_token) comes without the header
+        response = HttpResponse(content=body, status=status, content_type="application/json")
+        for k, v in headers.items():
+            response[k] = v
+        return response
 
+
+_token_view = TokenView.as_view()
+
+
+# OTP guesses get the tighter per-username limit of the service OTP endpoint
 @csrf_exempt
+@count_token_requests("o/token")
+@ratelimit(lambda request: "token_otp" if request.POST.get("grant_type") == "otp" else "token")
 def token_proxy(request, *args, **kwargs):
-    """
-    If incoming POST has grant_type=otp, rewrite it into a password grant
-    where password=<otp>. Keep the 'otp' field as well.
-    Then delegate to DOT's TokenView.
-    """
-    if request.method == "POST":
-        try:
-            # request.POST is a QueryDict (immutable) — make a mutable copy
-            pd = request.POST.copy()
-            if pd.get("grant_type") == "otp":
-                otp_val = pd.get("otp") or pd.get("password")
-                if otp_val:
-                    # put OTP into password so oauthlib handles it via password grant
-                    pd["password"] = otp_val
-                    pd["grant_type"] = "password"
-                    # assign back to request so TokenView sees modified data
-                    request._post = pd
-                    request._files = request.FILES
-        except Exception:
-            # if anything goes wrong, we still fall back to TokenView
-            pass
-
-    # Delegate to DOT TokenView (this will handle password, client_credentials, auth_code etc.)
-    view = TokenView.as_view()
-    return view(request, *args, **kwargs)
+    """DOT's TokenView; grant_type=otp is served by otp_grant.server's OTPGrant."""
+    try:
+        return _token_view(request, *args, **kwargs)
+    except HashingPoolSaturated:
+        # password grant: authenticate() could not get a hashing slot
+        return hashing_unavailable()
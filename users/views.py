@@ -1,57 +1,212 @@
+import json
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from oauth2_provider.models import AccessToken, RefreshToken
-from django.utils import timezone
+from django.conf import settings
 from django.contrib.auth import logout
-from .serializers import UserSerializer
+from django.db import router
+from django.http import JsonResponse, StreamingHttpResponse
+from oauth2_provider.exceptions import OAuthToolkitError
+from oauth2_provider.settings import oauth2_settings
+from oauth2_provider.views import AuthorizationView
+from oauth2_provider.views.oidc import ConnectDiscoveryInfoView
+from .app_registry import app_registry
+from .consent import consent_cache
+from .claims import claims_cache, not_modified, profile, set_cache_headers, userinfo
 from .models import User
+from .jwt_tokens import key_store
+from .introspection import authenticate_client, cache_max_age, introspect_tokens, load_active_tokens
+from .token_cache import token_checksum
+from .db_router import read_replica, shard_for_user, token_shard
+from .db_metrics import pool_stats
+from .revocation import revoke_tokens
+from .token_endpoints import has_service_key
+
+def _claims_response(request, shape):
+    entry = claims_cache.get(request.user.pk)
+    if entry is None:
+        return Response({'detail': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    claims, etag = entry
+    if not_modified(request, etag):
+        return set_cache_headers(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+    return set_cache_headers(Response(shape(claims)), etag)
 
 class UserInfoView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
-        serializer = UserSerializer(request.user)
-        return Response(serializer.data)
+        return _claims_response(request, userinfo)
 
 class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     def post(self, request):
-        AccessToken.objects.filter(user=request.user).delete()
-        RefreshToken.objects.filter(user=request.user).delete()
+        revoke_tokens(user=request.user)
         logout(request)
         return Response({'detail':'Logged out and tokens revoked'}, status=status.HTTP_200_OK)
 
+ROLE_LIST_CHUNK = 1000
+
+def _role_rows(db, after, limit=None):
+    # keyset pagination on the primary key: each chunk is an index range scan, never an OFFSET
+    while limit is None or limit > 0:
+        size = ROLE_LIST_CHUNK if limit is None else min(limit, ROLE_LIST_CHUNK)
+        chunk = list(User.objects.using(db).filter(pk__gt=after).order_by('pk')
+                     .values_list('id', 'username', 'role')[:size])
+        yield from ({'id': pk, 'username': username, 'role': role} for pk, username, role in chunk)
+        if len(chunk) < size:
+            return
+        after = chunk[-1][0]
+        if limit is not None:
+            limit -= size
+
+def _stream_json_array(rows):
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(row)
+    yield ']'
+
 class RoleListView(APIView):
+    """
+    Users with their role, ordered by id. ?after=<id>&limit=<n> returns one
+    page with a Link rel="next" header; without limit, every user after
+    `after` is streamed in chunks of ROLE_LIST_CHUNK rows.
+    """
     permission_classes = [permissions.IsAuthenticated]
+    @read_replica
     def get(self, request):
         if getattr(request.user, 'role', None) != 'admin':
             return Response({'detail':'Forbidden'}, status=status.HTTP_403_FORBIDDEN)
-        users = User.objects.all()
-        data = [{'id':u.id,'username':u.username,'role':u.role} for u in users]
-        return Response(data)
-
-
+        try:
+            after = int(request.GET.get('after', 0))
+            limit = int(request.GET['limit']) if 'limit' in request.GET else None
+        except ValueError:
+            return Response({'detail': 'after and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        # the stream is consumed after this handler returns, outside read_replica: pin its database now
+        db = router.db_for_read(User)
+        if limit is None:
+            return StreamingHttpResponse(_stream_json_array(_role_rows(db, after)), content_type='application/json')
+        limit = max(1, min(limit, ROLE_LIST_CHUNK))
+        rows = list(_role_rows(db, after, limit + 1))
+        response = Response(rows[:limit])
+        if len(rows) > limit:
+            next_url = request.build_absolute_uri(f"{request.path}?after={rows[limit - 1]['id']}&limit={limit}")
+            response['Link'] = f'<{next_url}>; rel="next"'
+        return response
 
 class ProfileView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     def get(self, request):
-        user = request.user
-        return Response({
-            "username": user.username,
-            "email": user.email,
-            "is_staff": user.is_staff,
-            "roles": [g.name for g in user.groups.all()],
-        })
+        return _claims_response(request, profile)
+def _public_cache_headers(response):
+    max_age = oauth2_settings.OIDC_JWKS_MAX_AGE_SECONDS
+    response['Cache-Control'] = f'public, max-age={max_age}, stale-while-revalidate={max_age}'
+    response['Access-Control-Allow-Origin'] = '*'
+    return response
+
+class JWKSView(APIView):
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    def get(self, request):
+        return _public_cache_headers(Response(key_store.jwks()))
+
+class OIDCDiscoveryView(ConnectDiscoveryInfoView):
+    """DOT's discovery document with the algorithms key_store signs with; its jwks_uri is routed to JWKSView."""
+    def get(self, request, *args, **kwargs):
+        data = json.loads(super().get(request, *args, **kwargs).content)
+        data['id_token_signing_alg_values_supported'] = sorted({key.get('alg') for key in key_store.keys})
+        return _public_cache_headers(JsonResponse(data))
+
+class AuthorizeView(AuthorizationView):
+    """
+    DOT's /o/authorize/ with a fast path for repeat logins: when the
+    application skips authorization, or approval_prompt is auto and the user
+    already approved these scopes (users.consent), the code is issued without
+    DOT's Application and AccessToken queries or rendering the consent page.
+    """
+    def get(self, request, *args, **kwargs):
+        prompt = request.GET.get('prompt', '').split()
+        # prompt handling and RFC 8707 resources stay with DOT
+        if 'login' in prompt or 'create' in prompt or 'resource' in request.GET:
+            return self._dot_get(request, *args, **kwargs)
+        try:
+            scopes, credentials = self.validate_authorization_request(request)
+        except OAuthToolkitError as error:
+            return self.error_response(error, application=None)
+        application = app_registry.get(credentials['client_id'])
+        auto = request.GET.get('approval_prompt', oauth2_settings.REQUEST_APPROVAL_PROMPT) == 'auto'
+        if not application.skip_authorization and not (auto and consent_cache.allows(request.user.pk, application, scopes)):
+            return self._dot_get(request, *args, **kwargs)
+        self.approved = True
+        if isinstance(credentials.get('ui_locales'), list):
+            credentials['ui_locales'] = ' '.join(credentials['ui_locales'])
+        try:
+            uri, headers, body, status = self.create_authorization_response(
+                request=request, scopes=' '.join(scopes), credentials=credentials, allow=True)
+        except OAuthToolkitError as error:
+            return self.error_response(error, application)
+        return self.redirect(uri, application)
+
+    def _dot_get(self, request, *args, **kwargs):
+        # DOT's approval_prompt=auto scan reads the user's AccessTokens: on their token shard
+        with token_shard(shard_for_user(request.user.pk)):
+            return super().get(request, *args, **kwargs)
+
+    def create_authorization_response(self, request, scopes, credentials, allow):
+        # approvals from the consent form and from DOT's token scan land here (a denial raises)
+        response = super().create_authorization_response(request, scopes, credentials, allow)
+        application = app_registry.get(credentials['client_id'])
+        if not getattr(self, 'approved', False) and not application.skip_authorization:
+            consent_cache.remember(request.user.pk, application, scopes.split())
+        return response
+
+class DBPoolStatsView(APIView):
+    """Per-process connection reuse and pool stats. Requires X-Service-Key."""
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    def get(self, request):
+        if not has_service_key(request):
+            return Response({'error': 'unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+        return Response(pool_stats())
+
 class ValidateTokenView(APIView):
     permission_classes = [permissions.AllowAny]
+    @read_replica
     def post(self, request):
         token_value = request.data.get('token')
         if not token_value:
             return Response({'active': False, 'detail': 'No token provided'}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            t = AccessToken.objects.get(token=token_value)
-            if t.expires < timezone.now():
-                return Response({'active': False})
-            return Response({'active': True, 'user_id': t.user_id, 'username': t.user.username, 'scope': t.scope, 'expires': t.expires})
-        except AccessToken.DoesNotExist:
+        row = load_active_tokens([token_value]).get(token_checksum(token_value))
+        if row is None:
             return Response({'active': False})
+        return Response({'active': True, 'user_id': row['user_id'], 'username': row['user__username'], 'scope': row['scope'], 'expires': row['expires']})
+
+class IntrospectView(APIView):
+    """
+    RFC 7662 introspection for confidential clients (HTTP Basic or client_id/client_secret).
+    `token=...` returns a single response; `tokens=[...]` (JSON or repeated form field)
+    returns {"results": [...]} resolved with one query. Send `Cache-Control: max-age=N`
+    to ask how long the result may be cached; the response says what is allowed.
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    def post(self, request):
+        if authenticate_client(request) is None:
+            response = Response({'error': 'invalid_client'}, status=status.HTTP_401_UNAUTHORIZED)
+            response['WWW-Authenticate'] = 'Basic realm="introspect"'
+            return response
+        if 'tokens' in request.data:
+            tokens = request.data.getlist('tokens') if hasattr(request.data, 'getlist') else request.data['tokens']
+            if not isinstance(tokens, list) or not all(isinstance(t, str) for t in tokens):
+                return Response({'error': 'invalid_request'}, status=status.HTTP_400_BAD_REQUEST)
+            if len(tokens) > settings.INTROSPECTION['MAX_BATCH']:
+                return Response({'error': 'invalid_request', 'error_description': 'Too many tokens'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            results = introspect_tokens(tokens)
+            response = Response({'results': results})
+        else:
+            token_value = request.data.get('token')
+            if not token_value:
+                return Response({'error': 'invalid_request'}, status=status.HTTP_400_BAD_REQUEST)
+            results = introspect_tokens([token_value])
+            response = Response(results[0])
+        response['Cache-Control'] = f'private, max-age={cache_max_age(request, results)}'
+        return response